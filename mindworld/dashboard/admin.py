@@ -1,3 +1,22 @@
 from django.contrib import admin
+from .models import Server, ServerConfig, ServerStatusChange
 
-# Register your models here.
+
+class ServerConfigInline(admin.StackedInline):
+    model = ServerConfig
+    can_delete = False
+
+
+@admin.register(Server)
+class ServerAdmin(admin.ModelAdmin):
+    list_display = ('name', 'namespace', 'status', 'replicas', 'ready_replicas', 'hibernated', 'template', 'deleted_at')
+    list_filter = ('status', 'hibernated', 'namespace', 'template')
+    search_fields = ('name',)
+    inlines = [ServerConfigInline]
+
+
+@admin.register(ServerStatusChange)
+class ServerStatusChangeAdmin(admin.ModelAdmin):
+    list_display = ('server', 'status', 'replicas', 'ready_replicas', 'hibernated', 'changed_at')
+    list_filter = ('status',)
+    list_select_related = ('server',)
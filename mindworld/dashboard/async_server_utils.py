@@ -0,0 +1,76 @@
+"""Asyncio variants of the server_utils API for use from websocket consumers.
+
+Everything here is built on kubernetes_asyncio so that no call blocks the
+event loop. Lookups are answered from the shared informer caches when they
+are warm and fall back to a direct read otherwise; the node overview joins
+several caches and waits for them instead.
+"""
+import logging
+from asgiref.sync import sync_to_async
+from kubernetes_asyncio.client.rest import ApiException
+from . import server_utils
+from .kube_clients import DEFAULT_CLUSTER, get_async_registry
+from .console import open_console
+from . import node_overview
+from .server_utils import (
+    NAMESPACE, CONSOLE_BACKEND, get_statefulset_name, template_console_backend, hibernation_patch
+)
+
+logger = logging.getLogger(__name__)
+
+async def _get_warm_informer(factory, *args):
+    informer = await sync_to_async(factory, thread_sensitive=False)(*args)
+    return informer if informer.has_synced() else None
+
+async def list_kubernetes_nodes(cluster=DEFAULT_CLUSTER):
+    """List all Kubernetes nodes of ``cluster`` with their allocation and placed servers."""
+    # Joining nodes with pods needs the pod cache, so wait for it off the event loop
+    return await sync_to_async(node_overview.list_kubernetes_nodes, thread_sensitive=False)(cluster)
+
+async def scale_statefulset(namespace, name, replicas, cluster=DEFAULT_CLUSTER):
+    """Scale a StatefulSet, returning True on success."""
+    apps_api = await get_async_registry(cluster).apps_api()
+    try:
+        body = {'spec': {'replicas': replicas}}
+        await apps_api.patch_namespaced_stateful_set_scale(name, namespace, body)
+        logger.info(f"Scaled {name} to {replicas} replicas.")
+        return True
+    except ApiException as e:
+        logger.error(f"Exception when calling AppsV1Api->patch_namespaced_stateful_set_scale: {e}")
+        return False
+
+async def set_hibernated(namespace, name, hibernated, cluster=DEFAULT_CLUSTER):
+    """Mark or unmark a server as hibernated, returning True on success."""
+    apps_api = await get_async_registry(cluster).apps_api()
+    try:
+        await apps_api.patch_namespaced_stateful_set(name, namespace, hibernation_patch(hibernated))
+        return True
+    except ApiException as e:
+        logger.error(f"Exception when calling AppsV1Api->patch_namespaced_stateful_set: {e}")
+        return False
+
+async def console_backend_for(statefulset_name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Return the console backend a server was created with."""
+    informer = await _get_warm_informer(server_utils.get_statefulset_informer, cluster)
+    if informer is not None:
+        sts = informer.get(f"{namespace}/{statefulset_name}")
+    else:
+        apps_api = await get_async_registry(cluster).apps_api()
+        try:
+            sts = await apps_api.read_namespaced_stateful_set(statefulset_name, namespace)
+        except ApiException as e:
+            logger.error(f"Exception when calling AppsV1Api->read_namespaced_stateful_set: {e}")
+            sts = None
+    return template_console_backend(sts) if sts is not None else CONSOLE_BACKEND
+
+async def attach_to_console(pod_name, backend="screen", namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Attach to the Minecraft server console without blocking the event loop."""
+    try:
+        logger.info("Connecting to the Minecraft server console...")
+        console = await open_console(get_statefulset_name(pod_name), pod_name, backend, namespace, cluster)
+        logger.info("Console connection established.")
+        return console
+
+    except Exception as e:
+        logger.error(f"Error attaching to console: {e}")
+        raise
@@ -0,0 +1,691 @@
+"""Incremental, deduplicated backups of server data volumes.
+
+A backup lists the files on the volume and only reads the ones whose size
+or modification time changed since the previous snapshot, streamed out of
+the pod as one tar over exec. Files are cut into fixed-size chunks stored
+under their SHA-256, so a chunk that is already in the store (from an
+earlier snapshot, or another server running the same jar) is never
+uploaded again. Region files are rewritten in place sector by sector, so
+fixed-size chunks line up with what actually changed.
+
+A snapshot is a JSON manifest listing every file with its chunks. Restore
+rebuilds a tar stream from the manifest and extracts it straight into the
+volume. Running servers are quiesced with ``save-off``/``save-all flush``
+over the console; stopped servers and restores go through a short-lived
+pod that mounts the server's volume.
+
+Chunks and manifests go to BACKUP_TARGET: ``file:///path`` or
+``s3://bucket/prefix`` (with BACKUP_S3_ENDPOINT for MinIO and other
+S3-compatible stores; needs boto3).
+"""
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import tarfile
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from channels.layers import get_channel_layer
+from kubernetes_asyncio.client.rest import ApiException
+from .async_server_utils import console_backend_for, scale_statefulset
+from .console import open_console
+from .files import DATA_ROOT, ExecStream, PodRef, exec_with_stdin
+from .kube_clients import DEFAULT_CLUSTER, get_async_registry
+from .server_templates import MINECRAFT_IMAGE
+from .server_utils import CONTAINER_NAME, get_pod_name, is_managed_by_mindworld
+
+logger = logging.getLogger(__name__)
+
+BACKUP_TARGET = os.getenv('BACKUP_TARGET', 'file:///var/lib/mindworld/backups')
+BACKUP_S3_ENDPOINT = os.getenv('BACKUP_S3_ENDPOINT', '')
+BACKUP_CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_SIZE', str(1024 * 1024)))
+# Top-level entries of the volume that are neither backed up nor removed on restore.
+BACKUP_EXCLUDE = [entry for entry in os.getenv('BACKUP_EXCLUDE', 'logs,crash-reports,lost+found').split(',') if entry]
+# How long to wait for "save-all flush" to finish before giving up on a backup.
+BACKUP_SAVE_TIMEOUT = float(os.getenv('BACKUP_SAVE_TIMEOUT', '60'))
+BACKUP_CONCURRENCY = int(os.getenv('BACKUP_CONCURRENCY', '2'))
+# How long to wait for a server pod to stop or a volume pod to start.
+BACKUP_POD_TIMEOUT = 300
+# Changed files are read in tar batches whose argument lists stay below this many bytes.
+BACKUP_BATCH_BYTES = 32 * 1024
+BACKUP_JOB_HISTORY = 200
+
+SNAPSHOT_ID_RE = re.compile(r'\d{8}T\d{12}Z')
+SAVED_MESSAGES = ("Saved the game", "Saved the world")
+BLOCK = 512
+
+# find -printf format: size, mtime, mode and path relative to the volume, NUL terminated.
+_FILE_FORMAT = '%s\\t%T@\\t%m\\t%P\\0'
+
+
+class BackupError(Exception):
+    pass
+
+
+class LocalBackupStore:
+    """Backup objects as files under a local directory (or a mounted volume)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def list(self, prefix):
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f"{prefix.rstrip('/')}/{name}" for name in os.listdir(directory) if not name.endswith('.tmp'))
+
+
+class S3BackupStore:
+    """Backup objects in an S3-compatible bucket."""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise BackupError("S3 backup targets need boto3 to be installed.")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._s3 = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key):
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._s3.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, key, data):
+        self._s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key):
+        return self._s3.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+
+    def list(self, prefix):
+        keys = []
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix.rstrip('/') + '/')):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        return sorted(key[strip:] for key in keys)
+
+
+def get_backup_store(target=BACKUP_TARGET):
+    url = urlparse(target)
+    if url.scheme == 'file':
+        return LocalBackupStore(url.path)
+    if url.scheme == 's3':
+        return S3BackupStore(url.netloc, url.path, BACKUP_S3_ENDPOINT)
+    raise BackupError(f"Unsupported BACKUP_TARGET: {target}")
+
+
+def chunk_key(digest):
+    return f"chunks/{digest[:2]}/{digest}"
+
+
+def snapshot_prefix(namespace, name, cluster=DEFAULT_CLUSTER):
+    if cluster == DEFAULT_CLUSTER:
+        return f"snapshots/{namespace}/{name}"
+    return f"clusters/{cluster}/snapshots/{namespace}/{name}"
+
+
+def list_snapshots(store, namespace, name, cluster=DEFAULT_CLUSTER):
+    """Return the snapshot manifests of a server, newest first, without their file lists."""
+    snapshots = []
+    for key in reversed(store.list(snapshot_prefix(namespace, name, cluster))):
+        manifest = json.loads(store.get(key))
+        manifest.pop('files')
+        snapshots.append(manifest)
+    return snapshots
+
+
+def latest_snapshot(store, namespace, name, cluster=DEFAULT_CLUSTER):
+    """Return the newest snapshot manifest of a server, or None. Only that manifest is read."""
+    keys = store.list(snapshot_prefix(namespace, name, cluster))
+    return json.loads(store.get(keys[-1])) if keys else None
+
+
+def load_snapshot(store, namespace, name, snapshot_id, cluster=DEFAULT_CLUSTER):
+    if not SNAPSHOT_ID_RE.fullmatch(snapshot_id or ''):
+        return None
+    key = f"{snapshot_prefix(namespace, name, cluster)}/{snapshot_id}.json"
+    if not store.exists(key):
+        return None
+    return json.loads(store.get(key))
+
+
+class _ByteStream:
+    """Read exact byte counts from an async iterator of chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def read(self, size):
+        while len(self._buffer) < size and not self._eof:
+            try:
+                self._buffer.extend(await self._chunks.__anext__())
+            except StopAsyncIteration:
+                self._eof = True
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _padding(size):
+    return -size % BLOCK
+
+
+async def iter_tar(chunks):
+    """Yield ``(path, TarInfo, read)`` for the regular files of a tar stream.
+
+    ``read(n)`` returns the next part of the member's data. Whatever the
+    caller does not read is skipped.
+    """
+    stream = _ByteStream(chunks)
+    long_name = None
+    while True:
+        header = await stream.read(BLOCK)
+        if len(header) < BLOCK or header == bytes(BLOCK):
+            return
+        info = tarfile.TarInfo.frombuf(header, 'utf-8', 'surrogateescape')
+        if info.type == tarfile.GNUTYPE_LONGNAME:
+            long_name = (await stream.read(info.size + _padding(info.size)))[:info.size].rstrip(b'\0')
+            long_name = long_name.decode('utf-8', 'surrogateescape')
+            continue
+        if info.type == tarfile.XHDTYPE:
+            for record in (await stream.read(info.size + _padding(info.size)))[:info.size].split(b'\n'):
+                _, _, keyword = record.partition(b' ')
+                if keyword.startswith(b'path='):
+                    long_name = keyword[len(b'path='):].decode('utf-8', 'surrogateescape')
+            continue
+
+        path, long_name = long_name or info.name, None
+        remaining = info.size if info.isreg() else 0
+
+        async def read(size):
+            nonlocal remaining
+            data = await stream.read(min(size, remaining))
+            remaining -= len(data)
+            return data
+
+        if info.isreg():
+            yield path, info, read
+        while remaining:
+            await read(BACKUP_CHUNK_SIZE)
+        await stream.read(_padding(info.size) if info.size else 0)
+
+
+def tar_header(entry):
+    info = tarfile.TarInfo(entry['path'])
+    info.size = entry['size']
+    info.mtime = entry['mtime']
+    info.mode = entry['mode']
+    return info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def tar_size(files):
+    """Exact size of the tar stream ``snapshot_tar`` produces for ``files``."""
+    return sum(len(tar_header(entry)) + entry['size'] + _padding(entry['size']) for entry in files) + 2 * BLOCK
+
+
+async def snapshot_tar(store, files):
+    """Yield a tar stream of ``files`` rebuilt from their chunks."""
+    for entry in files:
+        yield tar_header(entry)
+        for digest in entry['chunks']:
+            data = await asyncio.to_thread(store.get, chunk_key(digest))
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise BackupError(f"Chunk {digest} of {entry['path']} is corrupt.")
+            yield data
+        yield bytes(_padding(entry['size']))
+    yield bytes(2 * BLOCK)
+
+
+class ChunkWriter:
+    """Cut file data into chunks and upload the ones the store does not have yet."""
+
+    def __init__(self, store, known=()):
+        self.store = store
+        self.known = set(known)
+        self.uploaded_chunks = 0
+        self.uploaded_bytes = 0
+        self.read_bytes = 0
+
+    async def write(self, data):
+        """Store one chunk and return its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        self.read_bytes += len(data)
+        if digest not in self.known:
+            if not await asyncio.to_thread(self.store.exists, chunk_key(digest)):
+                await asyncio.to_thread(self.store.put, chunk_key(digest), data)
+                self.uploaded_chunks += 1
+                self.uploaded_bytes += len(data)
+            self.known.add(digest)
+        return digest
+
+    async def store_tar(self, chunks):
+        """Store every regular file of a tar stream, returning ``{path: {size, mtime, mode, chunks}}``."""
+        stored = {}
+        async for path, info, read in iter_tar(chunks):
+            digests = []
+            while data := await read(BACKUP_CHUNK_SIZE):
+                digests.append(await self.write(data))
+            # What tar read wins over the listing if the file changed in between
+            stored[path] = {'size': info.size, 'mtime': int(info.mtime), 'mode': info.mode, 'chunks': digests}
+        # Read past tar's end-of-archive padding so the command can report its exit status
+        async for _ in chunks:
+            pass
+        return stored
+
+
+def _batches(paths):
+    batch, length = [], 0
+    for path in paths:
+        if batch and length + len(path) > BACKUP_BATCH_BYTES:
+            yield batch
+            batch, length = [], 0
+        batch.append(path)
+        length += len(path) + 1
+    if batch:
+        yield batch
+
+
+async def list_volume(pod):
+    """Return ``{path: {size, mtime, mode}}`` for the regular files on the volume."""
+    excluded = []
+    for entry in BACKUP_EXCLUDE:
+        excluded += ['-path', f"{DATA_ROOT}/{entry}", '-o']
+    command = ['find', DATA_ROOT, '-mindepth', '1']
+    if excluded:
+        command += ['('] + excluded[:-1] + [')', '-prune', '-o']
+    command += ['-type', 'f', '-printf', _FILE_FORMAT]
+
+    process = await ExecStream.open(pod, command)
+    output = await process.output()
+    if not process.succeeded:
+        raise BackupError(f"Could not list the volume: {process.error}")
+    files = {}
+    for record in output.split(b'\0'):
+        if record:
+            size, mtime, mode, path = record.decode('utf-8', 'surrogateescape').split('\t', 3)
+            files[path] = {'size': int(size), 'mtime': int(float(mtime)), 'mode': int(mode, 8)}
+    return files
+
+
+class BackupJob:
+    """Progress of one backup or restore: pending -> ... -> done (or failed)."""
+
+    def __init__(self, kind, namespace, name, snapshot_id=None, cluster=DEFAULT_CLUSTER):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.cluster = cluster
+        self.namespace = namespace
+        self.name = name
+        self.snapshot_id = snapshot_id
+        self.state = 'pending'
+        self.message = ''
+        self.stats = {}
+        self.updated_at = time.time()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'cluster': self.cluster,
+            'namespace': self.namespace,
+            'name': self.name,
+            'snapshot': self.snapshot_id,
+            'state': self.state,
+            'message': self.message,
+            'stats': self.stats,
+            'updated_at': self.updated_at
+        }
+
+    async def update(self, state, message=''):
+        self.state = state
+        self.message = message
+        self.updated_at = time.time()
+        logger.info(f"{self.kind.capitalize()} of {self.namespace}/{self.name}: {state} {message}".rstrip())
+        try:
+            await get_channel_layer().group_send("servers", {'type': 'server.backup', 'job': self.as_dict()})
+        except Exception as e:
+            logger.error(f"Error publishing {self.kind} progress: {e}")
+
+
+async def _wait_for_pod(name, pod_ref, running):
+    """Wait until the pod is running (or gone if not ``running``)."""
+    pod_name = pod_ref.name
+    core_api = await get_async_registry(pod_ref.cluster).core_api()
+    deadline = time.monotonic() + BACKUP_POD_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            pod = await core_api.read_namespaced_pod(pod_name, pod_ref.namespace)
+            if running and pod.status.phase == 'Running':
+                return
+            if running and pod.status.phase in ('Failed', 'Succeeded'):
+                raise BackupError(f"Pod {pod_name} exited.")
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            if not running:
+                return
+        await asyncio.sleep(1)
+    raise BackupError(f"Pod {pod_name} of {name} did not {'start' if running else 'stop'} "
+                      f"within {BACKUP_POD_TIMEOUT} seconds.")
+
+
+def build_volume_pod_manifest(name):
+    """A pod that only mounts a server's data volume, for stopped servers and restores."""
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": f"{name}-backup",
+            "labels": {"mindworld/volume-of": name},
+            "annotations": {"managed-by": "mindworld"}
+        },
+        "spec": {
+            "restartPolicy": "Never",
+            "containers": [{
+                "name": CONTAINER_NAME,
+                "image": MINECRAFT_IMAGE,
+                "command": ["sleep", "infinity"],
+                "volumeMounts": [{"mountPath": DATA_ROOT, "name": "minecraft-data"}]
+            }],
+            "volumes": [{
+                "name": "minecraft-data",
+                "persistentVolumeClaim": {"claimName": f"minecraft-data-{name}-0"}
+            }]
+        }
+    }
+
+
+class _VolumePod:
+    """Run a volume pod for the duration of a ``async with`` block."""
+
+    def __init__(self, name, namespace, cluster):
+        self.name = name
+        self.pod = PodRef(f"{name}-backup", namespace, cluster)
+
+    async def __aenter__(self):
+        core_api = await get_async_registry(self.pod.cluster).core_api()
+        try:
+            await core_api.create_namespaced_pod(self.pod.namespace, build_volume_pod_manifest(self.name))
+        except ApiException as e:
+            if e.status == 409:
+                raise BackupError("Another backup or restore of this server is running.")
+            raise
+        try:
+            await _wait_for_pod(self.name, self.pod, running=True)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self.pod
+
+    async def __aexit__(self, *exc_info):
+        core_api = await get_async_registry(self.pod.cluster).core_api()
+        try:
+            await core_api.delete_namespaced_pod(self.pod.name, self.pod.namespace, grace_period_seconds=0)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error(f"Could not delete volume pod {self.pod.name}: {e}")
+
+
+async def _running_pod(job):
+    core_api = await get_async_registry(job.cluster).core_api()
+    try:
+        pod = await core_api.read_namespaced_pod(get_pod_name(job.name), job.namespace)
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+    return PodRef(pod.metadata.name, job.namespace, job.cluster) if pod.status.phase == 'Running' else None
+
+
+async def _drain(console, quiet=1.0):
+    """Discard output (such as replayed log lines) until the console is quiet."""
+    while True:
+        try:
+            if await asyncio.wait_for(console.read(), quiet) is None:
+                raise BackupError("The console closed.")
+        except asyncio.TimeoutError:
+            return
+
+
+async def _wait_for_save(console):
+    while True:
+        output = await console.read()
+        if output is None:
+            raise BackupError("The console closed while saving.")
+        if any(message in output for message in SAVED_MESSAGES):
+            return
+
+
+async def _quiesce(name, pod):
+    """Flush the world to disk and stop autosaving, returning the open console."""
+    backend = await console_backend_for(name, pod.namespace, pod.cluster)
+    console = await open_console(name, pod.name, backend, pod.namespace, pod.cluster)
+    try:
+        await _drain(console)
+        await console.write("save-off\n")
+        await console.write("save-all flush\n")
+        await asyncio.wait_for(_wait_for_save(console), BACKUP_SAVE_TIMEOUT)
+    except BaseException:
+        await _resume(console)
+        raise
+    return console
+
+
+async def _resume(console):
+    try:
+        await console.write("save-on\n")
+    except Exception as e:
+        logger.error(f"Could not turn autosave back on: {e}")
+    finally:
+        await console.close()
+
+
+async def backup_volume(store, pod, namespace, name, job=None, cluster=DEFAULT_CLUSTER):
+    """Store a snapshot of the volume mounted in ``pod`` and return its manifest."""
+    previous = await asyncio.to_thread(latest_snapshot, store, namespace, name, cluster)
+    previous_files = {entry['path']: entry for entry in (previous or {}).get('files', [])}
+    writer = ChunkWriter(store, (digest for entry in previous_files.values() for digest in entry['chunks']))
+
+    files = await list_volume(pod)
+    changed = [path for path, entry in sorted(files.items())
+               if (previous_files.get(path) or {}).get('size') != entry['size']
+               or previous_files[path]['mtime'] != entry['mtime']]
+    if job is not None:
+        await job.update('reading', f"{len(changed)} of {len(files)} files changed")
+
+    stored = {}
+    for batch in _batches(changed):
+        process = await ExecStream.open(pod, ['tar', '-cf', '-', '-C', DATA_ROOT, '--no-recursion', '--'] + batch)
+        stored.update(await writer.store_tar(process.chunks()))
+        if not process.succeeded:
+            raise BackupError(f"Could not read files from the volume: {process.error}")
+
+    manifest_files = []
+    for path in sorted(files):
+        if path in stored:
+            manifest_files.append({'path': path, **stored[path]})
+        elif path not in changed:
+            manifest_files.append(previous_files[path])
+        # A changed file tar did not return was deleted after the listing
+
+    created_at = datetime.now(timezone.utc)
+    manifest = {
+        'id': created_at.strftime('%Y%m%dT%H%M%S%fZ'),
+        'cluster': cluster,
+        'namespace': namespace,
+        'name': name,
+        'created_at': created_at.isoformat(),
+        'parent': previous['id'] if previous else None,
+        'stats': {
+            'files': len(manifest_files),
+            'changed_files': len(stored),
+            'size': sum(entry['size'] for entry in manifest_files),
+            'read_bytes': writer.read_bytes,
+            'uploaded_chunks': writer.uploaded_chunks,
+            'uploaded_bytes': writer.uploaded_bytes
+        },
+        'files': manifest_files
+    }
+    key = f"{snapshot_prefix(namespace, name, cluster)}/{manifest['id']}.json"
+    await asyncio.to_thread(store.put, key, json.dumps(manifest).encode())
+    return manifest
+
+
+async def restore_volume(store, pod, manifest):
+    """Replace the contents of the volume mounted in ``pod`` with a snapshot."""
+    keep = []
+    for entry in BACKUP_EXCLUDE:
+        keep += ['!', '-name', entry]
+    process = await ExecStream.open(pod, ['find', DATA_ROOT, '-mindepth', '1', '-maxdepth', '1'] + keep +
+                                    ['-exec', 'rm', '-rf', '--', '{}', '+'])
+    await process.output()
+    if not process.succeeded:
+        raise BackupError(f"Could not clear the volume: {process.error}")
+
+    files = manifest['files']
+    size = tar_size(files)
+    # Exec stdin cannot be half-closed, so tar is fed exactly "size" bytes
+    script = 'head -c "$1" | tar -xf - -C "$2"'
+    await exec_with_stdin(pod, ['sh', '-c', script, 'sh', str(size), DATA_ROOT],
+                          snapshot_tar(store, files), size)
+
+
+async def _check_managed(job):
+    apps_api = await get_async_registry(job.cluster).apps_api()
+    try:
+        sts = await apps_api.read_namespaced_stateful_set(job.name, job.namespace)
+    except ApiException as e:
+        if e.status == 404:
+            raise BackupError("Unknown server")
+        raise
+    if not is_managed_by_mindworld(sts):
+        raise BackupError("Unknown server")
+    return sts
+
+
+async def run_backup(job, store):
+    name = job.name
+    await _check_managed(job)
+    pod = await _running_pod(job)
+    if pod is not None:
+        await job.update('saving')
+        console = await _quiesce(name, pod)
+        try:
+            manifest = await backup_volume(store, pod, job.namespace, name, job, job.cluster)
+        finally:
+            await _resume(console)
+    else:
+        await job.update('mounting', "The server is stopped, mounting its volume")
+        async with _VolumePod(name, job.namespace, job.cluster) as volume_pod:
+            manifest = await backup_volume(store, volume_pod, job.namespace, name, job, job.cluster)
+    job.snapshot_id = manifest['id']
+    job.stats = manifest['stats']
+    await job.update('done')
+
+
+async def run_restore(job, store):
+    name = job.name
+    manifest = await asyncio.to_thread(load_snapshot, store, job.namespace, name, job.snapshot_id, job.cluster)
+    if manifest is None:
+        raise BackupError(f"Unknown snapshot {job.snapshot_id}")
+
+    replicas = (await _check_managed(job)).spec.replicas
+    await job.update('stopping')
+    if replicas and not await scale_statefulset(job.namespace, name, 0, job.cluster):
+        raise BackupError("Could not stop the server.")
+    try:
+        await _wait_for_pod(name, PodRef(get_pod_name(name), job.namespace, job.cluster), running=False)
+        await job.update('restoring')
+        volume_pod = _VolumePod(name, job.namespace, job.cluster)
+        async with volume_pod as pod:
+            await restore_volume(store, pod, manifest)
+        # The volume pod has to be gone before the server pod can mount the volume again
+        await _wait_for_pod(name, volume_pod.pod, running=False)
+    except Exception as e:
+        # The volume may be half wiped, and starting the server would generate a new world over it
+        if replicas:
+            raise BackupError(f"{e} The server was left stopped.") from e
+        raise
+    if replicas and not await scale_statefulset(job.namespace, name, replicas, job.cluster):
+        raise BackupError("The snapshot was restored, but the server could not be started again.")
+    job.stats = manifest['stats']
+    await job.update('done')
+
+
+_jobs = OrderedDict()
+_tasks = set()
+_semaphore = None
+_server_locks = {}
+_RUNNERS = {'backup': run_backup, 'restore': run_restore}
+
+
+async def run_job(job):
+    """Run a backup or restore to completion; failures end up in the job's state."""
+    global _semaphore
+    _semaphore = _semaphore or asyncio.Semaphore(BACKUP_CONCURRENCY)
+    _jobs[job.id] = job
+    while len(_jobs) > BACKUP_JOB_HISTORY:
+        _jobs.popitem(last=False)
+    # Jobs of one server share its volume pod, so they run one after the other
+    server_lock = _server_locks.setdefault((job.cluster, job.namespace, job.name), asyncio.Lock())
+    async with server_lock, _semaphore:
+        try:
+            await _RUNNERS[job.kind](job, await asyncio.to_thread(get_backup_store))
+        except Exception as e:
+            logger.error(f"{job.kind.capitalize()} of {job.namespace}/{job.name} failed: {e}")
+            await job.update('failed', str(e))
+    return job
+
+
+def _start(job):
+    """Queue ``job`` on the running event loop and return it immediately."""
+    task = asyncio.get_running_loop().create_task(run_job(job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+
+def start_backup(namespace, name, cluster=DEFAULT_CLUSTER):
+    return _start(BackupJob('backup', namespace, name, cluster=cluster))
+
+
+def start_restore(namespace, name, snapshot_id, cluster=DEFAULT_CLUSTER):
+    return _start(BackupJob('restore', namespace, name, snapshot_id, cluster))
+
+
+def get_backup_job(job_id):
+    return _jobs.get(job_id)
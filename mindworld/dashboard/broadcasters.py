@@ -0,0 +1,220 @@
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from functools import partial
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from .informers import object_key
+from .node_overview import node_summaries, pod_ready
+from .server_utils import (
+    get_node_informer, get_pod_informer, get_pod_name, get_statefulset_informer, statefulset_informers,
+    is_hibernated, is_managed_by_mindworld, statefulset_summary
+)
+
+logger = logging.getLogger(__name__)
+
+# Windows in seconds during which informer events are merged into one message.
+SERVER_STATUS_COALESCE_WINDOW = float(os.getenv('SERVER_STATUS_COALESCE_WINDOW', '0.25'))
+NODE_STATUS_COALESCE_WINDOW = float(os.getenv('NODE_STATUS_COALESCE_WINDOW', '1'))
+
+# Identifies this process on a shared (Redis) channel layer.
+WORKER_ID = uuid.uuid4().hex[:12]
+
+
+def worker_group(name):
+    """Group name that only reaches consumers connected to this process.
+
+    Every worker runs its own informers and producers, so their output is
+    sent to a per-worker group. Publishing it to a group shared by all
+    workers would deliver each update once per worker.
+    """
+    return f"{name}.{WORKER_ID}"
+
+
+def _pod_placement(pod):
+    return (pod.spec.node_name, pod.status.phase, pod_ready(pod))
+
+
+class NodeOverviewPublisher:
+    """Push changed node views to this worker's "nodes" group while it has subscribers.
+
+    Node, pod and StatefulSet events mark the nodes they touch as dirty.
+    After the coalescing window the dirty nodes are rebuilt from the caches
+    and only views that actually changed are sent. The informer handlers
+    are attached by the first subscriber and detached by the last, so no
+    views are built while nobody is watching.
+    """
+
+    def __init__(self, group, window):
+        self.group = group
+        self.window = window
+        self._dirty = set()
+        self._views = {}
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._loop = None
+        self._subscribers = 0
+        self._handlers = ()
+
+    def subscribe(self):
+        """Count in a viewer of the group. Must be called from the event loop."""
+        self._subscribers += 1
+        if self._subscribers > 1:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._handlers = ((get_node_informer(), self._on_node_event),
+                          (get_pod_informer(), self._on_pod_event),
+                          (get_statefulset_informer(), self._on_statefulset_event))
+        for informer, handler in self._handlers:
+            informer.add_handler(handler)
+
+    def unsubscribe(self):
+        """Count out a viewer of the group. Must be called from the event loop."""
+        self._subscribers -= 1
+        if self._subscribers > 0:
+            return
+        for informer, handler in self._handlers:
+            informer.remove_handler(handler)
+        self._handlers = ()
+        with self._lock:
+            self._dirty.clear()
+        # The next subscriber starts from a full snapshot, so there is nothing to diff against
+        self._views.clear()
+
+    def _on_node_event(self, event_type, node, old_node):
+        self._mark_dirty({node.metadata.name})
+
+    def _on_pod_event(self, event_type, pod, old_pod):
+        if event_type == "MODIFIED" and _pod_placement(pod) == _pod_placement(old_pod):
+            return
+        nodes = {pod.spec.node_name, old_pod.spec.node_name if old_pod is not None else None}
+        self._mark_dirty(nodes - {None})
+
+    def _on_statefulset_event(self, event_type, sts, old_sts):
+        if event_type == "MODIFIED":
+            return
+        # A server appearing or going away changes which pods are listed as servers
+        pod = get_pod_informer().get(f"{sts.metadata.namespace}/{get_pod_name(sts.metadata.name)}")
+        if pod is not None and pod.spec.node_name:
+            self._mark_dirty({pod.spec.node_name})
+
+    def _mark_dirty(self, node_names):
+        if not node_names:
+            return
+        with self._lock:
+            self._dirty |= node_names
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._loop.call_later, self.window, self._start_flush)
+
+    def _start_flush(self):
+        self._loop.create_task(self._flush())
+
+    async def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._flush_scheduled = False
+        if not dirty:
+            return
+
+        try:
+            views = await sync_to_async(node_summaries, thread_sensitive=False)(dirty)
+        except Exception as e:
+            logger.error(f"Error building node views: {e}")
+            return
+
+        changed = [view for view in views if self._views.get(view['name']) != view]
+        removed = sorted(name for name in dirty - {view['name'] for view in views} if name in self._views)
+        self._views.update((view['name'], view) for view in changed)
+        for name in removed:
+            del self._views[name]
+        if not changed and not removed:
+            return
+
+        try:
+            await get_channel_layer().group_send(self.group, {
+                'type': 'node.status',
+                'nodes': changed,
+                'removed': removed,
+                'partial': True
+            })
+        except Exception as e:
+            logger.error(f"Error publishing node status: {e}")
+
+
+def _replica_state(sts):
+    return (sts.status.ready_replicas, sts.spec.replicas, is_hibernated(sts))
+
+
+class ServerStatusPublisher:
+    """Push per-server status deltas to this worker's "servers" group as StatefulSets change.
+
+    Events arrive from the StatefulSet informer thread. Changes are collected
+    per server and flushed as a single ``server.status`` message once the
+    coalescing window has passed, so a burst of events becomes one update.
+    """
+
+    def __init__(self, group, window):
+        self.group = group
+        self.window = window
+        self._pending = {}
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def start(self):
+        """Attach to the StatefulSet informer of every cluster. Must be called from the event loop."""
+        if self._loop is not None:
+            return
+        informers = statefulset_informers()
+        self._loop = asyncio.get_running_loop()
+        for cluster, informer in informers.items():
+            informer.add_handler(partial(self._on_event, cluster))
+
+    def _on_event(self, cluster, event_type, sts, old_sts):
+        managed = is_managed_by_mindworld(sts)
+        was_managed = old_sts is not None and is_managed_by_mindworld(old_sts)
+        if not managed and not was_managed:
+            return
+
+        if event_type == "DELETED" or not managed:
+            change = None
+        elif event_type == "MODIFIED" and was_managed and _replica_state(sts) == _replica_state(old_sts):
+            return
+        else:
+            change = statefulset_summary(sts, cluster)
+
+        with self._lock:
+            self._pending[(cluster, object_key(sts))] = (cluster, sts.metadata.namespace, sts.metadata.name, change)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._loop.call_later, self.window, self._start_flush)
+
+    def _start_flush(self):
+        self._loop.create_task(self._flush())
+
+    async def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_scheduled = False
+
+        servers = [change for _, _, _, change in pending.values() if change is not None]
+        removed = [{"cluster": cluster, "namespace": namespace, "name": name}
+                   for cluster, namespace, name, change in pending.values() if change is None]
+        try:
+            await get_channel_layer().group_send(self.group, {
+                'type': 'server.status',
+                'servers': servers,
+                'removed': removed,
+                'partial': True
+            })
+        except Exception as e:
+            logger.error(f"Error publishing server status: {e}")
+
+
+node_overview_publisher = NodeOverviewPublisher(worker_group("nodes"), NODE_STATUS_COALESCE_WINDOW)
+server_status_publisher = ServerStatusPublisher(worker_group("servers"), SERVER_STATUS_COALESCE_WINDOW)
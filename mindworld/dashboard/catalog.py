@@ -0,0 +1,228 @@
+"""Server catalog: managed servers mirrored into the database.
+
+The reconciler follows the StatefulSet informer and upserts one Server row
+per managed StatefulSet, with its config and a status history. Listing,
+filtering and paging servers is then an indexed query instead of a walk
+over every StatefulSet in the cluster. A full reconcile after the informer
+syncs catches anything that changed while no process was watching. Every
+configured cluster is followed through its own informer.
+"""
+import logging
+import threading
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .informers import object_key
+from .kube_clients import DEFAULT_CLUSTER
+from .models import Server, ServerConfig, ServerStatusChange
+from .server_templates import TEMPLATE_ANNOTATION, TEMPLATE_VERSION_ANNOTATION
+from .server_utils import (
+    CONTAINER_NAME, INFORMER_SYNC_TIMEOUT, is_managed_by_mindworld, statefulset_informers, statefulset_summary
+)
+
+logger = logging.getLogger(__name__)
+
+# Set by build_statefulset_manifest for the console, not part of a server's config.
+PANEL_ENV_VARS = {'CREATE_CONSOLE_IN_PIPE', 'ENABLE_RCON', 'RCON_PASSWORD'}
+
+STATE_FIELDS = ('status', 'replicas', 'ready_replicas', 'hibernated')
+
+
+def server_env(sts):
+    """Return the plain env settings of the server container."""
+    for container in sts.spec.template.spec.containers:
+        if container.name == CONTAINER_NAME:
+            return {env.name: env.value for env in container.env or []
+                    if env.value_from is None and env.name not in PANEL_ENV_VARS}
+    return {}
+
+
+def server_fields(sts, cluster=DEFAULT_CLUSTER):
+    """Catalog fields of a managed StatefulSet."""
+    summary = statefulset_summary(sts, cluster)
+    annotations = sts.metadata.annotations or {}
+    version = annotations.get(TEMPLATE_VERSION_ANNOTATION)
+    return {
+        'status': summary['status'],
+        'replicas': summary['replicas'] or 0,
+        'ready_replicas': summary['running_replicas'] or 0,
+        'hibernated': summary['hibernated'],
+        'template': annotations.get(TEMPLATE_ANNOTATION, ''),
+        'template_version': int(version) if version and version.isdigit() else None,
+        'resource_version': sts.metadata.resource_version or '',
+        'deleted_at': None
+    }
+
+
+def _record_state(server):
+    ServerStatusChange.objects.create(server=server, **{field: getattr(server, field) for field in STATE_FIELDS})
+
+
+def sync_server(sts, cluster=DEFAULT_CLUSTER):
+    """Upsert the catalog entry for a managed StatefulSet. Returns the Server."""
+    fields = server_fields(sts, cluster)
+    with transaction.atomic():
+        server = Server.objects.select_for_update().filter(
+            cluster=cluster, namespace=sts.metadata.namespace, name=sts.metadata.name).first()
+        if server is not None and server.resource_version == fields['resource_version'] and server.deleted_at is None:
+            return server
+
+        created = server is None
+        if created:
+            server = Server(cluster=cluster, namespace=sts.metadata.namespace, name=sts.metadata.name)
+        state_changed = created or server.deleted_at is not None or any(
+            getattr(server, field) != fields[field] for field in STATE_FIELDS)
+        for field, value in fields.items():
+            setattr(server, field, value)
+        server.save()
+
+        ServerConfig.objects.update_or_create(server=server, defaults={'env': server_env(sts)})
+        if state_changed:
+            _record_state(server)
+    return server
+
+
+def mark_deleted(namespace, name, cluster=DEFAULT_CLUSTER):
+    """Flag the catalog entry for a StatefulSet that no longer exists."""
+    with transaction.atomic():
+        server = Server.objects.select_for_update().filter(
+            cluster=cluster, namespace=namespace, name=name, deleted_at__isnull=True).first()
+        if server is None:
+            return
+        server.status = Server.STATUS_DELETED
+        server.replicas = 0
+        server.ready_replicas = 0
+        server.deleted_at = timezone.now()
+        server.save()
+        _record_state(server)
+
+
+def reconcile(statefulsets, cluster=DEFAULT_CLUSTER):
+    """Bring the catalog in line with a full list of a cluster's StatefulSets.
+
+    Rows whose resourceVersion already matches are left alone, so a resync
+    of an unchanged cluster is one query.
+    """
+    known = {f"{namespace}/{name}": (resource_version, deleted_at)
+             for namespace, name, resource_version, deleted_at in Server.objects.filter(cluster=cluster).values_list(
+                 'namespace', 'name', 'resource_version', 'deleted_at')}
+
+    managed = set()
+    synced = 0
+    for sts in statefulsets:
+        if not is_managed_by_mindworld(sts):
+            continue
+        key = object_key(sts)
+        managed.add(key)
+        if known.get(key) != (sts.metadata.resource_version, None):
+            sync_server(sts, cluster)
+            synced += 1
+
+    gone = [key for key, (_, deleted_at) in known.items() if deleted_at is None and key not in managed]
+    for key in gone:
+        mark_deleted(*key.split('/', 1), cluster=cluster)
+    logger.info(f"Server catalog of cluster {cluster} reconciled: {synced} updated, {len(gone)} removed, {len(managed)} managed.")
+
+
+class ServerCatalog:
+    """Keep the server catalog in sync with this worker's StatefulSet informers."""
+
+    def __init__(self):
+        self._started = False
+        self._synced = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def start(self):
+        """Attach to the informers and reconcile each cluster in the background once it has synced."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        informers = statefulset_informers()
+        self._pending = len(informers)
+        for cluster, informer in informers.items():
+            informer.add_handler(lambda event_type, sts, old_sts, cluster=cluster:
+                                 self._on_event(cluster, event_type, sts, old_sts))
+            threading.Thread(target=self._initial_sync, args=(cluster, informer), name=f"server-catalog-{cluster}",
+                             daemon=True).start()
+
+    def has_synced(self):
+        """True once the first reconcile against every cluster has run."""
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout=INFORMER_SYNC_TIMEOUT):
+        """Start if needed and wait for the first reconcile. False on timeout.
+
+        The rows from before the timeout are still served, they are only as
+        old as the last time a worker was watching.
+        """
+        self.start()
+        if not self._synced.wait(timeout):
+            logger.warning(f"Server catalog not reconciled within {timeout} seconds, serving stored state.")
+            return False
+        return True
+
+    def _initial_sync(self, cluster, informer):
+        # A cluster that cannot be reached must not hold back the catalog of the others
+        synced = informer.wait_for_sync(INFORMER_SYNC_TIMEOUT)
+        if synced:
+            self._reconcile(cluster, informer)
+        with self._lock:
+            self._pending -= 1
+            if not self._pending:
+                self._synced.set()
+        if not synced:
+            informer.wait_for_sync()
+            self._reconcile(cluster, informer)
+
+    def _reconcile(self, cluster, informer):
+        close_old_connections()
+        try:
+            reconcile(informer.list(), cluster)
+        except Exception as e:
+            # Informer events still keep the rows they touch up to date
+            logger.error(f"Error reconciling the server catalog of cluster {cluster}: {e}")
+        finally:
+            close_old_connections()
+
+    def _on_event(self, cluster, event_type, sts, old_sts):
+        managed = is_managed_by_mindworld(sts)
+        was_managed = old_sts is not None and is_managed_by_mindworld(old_sts)
+        if not managed and not was_managed:
+            return
+        # Runs on the informer thread, which keeps its database connection between events
+        close_old_connections()
+        if event_type == "DELETED" or not managed:
+            mark_deleted(sts.metadata.namespace, sts.metadata.name, cluster)
+        else:
+            sync_server(sts, cluster)
+
+
+def list_servers(cluster=None, namespace=None, status=None, hibernated=None, name_prefix=None, offset=0, limit=None):
+    """Return ``(total, [server dict, ...])`` for live servers matching the filters."""
+    servers = Server.objects.filter(deleted_at__isnull=True)
+    if cluster:
+        servers = servers.filter(cluster=cluster)
+    if namespace:
+        servers = servers.filter(namespace=namespace)
+    if status:
+        servers = servers.filter(status=status)
+    if hibernated is not None:
+        servers = servers.filter(hibernated=hibernated)
+    if name_prefix:
+        servers = servers.filter(name__startswith=name_prefix)
+
+    total = servers.count()
+    servers = servers.order_by('cluster', 'namespace', 'name')[offset:None if limit is None else offset + limit]
+    return total, [server.as_dict() for server in servers]
+
+
+def status_history(namespace, name, limit=100, cluster=DEFAULT_CLUSTER):
+    """Return the newest ``limit`` status changes of a server, or None if it is unknown."""
+    server = Server.objects.filter(cluster=cluster, namespace=namespace, name=name).first()
+    if server is None:
+        return None
+    return [change.as_dict() for change in server.status_history.all()[:limit]]
+
+
+server_catalog = ServerCatalog()
@@ -0,0 +1,221 @@
+"""Console transports used by the console websocket.
+
+A transport delivers console output through ``read()`` (None once the
+console has closed), accepts commands through ``write(text)`` and is shut
+down with ``close()``, all coroutines. Three backends exist:
+
+* ``rcon``: commands go over RCON straight to the pod, output comes from
+  following the container log. No exec is involved.
+* ``pipe``: one exec that tails the server log and writes into the image's
+  console named pipe.
+* ``screen``: the legacy ``screen -x`` attach for servers started under screen.
+"""
+import asyncio
+import struct
+import logging
+import aiohttp
+from kubernetes_asyncio.client.rest import ApiException
+from kubernetes_asyncio.stream.ws_client import STDIN_CHANNEL, STDOUT_CHANNEL, STDERR_CHANNEL
+from .kube_clients import DEFAULT_CLUSTER, get_async_registry
+from .server_utils import (
+    NAMESPACE, CONTAINER_NAME, RCON_PORT, find_minecraft_screen, pipe_console_command, rcon_password
+)
+
+logger = logging.getLogger(__name__)
+
+# Lines of log history sent when an RCON console opens.
+CONSOLE_LOG_TAIL_LINES = 100
+RCON_CONNECT_TIMEOUT = 5
+
+RCON_TYPE_RESPONSE = 0
+RCON_TYPE_COMMAND = 2
+RCON_TYPE_LOGIN = 3
+
+
+class ExecTransport:
+    """An interactive exec stream into a server container."""
+
+    def __init__(self, ws):
+        self._ws = ws
+
+    async def read(self):
+        while True:
+            msg = await self._ws.receive()
+            if msg.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                return None
+            data = msg.data if isinstance(msg.data, bytes) else msg.data.encode('utf-8')
+            if len(data) > 1 and data[0] in (STDOUT_CHANNEL, STDERR_CHANNEL):
+                return data[1:].decode('utf-8', errors='replace')
+
+    async def write(self, text):
+        await self._ws.send_bytes(bytes([STDIN_CHANNEL]) + text.encode('utf-8'))
+
+    async def close(self):
+        await self._ws.close()
+
+    @classmethod
+    async def open(cls, pod_name, command, tty, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+        core_api = await get_async_registry(cluster).exec_core_api()
+        ws = await (await core_api.connect_get_namespaced_pod_exec(pod_name, namespace,
+                                                                   command=command,
+                                                                   container=CONTAINER_NAME,
+                                                                   stderr=True, stdin=True,
+                                                                   stdout=True, tty=tty,
+                                                                   _preload_content=False))
+        return cls(ws)
+
+
+class RconError(Exception):
+    pass
+
+
+class RconClient:
+    """Minimal asyncio client for the Source RCON protocol used by Minecraft."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._lock = asyncio.Lock()
+        self._request_id = 0
+
+    @classmethod
+    async def connect(cls, host, port, password):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), RCON_CONNECT_TIMEOUT)
+        rcon = cls(reader, writer)
+        try:
+            request_id, _ = await rcon._request(RCON_TYPE_LOGIN, password)
+        except Exception:
+            await rcon.close()
+            raise
+        if request_id == -1:
+            await rcon.close()
+            raise RconError("RCON authentication failed.")
+        return rcon
+
+    def _send(self, packet_type, body):
+        self._request_id += 1
+        payload = struct.pack('<ii', self._request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+        self._writer.write(struct.pack('<i', len(payload)) + payload)
+        return self._request_id
+
+    async def _receive(self):
+        length, = struct.unpack('<i', await self._reader.readexactly(4))
+        packet = await self._reader.readexactly(length)
+        request_id, _ = struct.unpack('<ii', packet[:8])
+        return request_id, packet[8:-2]
+
+    async def _request(self, packet_type, body):
+        self._send(packet_type, body)
+        await self._writer.drain()
+        request_id, response = await self._receive()
+        return request_id, response.decode('utf-8', errors='replace')
+
+    async def command(self, command):
+        """Run a console command and return its output.
+
+        Long output is split over several packets. The server answers the
+        empty packet sent after the command only once the last one is out.
+        """
+        async with self._lock:
+            self._send(RCON_TYPE_COMMAND, command)
+            end_id = self._send(RCON_TYPE_RESPONSE, '')
+            await self._writer.drain()
+            fragments = []
+            while True:
+                request_id, fragment = await self._receive()
+                if request_id == end_id:
+                    # Fragments may split a character, decode them together
+                    return b''.join(fragments).decode('utf-8', errors='replace')
+                fragments.append(fragment)
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class RconTransport:
+    """Send commands over RCON and read output by following the container log."""
+
+    def __init__(self, rcon, log_response):
+        self._rcon = rcon
+        self._log_response = log_response
+        self._output = asyncio.Queue()
+        self._log_task = asyncio.create_task(self._follow_log())
+
+    async def _follow_log(self):
+        try:
+            async for line in self._log_response.content:
+                await self._output.put(line.decode('utf-8', errors='replace'))
+        except (aiohttp.ClientError, asyncio.CancelledError):
+            pass
+        finally:
+            await self._output.put(None)
+
+    async def read(self):
+        return await self._output.get()
+
+    async def write(self, text):
+        for command in text.splitlines():
+            if command.strip():
+                response = await self._rcon.command(command.strip())
+                if response:
+                    await self._output.put(response if response.endswith('\n') else response + '\n')
+
+    async def close(self):
+        self._log_task.cancel()
+        self._log_response.release()
+        await self._rcon.close()
+
+    @classmethod
+    async def open(cls, statefulset_name, pod_name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+        core_api = await get_async_registry(cluster).core_api()
+        pod = await core_api.read_namespaced_pod(pod_name, namespace)
+        if not pod.status.pod_ip:
+            raise RconError(f"Pod {pod_name} has no IP yet.")
+
+        rcon = await RconClient.connect(pod.status.pod_ip, RCON_PORT,
+                                        rcon_password(statefulset_name, namespace, cluster))
+        try:
+            log_response = await core_api.read_namespaced_pod_log(pod_name, namespace,
+                                                                  container=CONTAINER_NAME,
+                                                                  follow=True,
+                                                                  tail_lines=CONSOLE_LOG_TAIL_LINES,
+                                                                  _preload_content=False)
+        except Exception:
+            await rcon.close()
+            raise
+        return cls(rcon, log_response)
+
+
+async def _open_screen(pod_name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    core_api = await get_async_registry(cluster).exec_core_api()
+    response = await core_api.connect_get_namespaced_pod_exec(pod_name, namespace,
+                                                              command=['screen', '-ls'],
+                                                              container=CONTAINER_NAME,
+                                                              stderr=True, stdin=False,
+                                                              stdout=True, tty=False)
+    minecraft_screen = find_minecraft_screen(response)
+
+    if not minecraft_screen:
+        raise Exception("No Minecraft screen session found.")
+
+    return await ExecTransport.open(pod_name, ['screen', '-x', minecraft_screen], tty=True,
+                                    namespace=namespace, cluster=cluster)
+
+
+async def open_console(statefulset_name, pod_name, backend, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Open a console transport for ``pod_name`` using ``backend``."""
+    if backend == "rcon":
+        try:
+            return await RconTransport.open(statefulset_name, pod_name, namespace, cluster)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RconError, ApiException) as e:
+            # RCON pods also expose the console pipe, so fall back to a single exec
+            logger.warning(f"RCON console unavailable for {pod_name}, falling back to exec: {e}")
+            backend = "pipe"
+    if backend == "pipe":
+        return await ExecTransport.open(pod_name, pipe_console_command(), tty=False,
+                                        namespace=namespace, cluster=cluster)
+    return await _open_screen(pod_name, namespace, cluster)
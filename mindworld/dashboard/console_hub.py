@@ -0,0 +1,370 @@
+import os
+import uuid
+import asyncio
+import logging
+from channels.layers import get_channel_layer
+from .async_server_utils import attach_to_console
+from .scrollback import ConsoleBuffer
+from .kube_clients import DEFAULT_CLUSTER
+from .server_utils import NAMESPACE, get_pod_name
+
+logger = logging.getLogger(__name__)
+
+# Bytes of console output kept per server for replay on connect.
+CONSOLE_BUFFER_BYTES = int(os.getenv('CONSOLE_BUFFER_BYTES', str(64 * 1024)))
+# Lines replayed to a viewer that is not resuming from a sequence number.
+CONSOLE_REPLAY_LINES = int(os.getenv('CONSOLE_REPLAY_LINES', '200'))
+# Output is sent at most once per interval (seconds), capped at CONSOLE_FRAME_BYTES per frame.
+CONSOLE_FRAME_INTERVAL = float(os.getenv('CONSOLE_FRAME_INTERVAL', '0.05'))
+CONSOLE_FRAME_BYTES = int(os.getenv('CONSOLE_FRAME_BYTES', str(16 * 1024)))
+# Seconds the upstream and scrollback are kept after the last viewer leaves, so a reconnect can resume.
+CONSOLE_IDLE_GRACE = float(os.getenv('CONSOLE_IDLE_GRACE', '60'))
+# Seconds a worker holds a server's upstream on a shared channel layer without renewing it.
+CONSOLE_LEADER_LEASE = float(os.getenv('CONSOLE_LEADER_LEASE', '15'))
+# How long a joining viewer waits for the scrollback of the worker holding the upstream.
+CONSOLE_SYNC_TIMEOUT = 1.0
+
+# Compare-and-set on the leader key, so a worker never renews or drops a lease it lost.
+_RENEW_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                 "return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0")
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+class ConsoleHub:
+    """Share one upstream console per server between every viewer.
+
+    Output is fanned out through a channel-layer group, stdin writes are
+    serialized, and the upstream is closed CONSOLE_IDLE_GRACE seconds after
+    the last viewer leaves unless someone joins again in the meantime.
+    Recent output is kept in a ring buffer so new viewers get scrollback.
+    Output is sent in frames covering a byte range of that buffer; a viewer
+    that falls behind sees a note about skipped output instead of a backlog.
+
+    This hub keeps the upstream in its own process, which is all there is on
+    the in-memory channel layer. SharedConsoleHub spreads it across workers.
+    """
+
+    def __init__(self, statefulset_name, backend, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER, channel_layer=None):
+        self.statefulset_name = statefulset_name
+        self.backend = backend
+        self.namespace = namespace
+        self.cluster = cluster
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.group = f"console.{cluster}.{namespace}.{statefulset_name}"
+        self.stream_id = uuid.uuid4().hex
+        self._viewers = set()
+        self._console = None
+        self._pump = None
+        self._closer = None
+        self._lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self.buffer = ConsoleBuffer(CONSOLE_BUFFER_BYTES)
+        self._flushed = 0
+        self._output_ready = None
+
+    async def join(self, channel_name):
+        async with self._lock:
+            self._cancel_closer()
+            if self._console is None:
+                await self._open_upstream()
+            self._viewers.add(channel_name)
+            await self.channel_layer.group_add(self.group, channel_name)
+
+    async def leave(self, channel_name):
+        async with self._lock:
+            self._viewers.discard(channel_name)
+            await self.channel_layer.group_discard(self.group, channel_name)
+            if not self._viewers and self._closer is None:
+                self._closer = asyncio.create_task(self._close_when_idle())
+
+    async def write(self, text):
+        async with self._write_lock:
+            if self._console is None:
+                raise RuntimeError("Console is not connected.")
+            await self._console.write(text)
+
+    def scrollback(self, since=None):
+        """Return ``(start_seq, end_seq, data, resumed)`` for a connecting viewer.
+
+        With ``since`` the output after that sequence number is returned, and
+        ``resumed`` tells whether nothing was lost in between. Otherwise the
+        last CONSOLE_REPLAY_LINES lines are returned.
+        """
+        if since is not None:
+            start, data = self.buffer.read_from(since)
+            resumed = self.buffer.start <= since <= self.buffer.end
+        else:
+            start, data = self.buffer.tail_lines(CONSOLE_REPLAY_LINES)
+            resumed = False
+        return start, start + len(data), data, resumed
+
+    def is_idle(self):
+        return not self._viewers and self._console is None
+
+    async def _open_upstream(self):
+        self._console = await attach_to_console(get_pod_name(self.statefulset_name), self.backend,
+                                                self.namespace, self.cluster)
+        # A fresh upstream replays its own log tail, so start the scrollback over
+        self.buffer.clear()
+        self._pump = asyncio.create_task(self._pump_output(self._console))
+
+    def _cancel_closer(self):
+        if self._closer is not None:
+            self._closer.cancel()
+            self._closer = None
+
+    async def _close_when_idle(self):
+        await asyncio.sleep(CONSOLE_IDLE_GRACE)
+        async with self._lock:
+            self._closer = None
+            if not self._viewers:
+                await self._teardown()
+
+    async def _teardown(self):
+        console, self._console = self._console, None
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+        if console is not None:
+            try:
+                await console.close()
+            except Exception as e:
+                logger.error(f"Error closing console for {self.statefulset_name}: {e}")
+
+    async def _read_upstream(self, console):
+        try:
+            while True:
+                message = await console.read()
+                if message is None:
+                    break
+                self.buffer.append(message.encode('utf-8'))
+                self._output_ready.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading console output: {e}")
+        finally:
+            self._output_ready.set()
+
+    async def _send_frame(self, channel_layer):
+        start, end = self._flushed, self.buffer.end
+        if start >= end:
+            return
+        # Never send more than one frame's worth: skip ahead and let viewers
+        # know how much was left out rather than queueing it all.
+        frame_start = max(start, end - CONSOLE_FRAME_BYTES, self.buffer.start)
+        _, data = self.buffer.read_from(frame_start)
+        self._flushed = end
+        await channel_layer.group_send(self.group, {
+            'type': 'console.output',
+            'data': data,
+            'start': frame_start,
+            'seq': end,
+            'stream': self.stream_id
+        })
+
+    async def _pump_output(self, console):
+        channel_layer = self.channel_layer
+        self._flushed = self.buffer.end
+        self._output_ready = asyncio.Event()
+        reader = asyncio.create_task(self._read_upstream(console))
+        try:
+            while not reader.done():
+                await self._output_ready.wait()
+                # Let more output arrive so bursts go out as one frame
+                await asyncio.sleep(CONSOLE_FRAME_INTERVAL)
+                self._output_ready.clear()
+                await self._send_frame(channel_layer)
+        finally:
+            reader.cancel()
+
+        logger.warning("Console connection closed.")
+        await channel_layer.group_send(self.group, {'type': 'console.closed'})
+        async with self._lock:
+            if self._console is console:
+                self._pump = None
+                await self._teardown()
+
+
+class SharedConsoleHub(ConsoleHub):
+    """A ConsoleHub with one upstream per server across every worker of a Redis channel layer.
+
+    The worker holding the server's leader key in Redis opens the upstream
+    and publishes its frames to the server's group, which viewers on every
+    worker join. The other workers mirror those frames into their own buffer
+    for scrollback, forward stdin to the leader (which serializes all
+    writes) and keep it alive while they have viewers. A worker with viewers
+    takes the upstream over once the leader's lease runs out.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._leader_key = f"{self.channel_layer.prefix}:console-leader:{self.group}"
+        self._inbox = None
+        self._listener = None
+        self._heartbeat = None
+        self._synced = asyncio.Event()
+
+    async def join(self, channel_name):
+        async with self._lock:
+            self._cancel_closer()
+            await self._start()
+            if self._console is None and not await self._elect():
+                await self._sync()
+            self._viewers.add(channel_name)
+            await self.channel_layer.group_add(self.group, channel_name)
+
+    async def write(self, text):
+        if self._console is not None:
+            return await super().write(text)
+        leader = await self._leader()
+        if leader is None:
+            raise RuntimeError("Console is not connected.")
+        await self.channel_layer.send(leader, {'type': 'console.input', 'text': text})
+
+    def is_idle(self):
+        return not self._viewers and self._listener is None
+
+    def _redis(self):
+        return self.channel_layer.connection(0)
+
+    async def _leader(self):
+        leader = await self._redis().get(self._leader_key)
+        return leader.decode() if leader is not None else None
+
+    async def _elect(self):
+        """Open the upstream unless another worker has it. Returns True if this worker does now."""
+        if not await self._redis().set(self._leader_key, self._inbox, nx=True, px=int(CONSOLE_LEADER_LEASE * 1000)):
+            return False
+        try:
+            await self._open_upstream()
+        except BaseException:
+            await self._release()
+            raise
+        return True
+
+    async def _release(self):
+        try:
+            await self._redis().eval(_RELEASE_SCRIPT, 1, self._leader_key, self._inbox)
+        except Exception as e:
+            logger.error(f"Error releasing the console of {self.statefulset_name}: {e}")
+
+    async def _sync(self):
+        """Ask the leader for its scrollback and wait briefly for it."""
+        leader = await self._leader()
+        if leader is None:
+            return
+        self._synced.clear()
+        await self.channel_layer.send(leader, {'type': 'console.sync', 'reply_to': self._inbox})
+        try:
+            await asyncio.wait_for(self._synced.wait(), CONSOLE_SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"No scrollback from the console leader of {self.statefulset_name}.")
+
+    async def _start(self):
+        if self._listener is not None:
+            return
+        self._inbox = await self.channel_layer.new_channel()
+        # The inbox mirrors the leader's frames while this worker is not the leader
+        await self.channel_layer.group_add(self.group, self._inbox)
+        self._listener = asyncio.create_task(self._listen(self._inbox))
+        self._heartbeat = asyncio.create_task(self._keep_alive())
+
+    async def _teardown(self):
+        was_leader = self._console is not None
+        await super()._teardown()
+        if was_leader:
+            await self._release()
+        for task in (self._listener, self._heartbeat):
+            if task is not None:
+                task.cancel()
+        self._listener = self._heartbeat = None
+        if self._inbox is not None:
+            await self.channel_layer.group_discard(self.group, self._inbox)
+            self._inbox = None
+
+    async def _keep_alive(self):
+        """Renew the lease as leader; otherwise keep the leader up for our viewers, or take over."""
+        while True:
+            await asyncio.sleep(CONSOLE_LEADER_LEASE / 3)
+            try:
+                async with self._lock:
+                    if self._console is not None:
+                        renewed = await self._redis().eval(_RENEW_SCRIPT, 1, self._leader_key, self._inbox,
+                                                           int(CONSOLE_LEADER_LEASE * 1000))
+                        if not renewed:
+                            logger.warning(f"Lost the console lease of {self.statefulset_name}, closing it here.")
+                            await ConsoleHub._teardown(self)
+                    elif self._viewers:
+                        leader = await self._leader()
+                        if leader is not None:
+                            await self.channel_layer.send(leader, {'type': 'console.keepalive'})
+                        elif await self._elect():
+                            logger.info(f"Took over the console of {self.statefulset_name}.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error keeping the console of {self.statefulset_name} alive: {e}")
+
+    async def _listen(self, inbox):
+        while True:
+            message = await self.channel_layer.receive(inbox)
+            try:
+                await self._handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error handling {message.get('type')} for the console of {self.statefulset_name}: {e}")
+
+    async def _handle(self, message):
+        kind = message['type']
+        if kind == 'console.output' and self._console is None:
+            self._mirror(message)
+        elif kind == 'console.input' and self._console is not None:
+            await self.write(message['text'])
+        elif kind == 'console.keepalive' and self._closer is not None:
+            # Viewers on another worker restart the idle grace period
+            self._cancel_closer()
+            self._closer = asyncio.create_task(self._close_when_idle())
+        elif kind == 'console.sync' and self._console is not None:
+            _, data = self.buffer.read_from(self.buffer.start)
+            await self.channel_layer.send(message['reply_to'], {
+                'type': 'console.output',
+                'data': data,
+                'start': self.buffer.start,
+                'seq': self.buffer.end,
+                'stream': self.stream_id
+            })
+
+    def _mirror(self, frame):
+        """Copy a frame of the leader's output into this worker's buffer, at the same sequence numbers."""
+        start, seq, data = frame['start'], frame['seq'], frame['data']
+        if frame.get('stream') != self.stream_id or start > self.buffer.end:
+            # Another stream, or frames this worker missed
+            self.stream_id = frame.get('stream')
+            self.buffer.reset(start)
+        if seq > self.buffer.end:
+            self.buffer.append(data[self.buffer.end - start:])
+        self._synced.set()
+
+
+_hubs = {}
+
+
+def _shared_layer(channel_layer):
+    try:
+        from channels_redis.core import RedisChannelLayer
+    except ImportError:
+        return False
+    return isinstance(channel_layer, RedisChannelLayer)
+
+
+def get_console_hub(statefulset_name, backend, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Return the process-wide hub for a server."""
+    key = (cluster, namespace, statefulset_name)
+    hub = _hubs.get(key)
+    if hub is None or (hub.is_idle() and hub.backend != backend):
+        hub_class = SharedConsoleHub if _shared_layer(get_channel_layer()) else ConsoleHub
+        hub = hub_class(statefulset_name, backend, namespace, cluster)
+        _hubs[key] = hub
+    return hub
@@ -1,53 +1,102 @@
 import json
-import threading
+import struct
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .server_utils import attach_to_console, get_pod_name, load_kube_config, get_statefulsets_managed_by_mindworld, list_kubernetes_nodes
-from websocket import WebSocketConnectionClosedException
-from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from .async_server_utils import console_backend_for, list_kubernetes_nodes
+from .catalog import server_catalog, list_servers
+from .console_hub import get_console_hub
+from .kube_clients import DEFAULT_CLUSTER, cluster_names
+from .broadcasters import node_overview_publisher, server_status_publisher
+from .server_metrics import metrics_collector
+from .instrumentation import WEBSOCKETS_OPEN
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
-class NodesConsumer(AsyncWebsocketConsumer):
+class InstrumentedConsumer(AsyncWebsocketConsumer):
+    """Count open websockets per consumer class in mindworld_websockets_open."""
+
+    async def websocket_connect(self, message):
+        WEBSOCKETS_OPEN.labels(type(self).__name__).inc()
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        WEBSOCKETS_OPEN.labels(type(self).__name__).dec()
+        await super().websocket_disconnect(message)
+
+class NodesConsumer(InstrumentedConsumer):
     async def connect(self):
+        await self.channel_layer.group_add(node_overview_publisher.group, self.channel_name)
         await self.accept()
-        self.thread = threading.Thread(target=self.send_node_status)
-        self.thread.start()
+
+        node_overview_publisher.subscribe()
+        self.subscribed = True
+        nodes = await list_kubernetes_nodes()
+        await self.send(text_data=json.dumps({
+            'type': 'node.status',
+            'data': nodes
+        }))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("nodes", self.channel_name)
+        await self.channel_layer.group_discard(node_overview_publisher.group, self.channel_name)
+        if getattr(self, 'subscribed', False):
+            self.subscribed = False
+            node_overview_publisher.unsubscribe()
 
     async def receive(self, text_data):
         pass
 
-    def send_node_status(self):
-        while True:
-            nodes = list_kubernetes_nodes()
-            async_to_sync(self.send)(text_data=json.dumps({
-                'type': 'node.status',
-                'data': nodes
-            }))
+    async def node_status(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'node.status',
+            'data': event['nodes'],
+            'removed': event.get('removed', []),
+            'partial': event.get('partial', False)
+        }))
 
-class ConsoleConsumer(AsyncWebsocketConsumer):
+class ConsoleConsumer(InstrumentedConsumer):
     async def connect(self):
         self.namespace = self.scope['url_route']['kwargs']['namespace']
         self.deployment_name = self.scope['url_route']['kwargs']['deployment_name']
-        
-        self.pod_name = get_pod_name(self.deployment_name)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.cluster = query.get('cluster', [DEFAULT_CLUSTER])[0]
+        if self.cluster not in cluster_names():
+            await self.close(code=4004)
+            return
 
-        load_kube_config()
-        self.ws_client = attach_to_console(self.pod_name)
+        backend = await console_backend_for(self.deployment_name, self.namespace, self.cluster)
+        self.hub = get_console_hub(self.deployment_name, backend, self.namespace, self.cluster)
+        await self.hub.join(self.channel_name)
 
         await self.accept()
 
-        self.thread = threading.Thread(target=self.read_console_output)
-        self.thread.start()
+        # Replay scrollback, or resume after ?since=<seq> when reconnecting.
+        # Sequence numbers only mean something within one hub's stream, and a
+        # reconnect may land on another worker, so the stream has to match.
+        self.binary = query.get('format') == ['binary']
+        since = query.get('since')
+        try:
+            since = int(since[0]) if since else None
+        except ValueError:
+            since = None
+        if query.get('stream') != [self.hub.stream_id]:
+            since = None
+        _, self.last_seq, data, resumed = self.hub.scrollback(since)
+        await self.send(text_data=json.dumps({
+            'message': data.decode('utf-8', errors='replace'),
+            'seq': self.last_seq,
+            'stream': self.hub.stream_id,
+            'replay': True,
+            'resumed': resumed
+        }))
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'hub'):
+            return
         try:
-            self.ws_client.write_stdin("exit\n")
-            self.ws_client.close()
+            await self.hub.leave(self.channel_name)
         except Exception as e:
             logger.error(f"Error during disconnect: {e}")
 
@@ -55,32 +104,57 @@ class ConsoleConsumer(AsyncWebsocketConsumer):
         try:
             command = json.loads(text_data).get('command')
             if command:
-                logger.info(f"Received command: {command}")
-                self.ws_client.write_stdin(command + "\n")
+                logger.debug(f"Received command: {command}")
+                await self.hub.write(command + "\n")
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
         except Exception as e:
             logger.error(f"Error writing command to stdin: {e}")
 
-    def read_console_output(self):
-        try:
-            while True:
-                message = self.ws_client.read_stdout()
-                if message:
-                    logger.info(f"Console output: {message}")
-                    async_to_sync(self.send)(text_data=json.dumps({'message': message}))
-        except WebSocketConnectionClosedException:
-            logger.warning("WebSocket connection closed.")
-        except Exception as e:
-            logger.error(f"Error reading console output: {e}")
-
-class ServerStatusConsumer(AsyncWebsocketConsumer):
+    async def console_output(self, event):
+        """Forward a frame of console output.
+
+        Frames cover a byte range of the hub's buffer. Any part already sent
+        is trimmed, and any gap (frames the channel layer dropped because this
+        viewer fell behind) is reported as ``skipped`` bytes. In binary mode
+        a frame is an 8-byte sequence number and a 4-byte skipped count
+        (both big-endian) followed by the raw output.
+        """
+        start, seq, data = event['start'], event['seq'], event['data']
+        if seq <= self.last_seq:
+            return
+        if start < self.last_seq:
+            data = data[self.last_seq - start:]
+        skipped = max(0, start - self.last_seq)
+        self.last_seq = seq
+
+        if self.binary:
+            await self.send(bytes_data=struct.pack('>QI', seq, min(skipped, 0xFFFFFFFF)) + data)
+            return
+        message = data.decode('utf-8', errors='replace')
+        if skipped:
+            message = f"[... {skipped} bytes of output skipped ...]\n" + message
+        await self.send(text_data=json.dumps({'message': message, 'seq': seq, 'skipped': skipped}))
+
+    async def console_closed(self, event):
+        # Not a normal closure, so the page reconnects and reopens the upstream
+        await self.close(code=4000)
+
+def server_catalog_snapshot():
+    server_catalog.wait_for_sync()
+    return list_servers()[1]
+
+class ServerStatusConsumer(InstrumentedConsumer):
     async def connect(self):
+        # Restart progress is published cluster-wide, status deltas by this worker's informer
         await self.channel_layer.group_add("servers", self.channel_name)
+        await self.channel_layer.group_add(server_status_publisher.group, self.channel_name)
         await self.accept()
 
         # Send initial server status data
-        servers = get_statefulsets_managed_by_mindworld()
+        servers = await database_sync_to_async(server_catalog_snapshot)()
+        server_status_publisher.start()
+        metrics_collector.start()
         await self.send(text_data=json.dumps({
             'type': 'server.status',
             'data': servers
@@ -88,6 +162,7 @@ class ServerStatusConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard("servers", self.channel_name)
+        await self.channel_layer.group_discard(server_status_publisher.group, self.channel_name)
 
     async def receive(self, text_data):
         pass
@@ -96,5 +171,41 @@ class ServerStatusConsumer(AsyncWebsocketConsumer):
         servers = event['servers']
         await self.send(text_data=json.dumps({
             'type': 'server.status',
-            'data': servers
+            'data': servers,
+            'removed': event.get('removed', []),
+            'partial': event.get('partial', False)
+        }))
+
+    async def server_restart(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'server.restart',
+            'data': event['job']
+        }))
+
+    async def server_backup(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'server.backup',
+            'data': event['job']
+        }))
+
+class MetricsConsumer(InstrumentedConsumer):
+    async def connect(self):
+        await self.channel_layer.group_add(metrics_collector.group, self.channel_name)
+        await self.accept()
+        metrics_collector.start()
+        await self.send(text_data=json.dumps({
+            'type': 'metrics.sample',
+            'data': metrics_collector.latest()
+        }))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(metrics_collector.group, self.channel_name)
+
+    async def receive(self, text_data):
+        pass
+
+    async def metrics_sample(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'metrics.sample',
+            'data': event['samples']
         }))
@@ -0,0 +1,241 @@
+"""File access to a server's data volume over exec.
+
+Every operation is one exec into the server container running the
+image's standard tools (find, tar, head, tail, dd, gzip). Data is streamed
+through the exec websocket in chunks in both directions, so a transfer runs
+at constant memory however big the world is, and the async views using
+this never hold a worker thread for the length of a transfer.
+"""
+import json
+import logging
+import posixpath
+from collections import namedtuple
+import aiohttp
+from kubernetes_asyncio.client.rest import ApiException
+from kubernetes_asyncio.stream.ws_client import STDIN_CHANNEL, STDOUT_CHANNEL, STDERR_CHANNEL, ERROR_CHANNEL
+from .kube_clients import DEFAULT_CLUSTER, get_async_registry
+from .server_utils import NAMESPACE, CONTAINER_NAME, get_pod_name, is_managed_by_mindworld
+
+logger = logging.getLogger(__name__)
+
+# Mount path of the minecraft-data volume.
+DATA_ROOT = '/data'
+FILE_CHUNK_SIZE = 64 * 1024
+# stderr kept for error messages, the rest is dropped.
+STDERR_LIMIT = 4096
+
+# find -printf format: type, size, mtime and name, NUL terminated.
+_ENTRY_FORMAT = '%y\\t%s\\t%T@\\t%f\\0'
+_ENTRY_TYPES = {'d': 'directory', 'f': 'file', 'l': 'symlink'}
+
+
+class FileError(Exception):
+    """A file operation that failed, with the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# A pod to exec into, with the namespace and cluster it runs in.
+PodRef = namedtuple('PodRef', ['name', 'namespace', 'cluster'])
+
+
+def resolve_path(path):
+    """Map a path relative to the volume onto a container path inside DATA_ROOT."""
+    # Normalising against "/" folds any "..", so the result cannot leave the root
+    relative = posixpath.normpath('/' + (path or '')).lstrip('/')
+    return posixpath.join(DATA_ROOT, relative) if relative else DATA_ROOT
+
+
+class ExecStream:
+    """A non-interactive exec whose stdin and stdout are streamed in chunks."""
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._stderr = bytearray()
+        self.status = None
+
+    @classmethod
+    async def open(cls, pod, command, stdin=False):
+        core_api = await get_async_registry(pod.cluster).exec_core_api()
+        ws = await (await core_api.connect_get_namespaced_pod_exec(pod.name, pod.namespace,
+                                                                   command=command,
+                                                                   container=CONTAINER_NAME,
+                                                                   stderr=True, stdin=stdin,
+                                                                   stdout=True, tty=False,
+                                                                   _preload_content=False))
+        return cls(ws)
+
+    async def chunks(self):
+        """Yield stdout as it arrives until the command exits."""
+        try:
+            while True:
+                msg = await self._ws.receive()
+                if msg.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                    return
+                data = msg.data if isinstance(msg.data, bytes) else msg.data.encode('utf-8')
+                if len(data) < 2:
+                    continue
+                channel, payload = data[0], data[1:]
+                if channel == STDOUT_CHANNEL:
+                    yield payload
+                elif channel == STDERR_CHANNEL:
+                    self._stderr.extend(payload[:STDERR_LIMIT - len(self._stderr)])
+                elif channel == ERROR_CHANNEL:
+                    self.status = json.loads(payload)
+        finally:
+            await self.close()
+
+    async def write(self, data):
+        for offset in range(0, len(data), FILE_CHUNK_SIZE):
+            await self._ws.send_bytes(bytes([STDIN_CHANNEL]) + data[offset:offset + FILE_CHUNK_SIZE])
+
+    async def output(self):
+        """Wait for the command to exit and return all of its stdout (small outputs only)."""
+        return b''.join([chunk async for chunk in self.chunks()])
+
+    @property
+    def succeeded(self):
+        return self.status is not None and self.status.get('status') == 'Success'
+
+    @property
+    def error(self):
+        stderr = self._stderr.decode('utf-8', errors='replace').strip()
+        return stderr or (self.status or {}).get('message') or "Command failed"
+
+    async def close(self):
+        await self._ws.close()
+
+
+async def server_pod(name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Return the PodRef of managed server ``name``, raising FileError if it has no running pod."""
+    clients = get_async_registry(cluster)
+    apps_api = await clients.apps_api()
+    core_api = await clients.core_api()
+    try:
+        sts = await apps_api.read_namespaced_stateful_set(name, namespace)
+        if not is_managed_by_mindworld(sts):
+            raise FileError("Unknown server", status=404)
+        pod = await core_api.read_namespaced_pod(get_pod_name(name), namespace)
+    except ApiException as e:
+        if e.status == 404:
+            raise FileError("Unknown server or server not running", status=404)
+        raise
+    if pod.status.phase != 'Running':
+        raise FileError("The server is not running", status=409)
+    return PodRef(pod.metadata.name, namespace, cluster)
+
+
+def _parse_entries(output):
+    entries = []
+    for record in output.split(b'\0'):
+        if not record:
+            continue
+        kind, size, modified, name = record.decode('utf-8', errors='surrogateescape').split('\t', 3)
+        entries.append({
+            'name': name,
+            'type': _ENTRY_TYPES.get(kind, 'other'),
+            'size': int(size),
+            'modified': float(modified)
+        })
+    return entries
+
+
+async def stat(pod, path):
+    """Return the entry for ``path`` (see list_directory), or None if it does not exist."""
+    process = await ExecStream.open(pod, ['find', resolve_path(path), '-maxdepth', '0', '-printf', _ENTRY_FORMAT])
+    entries = _parse_entries(await process.output())
+    return entries[0] if entries else None
+
+
+async def list_directory(pod, path):
+    """Return ``[{name, type, size, modified}, ...]`` for a directory, directories first."""
+    process = await ExecStream.open(pod, ['find', resolve_path(path), '-mindepth', '1', '-maxdepth', '1',
+                                               '-printf', _ENTRY_FORMAT])
+    output = await process.output()
+    if not process.succeeded:
+        raise FileError(process.error, status=404)
+    return sorted(_parse_entries(output), key=lambda entry: (entry['type'] != 'directory', entry['name']))
+
+
+async def read_file(pod, path, start=0, length=None, compress=False):
+    """Yield the bytes of a file, or of ``length`` bytes from ``start``, optionally gzipped."""
+    full_path = resolve_path(path)
+    if start or length is not None:
+        # tail seeks on regular files, so resuming near the end of a big file is cheap
+        script = 'tail -c +"$1" -- "$2"' + (' | head -c "$3"' if length is not None else '')
+        command = ['sh', '-c', script, 'sh', str(start + 1), full_path]
+        if length is not None:
+            command.append(str(length))
+    elif compress:
+        command = ['gzip', '-c', '--', full_path]
+    else:
+        command = ['cat', '--', full_path]
+    process = await ExecStream.open(pod, command)
+    async for chunk in process.chunks():
+        yield chunk
+    if not process.succeeded:
+        # Headers are already sent, so the client only sees a short body
+        logger.error(f"Reading {full_path} in {pod.name} failed: {process.error}")
+
+
+async def read_archive(pod, path, compress=False):
+    """Yield a tar (or tar.gz) stream of a file or directory."""
+    full_path = resolve_path(path)
+    parent, base = posixpath.split(full_path) if full_path != DATA_ROOT else (DATA_ROOT, '.')
+    process = await ExecStream.open(pod, ['tar', '-czf' if compress else '-cf', '-', '-C', parent, base])
+    async for chunk in process.chunks():
+        yield chunk
+    if not process.succeeded:
+        logger.error(f"Archiving {full_path} in {pod.name} failed: {process.error}")
+
+
+async def exec_with_stdin(pod, command, chunks, size):
+    """Run ``command`` with exactly ``size`` bytes from ``chunks`` on stdin."""
+    process = await ExecStream.open(pod, command, stdin=True)
+    received = 0
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > size:
+                raise FileError("Request body is longer than Content-Length")
+            await process.write(chunk)
+    except BaseException:
+        # Closing the exec stops the command before it sees the rest of the data
+        await process.close()
+        raise
+    if received != size:
+        await process.close()
+        raise FileError(f"Request body ended after {received} of {size} bytes")
+
+    await process.output()
+    if not process.succeeded:
+        raise FileError(process.error, status=500)
+
+
+async def write_file(pod, path, chunks, size, offset=None):
+    """Write ``size`` bytes from ``chunks`` to a file.
+
+    Without ``offset`` the file is replaced once the upload is complete. With
+    ``offset`` the bytes are written at that position of the existing file,
+    which is how an interrupted upload is resumed.
+    """
+    full_path = resolve_path(path)
+    if full_path == DATA_ROOT:
+        raise FileError("Cannot write to the volume root")
+    if offset is None:
+        # The command stops reading after exactly "size" bytes, as the exec stdin cannot be half-closed
+        script = ('mkdir -p -- "$(dirname -- "$1")" && head -c "$2" > "$1.upload" && '
+                  'mv -f -- "$1.upload" "$1"')
+        command = ['sh', '-c', script, 'sh', full_path, str(size)]
+    else:
+        script = 'head -c "$2" | dd of="$1" bs=65536 seek="$3" oflag=seek_bytes conv=notrunc status=none'
+        command = ['sh', '-c', script, 'sh', full_path, str(size), str(offset)]
+    await exec_with_stdin(pod, command, chunks, size)
+
+
+async def extract_archive(pod, path, chunks, size, compressed=False):
+    """Extract a tar (or tar.gz) stream of ``size`` bytes into directory ``path``."""
+    script = f'mkdir -p -- "$1" && head -c "$2" | tar -x{"z" if compressed else ""}f - -C "$1"'
+    await exec_with_stdin(pod, ['sh', '-c', script, 'sh', resolve_path(path), str(size)], chunks, size)
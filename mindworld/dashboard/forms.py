@@ -1,7 +1,41 @@
+import re
 from django import forms
+from .kube_clients import DEFAULT_CLUSTER, cluster_names
+from .server_utils import NAMESPACE, WATCH_ALL_NAMESPACES, parse_jvm_memory
+from .server_templates import DEFAULT_SERVER_TEMPLATE, template_choices
+
+# Smallest heap a server is created with; below this the JVM cannot load a world.
+MIN_SERVER_MEMORY = 512 * 1024 ** 2
 
 class CreateServerForm(forms.Form):
     serverName = forms.CharField(max_length=100, label='Server Name')
+    template = forms.ChoiceField(choices=template_choices, label='Server Type', initial=DEFAULT_SERVER_TEMPLATE)
     memory = forms.CharField(max_length=10, label='Memory Allocation', initial='2G')
     maxPlayers = forms.IntegerField(label='Max Players', initial=20)
     eula = forms.BooleanField(label='I agree to the Minecraft EULA')
+    cluster = forms.ChoiceField(choices=lambda: [(name, name) for name in cluster_names()], label='Cluster',
+                                initial=DEFAULT_CLUSTER, required=False)
+    namespace = forms.CharField(max_length=63, label='Namespace', initial=NAMESPACE, required=False)
+
+    def clean_memory(self):
+        # The container is sized from this, so it has to be a valid JVM heap size
+        memory = self.cleaned_data['memory'].strip()
+        try:
+            size = parse_jvm_memory(memory)
+        except ValueError:
+            raise forms.ValidationError("Use a size like 2G or 1536M.")
+        if size < MIN_SERVER_MEMORY:
+            raise forms.ValidationError(f"A server needs at least {MIN_SERVER_MEMORY // 1024 ** 2}M of memory.")
+        return memory
+
+    def clean_cluster(self):
+        return self.cleaned_data['cluster'] or DEFAULT_CLUSTER
+
+    def clean_namespace(self):
+        namespace = self.cleaned_data['namespace'].strip() or NAMESPACE
+        if not re.fullmatch(r'[a-z0-9]([-a-z0-9]*[a-z0-9])?', namespace):
+            raise forms.ValidationError("Not a valid namespace name.")
+        # Servers outside the watched namespace would never show up in the panel
+        if not WATCH_ALL_NAMESPACES and namespace != NAMESPACE:
+            raise forms.ValidationError(f"Only the {NAMESPACE} namespace is watched.")
+        return namespace
@@ -0,0 +1,74 @@
+"""Scale idle servers to zero.
+
+Player counts come from the metrics collector. A server with nobody online
+for HIBERNATE_AFTER seconds is annotated as hibernated and scaled to zero;
+the wake proxy (``manage.py wake_proxy``) scales it back up when a player
+connects. Hibernation is off unless HIBERNATE_AFTER is set, and the scaler
+runs in a single process of its own (``manage.py idle_scaler``).
+"""
+import os
+import asyncio
+import logging
+from .server_metrics import metrics_collector
+from .server_utils import allows_hibernation, get_statefulset_informer, scale_statefulset, set_hibernated
+
+logger = logging.getLogger(__name__)
+
+# Seconds without players before a server is hibernated; 0 turns hibernation off.
+HIBERNATE_AFTER = int(os.getenv('HIBERNATE_AFTER', '0'))
+
+
+def hibernate_server(namespace, name):
+    """Annotate and scale a running server to zero. Returns True if it was hibernated."""
+    sts = get_statefulset_informer().get(f"{namespace}/{name}")
+    if sts is None or not sts.spec.replicas or not allows_hibernation(sts):
+        return False
+    # Annotate first so the status update for the scale-down already shows it as hibernated
+    if not set_hibernated(namespace, name, True):
+        return False
+    if not scale_statefulset(namespace, name, replicas=0):
+        set_hibernated(namespace, name, False)
+        return False
+    logger.info(f"Hibernated idle server {namespace}/{name}.")
+    return True
+
+
+class IdleScaler:
+    """Hibernate servers that have had no players for ``idle_after`` seconds.
+
+    Runs on the metrics collector's loop. A server whose player count cannot
+    be read (RCON down, still starting) counts as busy, and a server first
+    seen by this process gets a full idle period before it can be hibernated.
+    """
+
+    def __init__(self, idle_after):
+        self.idle_after = idle_after
+        self._last_active = {}
+        self._started = False
+
+    def start(self):
+        if self.idle_after <= 0:
+            return
+        if not self._started:
+            self._started = True
+            metrics_collector.add_listener(self.observe)
+        metrics_collector.start()
+
+    async def observe(self, samples, now):
+        seen = set()
+        for sample in samples:
+            key = (sample['namespace'], sample['name'])
+            seen.add(key)
+            last_active = self._last_active.setdefault(key, now)
+            if sample['players'] is None or sample['players'] > 0:
+                self._last_active[key] = now
+            elif now - last_active >= self.idle_after:
+                if await asyncio.to_thread(hibernate_server, *key):
+                    del self._last_active[key]
+
+        # Stopped servers start a new idle period when they come back
+        for key in [key for key in self._last_active if key not in seen]:
+            del self._last_active[key]
+
+
+idle_scaler = IdleScaler(HIBERNATE_AFTER)
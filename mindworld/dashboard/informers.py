@@ -0,0 +1,152 @@
+import logging
+import threading
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from .instrumentation import READER_THREADS
+
+logger = logging.getLogger(__name__)
+
+# Server-side timeout for a single watch request. The watch is re-established
+# from the last seen resourceVersion when it expires.
+WATCH_TIMEOUT_SECONDS = 300
+# Delay before relisting after an unexpected error.
+RETRY_BACKOFF_SECONDS = 5
+
+
+def object_key(obj):
+    """Return the cache key for a Kubernetes object (namespace/name, or name if cluster scoped)."""
+    namespace = obj.metadata.namespace
+    name = obj.metadata.name
+    return f"{namespace}/{name}" if namespace else name
+
+
+class Informer:
+    """Keep an in-memory copy of one resource kind using a single LIST+WATCH.
+
+    The informer runs in a daemon thread. Reads are served from the local
+    store and never touch the API server. ``list_func_factory`` returns the
+    API list method and is called again on every relist, so rotated
+    credentials are picked up.
+    """
+
+    def __init__(self, name, list_func_factory, **list_kwargs):
+        self.name = name
+        self.list_func_factory = list_func_factory
+        self.list_kwargs = list_kwargs
+        self._store = {}
+        self._lock = threading.Lock()
+        self._handlers = []
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def wait_for_sync(self, timeout=None):
+        """Block until the initial LIST has populated the store."""
+        return self._synced.wait(timeout)
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def add_handler(self, handler):
+        """Register ``handler(event_type, obj, old_obj)`` to be called on every change."""
+        # Copied rather than changed in place, the informer thread may be iterating it
+        self._handlers = self._handlers + [handler]
+
+    def remove_handler(self, handler):
+        self._handlers = [registered for registered in self._handlers if registered != handler]
+
+    def list(self):
+        """Return cached objects ordered by key, like a LIST response."""
+        with self._lock:
+            return [self._store[key] for key in sorted(self._store)]
+
+    def get(self, key):
+        with self._lock:
+            return self._store.get(key)
+
+    def _notify(self, event_type, obj, old_obj):
+        for handler in self._handlers:
+            try:
+                handler(event_type, obj, old_obj)
+            except Exception as e:
+                logger.error(f"Error in {self.name} informer handler: {e}")
+
+    def _relist(self, list_func):
+        result = list_func(**self.list_kwargs)
+        fresh = {object_key(obj): obj for obj in result.items}
+
+        with self._lock:
+            previous = self._store
+            self._store = fresh
+
+        # Replay the difference so handlers stay consistent after a relist
+        for key, obj in fresh.items():
+            old_obj = previous.get(key)
+            if old_obj is None:
+                self._notify("ADDED", obj, None)
+            elif old_obj.metadata.resource_version != obj.metadata.resource_version:
+                self._notify("MODIFIED", obj, old_obj)
+        for key, old_obj in previous.items():
+            if key not in fresh:
+                self._notify("DELETED", old_obj, old_obj)
+
+        self._synced.set()
+        return result.metadata.resource_version
+
+    def _apply(self, event_type, obj):
+        key = object_key(obj)
+        with self._lock:
+            old_obj = self._store.get(key)
+            if event_type == "DELETED":
+                self._store.pop(key, None)
+            else:
+                self._store[key] = obj
+        self._notify(event_type, obj, old_obj)
+
+    def _run(self):
+        READER_THREADS.labels(self.name).inc()
+        try:
+            self._list_and_watch()
+        finally:
+            READER_THREADS.labels(self.name).dec()
+
+    def _list_and_watch(self):
+        while not self._stopped.is_set():
+            try:
+                list_func = self.list_func_factory()
+                resource_version = self._relist(list_func)
+                while not self._stopped.is_set():
+                    self._watch = watch.Watch()
+                    for event in self._watch.stream(list_func,
+                                                    resource_version=resource_version,
+                                                    timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                                                    allow_watch_bookmarks=True,
+                                                    **self.list_kwargs):
+                        if event['type'] == "BOOKMARK":
+                            # Bookmarks are not deserialised, only the raw object carries the version
+                            resource_version = event['raw_object']['metadata']['resourceVersion']
+                        elif event['type'] in ("ADDED", "MODIFIED", "DELETED"):
+                            obj = event['object']
+                            resource_version = obj.metadata.resource_version
+                            self._apply(event['type'], obj)
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info(f"{self.name} informer resource version expired, relisting.")
+                    continue
+                logger.error(f"Exception in {self.name} informer: {e}")
+                self._stopped.wait(RETRY_BACKOFF_SECONDS)
+            except Exception as e:
+                logger.error(f"Unexpected error in {self.name} informer: {e}")
+                self._stopped.wait(RETRY_BACKOFF_SECONDS)
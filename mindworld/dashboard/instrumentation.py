@@ -0,0 +1,211 @@
+"""Prometheus metrics and optional OpenTelemetry tracing.
+
+Kubernetes calls are timed at the REST layer of every client the registries
+hand out, so each call is counted by cluster, verb, resource and status
+without touching the call sites. Views are timed by MetricsMiddleware and
+everything is served at /metrics.
+
+With OTEL_ENABLED the same points also open spans (the OpenTelemetry API
+has to be installed, exporters are configured the usual OTEL_* way). A
+view's span is current while it runs, so the apiserver calls a dashboard
+click triggers show up as its children. Work a view hands to a thread
+(bulk actions, restarts, warm pool hand-overs) is started in a copy of the
+view's context to stay in its trace.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from kubernetes_asyncio.stream import WsApiClient
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+OTEL_ENABLED = os.getenv('OTEL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+KUBE_REQUEST_SECONDS = Histogram(
+    'mindworld_kube_request_duration_seconds',
+    "Kubernetes API calls by cluster, verb, resource and status. Watches and exec streams are timed to the response headers.",
+    ['cluster', 'verb', 'resource', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+VIEW_SECONDS = Histogram(
+    'mindworld_view_duration_seconds',
+    "Time until a view returned its response (streamed bodies are not included).",
+    ['view', 'method', 'status']
+)
+WEBSOCKETS_OPEN = Gauge('mindworld_websockets_open', "Open websockets by consumer.", ['consumer'])
+READER_THREADS = Gauge('mindworld_reader_threads', "Running informer threads reading from the apiserver.",
+                       ['reader'])
+
+_HTTP_VERBS = {'POST': 'create', 'PUT': 'replace', 'PATCH': 'patch', 'DELETE': 'delete'}
+_tracer = None
+
+
+def request_verb_and_resource(method, url, query_params=None):
+    """Map an API request to a Kubernetes verb and resource, e.g. ``('list', 'pods')``."""
+    parts = urlsplit(url)
+    query = [(key, str(value).lower()) for key, value in parse_qsl(parts.query) + list(query_params or [])]
+    segments = [segment for segment in parts.path.split('/') if segment]
+    # /api/v1/... or /apis/<group>/<version>/...
+    segments = segments[2:] if segments[:1] == ['api'] else segments[3:]
+    if len(segments) > 2 and segments[0] == 'namespaces':
+        segments = segments[2:]
+    if not segments:
+        return method.lower(), 'unknown'
+
+    resource = segments[0] if len(segments) < 3 else f"{segments[0]}/{segments[2]}"
+    if resource.endswith(('/exec', '/attach')):
+        return 'exec', resource
+    if method == 'GET':
+        if ('watch', 'true') in query or ('watch', '1') in query:
+            return 'watch', resource
+        return 'list' if len(segments) == 1 else 'get', resource
+    if method == 'DELETE' and len(segments) == 1:
+        return 'deletecollection', resource
+    return _HTTP_VERBS.get(method, method.lower()), resource
+
+
+def _get_tracer():
+    global _tracer, OTEL_ENABLED
+    if _tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            logger.warning("OTEL_ENABLED is set but opentelemetry is not installed, tracing is off.")
+            OTEL_ENABLED = False
+            return None
+        _tracer = trace.get_tracer('mindworld')
+    return _tracer
+
+
+@contextmanager
+def span(name, **attributes):
+    """Run the block in an OpenTelemetry span when tracing is on."""
+    tracer = _get_tracer() if OTEL_ENABLED else None
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+@contextmanager
+def _observe_request(cluster, method, url, query_params=None):
+    """Time the block as one API call. It stores the HTTP status in the yielded dict."""
+    verb, resource = request_verb_and_resource(method, url, query_params)
+    outcome = {'status': None}
+    started = time.perf_counter()
+    try:
+        with span(f"kubernetes {verb} {resource}", **{'k8s.cluster': cluster, 'http.method': method}) as current:
+            try:
+                yield outcome
+            except Exception as e:
+                # ApiException carries the status, connection errors have none
+                outcome['status'] = getattr(e, 'status', None)
+                raise
+            finally:
+                if current is not None:
+                    current.set_attribute('http.status_code', str(outcome['status'] or 'error'))
+    finally:
+        KUBE_REQUEST_SECONDS.labels(cluster, verb, resource, str(outcome['status'] or 'error')).observe(
+            time.perf_counter() - started)
+
+
+class _TimedConnect:
+    """A pending exec websocket connect that is timed when it is awaited."""
+
+    def __init__(self, connect, cluster, url):
+        self._connect = connect
+        self._cluster = cluster
+        self._url = url
+
+    def __await__(self):
+        return self._timed().__await__()
+
+    async def _timed(self):
+        with _observe_request(self._cluster, 'GET', self._url) as outcome:
+            ws = await self._connect
+            outcome['status'] = 101
+            return ws
+
+
+def instrument_api_client(api_client, cluster):
+    """Time every request ``api_client`` (blocking client) makes."""
+    rest_client = api_client.rest_client
+    request = rest_client.request
+
+    def timed_request(method, url, *args, **kwargs):
+        with _observe_request(cluster, method, url) as outcome:
+            response = request(method, url, *args, **kwargs)
+            outcome['status'] = response.status
+            return response
+
+    rest_client.request = timed_request
+    return api_client
+
+
+def instrument_async_api_client(api_client, cluster):
+    """Time every request a kubernetes_asyncio ApiClient or WsApiClient makes."""
+    if isinstance(api_client, WsApiClient):
+        # WsApiClient connects itself, without going through the REST client
+        request = api_client.request
+
+        async def timed_connect(method, url, *args, **kwargs):
+            result = await request(method, url, *args, **kwargs)
+            return _TimedConnect(result, cluster, url) if hasattr(result, '__await__') else result
+
+        api_client.request = timed_connect
+        return api_client
+
+    rest_client = api_client.rest_client
+    request = rest_client.request
+
+    async def timed_request(method, url, *args, **kwargs):
+        with _observe_request(cluster, method, url, kwargs.get('query_params')) as outcome:
+            response = await request(method, url, *args, **kwargs)
+            outcome['status'] = response.status
+            return response
+
+    rest_client.request = timed_request
+    return api_client
+
+
+def _observe_view(request, response, started, current):
+    match = request.resolver_match
+    view = match.view_name if match is not None else 'unmatched'
+    VIEW_SECONDS.labels(view, request.method, response.status_code).observe(time.perf_counter() - started)
+    if current is not None:
+        current.update_name(f"{request.method} {view}")
+        current.set_attribute('http.status_code', response.status_code)
+
+
+class MetricsMiddleware:
+    """Time every view and run it in a span, for sync and async views alike."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        started = time.perf_counter()
+        with span(request.method, **{'http.target': request.path}) as current:
+            response = self.get_response(request)
+            _observe_view(request, response, started, current)
+        return response
+
+    async def _acall(self, request):
+        started = time.perf_counter()
+        with span(request.method, **{'http.target': request.path}) as current:
+            response = await self.get_response(request)
+            _observe_view(request, response, started, current)
+        return response
@@ -0,0 +1,238 @@
+"""Process-wide Kubernetes client registries, one per cluster.
+
+Configuration is loaded once (in-cluster first, then kubeconfig) and a single
+pooled ApiClient is shared by every caller. The registry only reloads when
+the credential files on disk change, e.g. after a token or kubeconfig rotation.
+
+The cluster the panel runs in (or the current kubeconfig context) is
+DEFAULT_CLUSTER. KUBE_CLUSTERS adds more clusters as ``name=context`` pairs
+from the kubeconfig, each with its own registries.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from kubernetes import client, config
+from kubernetes.config.incluster_config import SERVICE_TOKEN_FILENAME
+from kubernetes.config.kube_config import KUBE_CONFIG_DEFAULT_LOCATION
+import kubernetes_asyncio.client as async_client
+import kubernetes_asyncio.config as async_config
+from kubernetes_asyncio.stream import WsApiClient
+from .instrumentation import instrument_api_client, instrument_async_api_client
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of pooled connections to the apiserver.
+KUBE_POOL_MAXSIZE = int(os.getenv('KUBE_POOL_MAXSIZE', '32'))
+# How often (seconds) credential files are checked for rotation.
+KUBE_CREDENTIAL_CHECK_INTERVAL = float(os.getenv('KUBE_CREDENTIAL_CHECK_INTERVAL', '30'))
+# Extra clusters managed by the panel, e.g. "eu=eu-prod,us=us-prod" (cluster name=kubeconfig context).
+KUBE_CLUSTERS = os.getenv('KUBE_CLUSTERS', '')
+DEFAULT_CLUSTER = 'default'
+CLUSTER_NAME_RE = re.compile(r'[a-z0-9]([-a-z0-9]*[a-z0-9])?')
+
+
+def _in_cluster():
+    return 'KUBERNETES_SERVICE_HOST' in os.environ and os.path.exists(SERVICE_TOKEN_FILENAME)
+
+
+def credential_fingerprint():
+    """Return a value that changes whenever the credentials on disk change."""
+    if _in_cluster():
+        paths = [SERVICE_TOKEN_FILENAME]
+    else:
+        paths = [os.path.expanduser(path) for path in KUBE_CONFIG_DEFAULT_LOCATION.split(os.pathsep)]
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+def parse_clusters(value):
+    """Parse KUBE_CLUSTERS into ``{cluster name: kubeconfig context}``, DEFAULT_CLUSTER first."""
+    clusters = {DEFAULT_CLUSTER: None}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, _, context = entry.partition('=')
+        name = name.strip()
+        if not CLUSTER_NAME_RE.fullmatch(name):
+            # Cluster names end up in URLs, cache keys and channel group names
+            raise ValueError(f"Invalid cluster name: {name!r}")
+        if name in clusters:
+            raise ValueError(f"Cluster {name} is configured twice")
+        clusters[name] = context.strip() or name
+    return clusters
+
+
+class ClientRegistry:
+    """Lazily build and share one pooled ApiClient for the blocking client.
+
+    ``context`` selects a kubeconfig context; None is the in-cluster config
+    or the current context. ``cluster`` names the cluster in metrics.
+    """
+
+    def __init__(self, context=None, cluster=DEFAULT_CLUSTER):
+        self.context = context
+        self.cluster = cluster
+        self._lock = threading.Lock()
+        self._configuration = None
+        self._api_client = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+
+    def _load_configuration(self):
+        configuration = client.Configuration()
+        if self.context is None and _in_cluster():
+            config.load_incluster_config(client_configuration=configuration)
+        else:
+            config.load_kube_config(context=self.context, client_configuration=configuration)
+        configuration.connection_pool_maxsize = KUBE_POOL_MAXSIZE
+        configuration.keep_alive = True
+        return configuration
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._api_client is not None and now - self._checked_at < KUBE_CREDENTIAL_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        fingerprint = credential_fingerprint()
+        if self._api_client is not None and fingerprint == self._fingerprint:
+            return
+
+        if self._api_client is not None:
+            logger.info("Kubernetes credentials changed, reloading configuration.")
+        self._configuration = self._load_configuration()
+        # The previous client is left to the garbage collector because calls
+        # on other threads may still be using its pool.
+        self._api_client = instrument_api_client(client.ApiClient(self._configuration), self.cluster)
+        self._fingerprint = fingerprint
+
+    def api_client(self):
+        with self._lock:
+            self._refresh()
+            return self._api_client
+
+    def configuration(self):
+        with self._lock:
+            self._refresh()
+            return self._configuration
+
+    def apps_api(self):
+        return client.AppsV1Api(self.api_client())
+
+    def core_api(self):
+        return client.CoreV1Api(self.api_client())
+
+
+class AsyncClientRegistry:
+    """Share one pooled kubernetes_asyncio ApiClient per event loop."""
+
+    def __init__(self, context=None, cluster=DEFAULT_CLUSTER):
+        self.context = context
+        self.cluster = cluster
+        self._lock = None
+        self._loop = None
+        self._configuration = None
+        self._api_client = None
+        self._ws_api_client = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+
+    async def _load_configuration(self):
+        configuration = async_client.Configuration()
+        if self.context is None and _in_cluster():
+            async_config.load_incluster_config(client_configuration=configuration)
+        else:
+            await async_config.load_kube_config(context=self.context, client_configuration=configuration)
+        configuration.connection_pool_maxsize = KUBE_POOL_MAXSIZE
+        return configuration
+
+    async def _refresh(self):
+        now = time.monotonic()
+        if self._api_client is not None and now - self._checked_at < KUBE_CREDENTIAL_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        fingerprint = credential_fingerprint()
+        if self._api_client is not None and fingerprint == self._fingerprint:
+            return
+
+        if self._api_client is not None:
+            logger.info("Kubernetes credentials changed, reloading configuration.")
+        old_clients = (self._api_client, self._ws_api_client)
+        self._configuration = await self._load_configuration()
+        self._api_client = instrument_async_api_client(async_client.ApiClient(self._configuration), self.cluster)
+        self._ws_api_client = instrument_async_api_client(WsApiClient(self._configuration), self.cluster)
+        self._fingerprint = fingerprint
+
+        for old_client in old_clients:
+            if old_client is not None:
+                # Give in-flight requests a moment before closing the old pool
+                asyncio.get_running_loop().call_later(60, lambda c=old_client: asyncio.ensure_future(c.close()))
+
+    async def _ensure(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # aiohttp sessions are bound to the loop that created them
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._api_client = None
+            self._ws_api_client = None
+        async with self._lock:
+            await self._refresh()
+
+    async def api_client(self):
+        await self._ensure()
+        return self._api_client
+
+    async def ws_api_client(self):
+        await self._ensure()
+        return self._ws_api_client
+
+    async def apps_api(self):
+        return async_client.AppsV1Api(await self.api_client())
+
+    async def core_api(self):
+        return async_client.CoreV1Api(await self.api_client())
+
+    async def exec_core_api(self):
+        return async_client.CoreV1Api(await self.ws_api_client())
+
+    async def custom_objects_api(self):
+        return async_client.CustomObjectsApi(await self.api_client())
+
+
+CLUSTERS = parse_clusters(KUBE_CLUSTERS)
+_registries = {name: ClientRegistry(context, name) for name, context in CLUSTERS.items()}
+_async_registries = {name: AsyncClientRegistry(context, name) for name, context in CLUSTERS.items()}
+
+
+def cluster_names():
+    return list(CLUSTERS)
+
+
+def get_registry(cluster=DEFAULT_CLUSTER):
+    """Return the blocking client registry of ``cluster``. Raises ValueError if it is unknown."""
+    try:
+        return _registries[cluster]
+    except KeyError:
+        raise ValueError(f"Unknown cluster: {cluster}")
+
+
+def get_async_registry(cluster=DEFAULT_CLUSTER):
+    try:
+        return _async_registries[cluster]
+    except KeyError:
+        raise ValueError(f"Unknown cluster: {cluster}")
+
+
+registry = get_registry()
+async_registry = get_async_registry()
@@ -0,0 +1,54 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from kubernetes.client.rest import ApiException
+from dashboard.backups import BackupJob, run_job
+from dashboard.kube_clients import DEFAULT_CLUSTER, cluster_names, get_registry
+from dashboard.server_utils import NAMESPACE, WATCH_ALL_NAMESPACES, is_managed_by_mindworld
+
+
+class Command(BaseCommand):
+    help = "Back up server worlds, uploading only the chunks that changed since the last snapshot (run nightly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Servers to back up.")
+        parser.add_argument('--all', action='store_true', help="Back up every managed server of every cluster.")
+        parser.add_argument('--namespace', default=NAMESPACE, help="Namespace of the named servers.")
+        parser.add_argument('--cluster', default=DEFAULT_CLUSTER, choices=cluster_names(),
+                            help="Cluster of the named servers.")
+
+    def handle(self, *args, **options):
+        servers = [(options['cluster'], options['namespace'], name) for name in options['names']]
+        if options['all']:
+            servers = []
+            for cluster in cluster_names():
+                apps_api = get_registry(cluster).apps_api()
+                try:
+                    if WATCH_ALL_NAMESPACES:
+                        statefulsets = apps_api.list_stateful_set_for_all_namespaces().items
+                    else:
+                        statefulsets = apps_api.list_namespaced_stateful_set(NAMESPACE).items
+                except ApiException as e:
+                    raise CommandError(f"Could not list StatefulSets of cluster {cluster}: {e}")
+                servers += [(cluster, sts.metadata.namespace, sts.metadata.name)
+                            for sts in statefulsets if is_managed_by_mindworld(sts)]
+        if not servers:
+            raise CommandError("Name the servers to back up, or pass --all.")
+
+        # Backups beyond BACKUP_CONCURRENCY wait for a slot
+        jobs = asyncio.run(self._backup(servers))
+        failed = []
+        for job in jobs:
+            if job.state == 'done':
+                stats = job.stats
+                self.stdout.write(self.style.SUCCESS(
+                    f"Backed up {job.name} as {job.snapshot_id}: {stats['changed_files']} of {stats['files']} files "
+                    f"changed, {stats['uploaded_chunks']} new chunks ({stats['uploaded_bytes']} bytes) uploaded"))
+            else:
+                failed.append(job.name)
+                self.stderr.write(f"Failed to back up {job.name}: {job.message}")
+        if failed:
+            raise CommandError(f"Backup failed for: {', '.join(failed)}")
+
+    async def _backup(self, servers):
+        return await asyncio.gather(*(run_job(BackupJob('backup', namespace, name, cluster=cluster))
+                                      for cluster, namespace, name in servers))
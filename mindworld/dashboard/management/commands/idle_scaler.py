@@ -0,0 +1,19 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from dashboard.hibernation import HIBERNATE_AFTER, idle_scaler
+
+
+class Command(BaseCommand):
+    help = "Hibernate servers that have had no players for HIBERNATE_AFTER seconds (run as a single replica)."
+
+    def handle(self, *args, **options):
+        if HIBERNATE_AFTER <= 0:
+            raise CommandError("Hibernation is off, set HIBERNATE_AFTER to the idle seconds before a server "
+                               "is scaled to zero.")
+        asyncio.run(self._run())
+
+    async def _run(self):
+        idle_scaler.start()
+        self.stdout.write(f"Hibernating servers idle for {HIBERNATE_AFTER} seconds.")
+        # The scaler runs on the metrics collector's thread
+        await asyncio.Event().wait()
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from kubernetes.client.rest import ApiException
+from dashboard.kube_clients import DEFAULT_CLUSTER, cluster_names, get_registry
+from dashboard.server_utils import NAMESPACE, WATCH_ALL_NAMESPACES, is_managed_by_mindworld, migrate_server_labels, needs_label_migration
+
+
+class Command(BaseCommand):
+    help = "Move servers created with the shared app=minecraft-server selector onto per-server labels."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Servers to migrate (default: every managed server).")
+        parser.add_argument('--cluster', default=DEFAULT_CLUSTER, choices=cluster_names(), help="Cluster to migrate.")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the servers that need migrating.")
+
+    def handle(self, *args, **options):
+        cluster = options['cluster']
+        apps_api = get_registry(cluster).apps_api()
+        try:
+            if WATCH_ALL_NAMESPACES:
+                statefulsets = apps_api.list_stateful_set_for_all_namespaces().items
+            else:
+                statefulsets = apps_api.list_namespaced_stateful_set(NAMESPACE).items
+        except ApiException as e:
+            raise CommandError(f"Could not list StatefulSets: {e}")
+
+        pending = [(sts.metadata.namespace, sts.metadata.name) for sts in statefulsets
+                   if is_managed_by_mindworld(sts) and needs_label_migration(sts)
+                   and (not options['names'] or sts.metadata.name in options['names'])]
+        if not pending:
+            self.stdout.write("All servers already use per-server labels.")
+            return
+
+        failed = []
+        for namespace, name in pending:
+            if options['dry_run']:
+                self.stdout.write(f"Would migrate {namespace}/{name}")
+                continue
+            # Each server's pod is restarted once onto the new template
+            try:
+                migrate_server_labels(name, namespace, cluster)
+                self.stdout.write(self.style.SUCCESS(f"Migrated {namespace}/{name}"))
+            except Exception as e:
+                failed.append(f"{namespace}/{name}")
+                self.stderr.write(f"Failed to migrate {namespace}/{name}: {e}")
+        if failed:
+            raise CommandError(f"Migration failed for: {', '.join(failed)}")
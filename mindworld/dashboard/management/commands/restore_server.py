@@ -0,0 +1,28 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from dashboard.backups import BackupJob, get_backup_store, list_snapshots, run_job
+from dashboard.kube_clients import DEFAULT_CLUSTER, cluster_names
+from dashboard.server_utils import NAMESPACE
+
+
+class Command(BaseCommand):
+    help = "Replace a server's world with a snapshot. The server is stopped while its volume is restored."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Server to restore.")
+        parser.add_argument('snapshot', nargs='?', help="Snapshot id (default: list the server's snapshots).")
+        parser.add_argument('--namespace', default=NAMESPACE, help="Namespace of the server.")
+        parser.add_argument('--cluster', default=DEFAULT_CLUSTER, choices=cluster_names(), help="Cluster of the server.")
+
+    def handle(self, *args, **options):
+        name, namespace, cluster = options['name'], options['namespace'], options['cluster']
+        if not options['snapshot']:
+            for snapshot in list_snapshots(get_backup_store(), namespace, name, cluster):
+                self.stdout.write(f"{snapshot['id']}  {snapshot['created_at']}  "
+                                  f"{snapshot['stats']['files']} files, {snapshot['stats']['size']} bytes")
+            return
+
+        job = asyncio.run(run_job(BackupJob('restore', namespace, name, options['snapshot'], cluster)))
+        if job.state != 'done':
+            raise CommandError(f"Restore of {name} failed: {job.message}")
+        self.stdout.write(self.style.SUCCESS(f"Restored {name} from {options['snapshot']}"))
@@ -0,0 +1,13 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from dashboard.wake_proxy import WAKE_PROXY_PORT, WakeProxy
+
+
+class Command(BaseCommand):
+    help = "Run the wake-on-connect proxy for hibernated servers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=WAKE_PROXY_PORT)
+
+    def handle(self, *args, **options):
+        asyncio.run(WakeProxy(options['port']).serve())
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+from dashboard.warm_pool import warm_pool
+
+
+class Command(BaseCommand):
+    help = "Keep the warm pool full and clean up unfinished volume hand-overs (run as a single replica)."
+
+    def handle(self, *args, **options):
+        if not warm_pool.sizes:
+            raise CommandError("The warm pool is off, set WARM_POOL (e.g. vanilla=2,paper=1).")
+        self.stdout.write(f"Keeping warm pool members: {warm_pool.sizes}")
+        warm_pool.run()
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Server',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=63)),
+                ('name', models.CharField(max_length=63)),
+                ('status', models.CharField(choices=[('Running', 'Running'), ('Stopped', 'Stopped'), ('Deleted', 'Deleted')], default='Stopped', max_length=16)),
+                ('replicas', models.PositiveIntegerField(default=0)),
+                ('ready_replicas', models.PositiveIntegerField(default=0)),
+                ('hibernated', models.BooleanField(default=False)),
+                ('template', models.CharField(blank=True, max_length=63)),
+                ('template_version', models.PositiveIntegerField(blank=True, null=True)),
+                ('resource_version', models.CharField(blank=True, max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['namespace', 'name'],
+                'indexes': [models.Index(fields=['deleted_at', 'namespace', 'name'], name='server_list_idx'), models.Index(fields=['deleted_at', 'status', 'namespace', 'name'], name='server_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('namespace', 'name'), name='unique_server_name')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ServerConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('env', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('server', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='config', to='dashboard.server')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ServerStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('Running', 'Running'), ('Stopped', 'Stopped'), ('Deleted', 'Deleted')], max_length=16)),
+                ('replicas', models.PositiveIntegerField(default=0)),
+                ('ready_replicas', models.PositiveIntegerField(default=0)),
+                ('hibernated', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='dashboard.server')),
+            ],
+            options={
+                'ordering': ['-changed_at', '-id'],
+                'indexes': [models.Index(fields=['server', '-changed_at'], name='server_history_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='server',
+            options={'ordering': ['cluster', 'namespace', 'name']},
+        ),
+        migrations.RemoveConstraint(
+            model_name='server',
+            name='unique_server_name',
+        ),
+        migrations.RemoveIndex(
+            model_name='server',
+            name='server_list_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='server',
+            name='server_status_idx',
+        ),
+        migrations.AddField(
+            model_name='server',
+            name='cluster',
+            field=models.CharField(default='default', max_length=63),
+        ),
+        migrations.AddIndex(
+            model_name='server',
+            index=models.Index(fields=['deleted_at', 'cluster', 'namespace', 'name'], name='server_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='server',
+            index=models.Index(fields=['deleted_at', 'status', 'cluster', 'namespace', 'name'], name='server_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='server',
+            constraint=models.UniqueConstraint(fields=('cluster', 'namespace', 'name'), name='unique_server_name'),
+        ),
+    ]
@@ -1,3 +1,98 @@
 from django.db import models
+from django.utils import timezone
+from .kube_clients import DEFAULT_CLUSTER
 
-# Create your models here.
+
+class Server(models.Model):
+    """A managed server, mirrored from its StatefulSet by the catalog reconciler."""
+
+    STATUS_RUNNING = 'Running'
+    STATUS_STOPPED = 'Stopped'
+    STATUS_DELETED = 'Deleted'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_STOPPED, 'Stopped'),
+        (STATUS_DELETED, 'Deleted'),
+    ]
+
+    cluster = models.CharField(max_length=63, default=DEFAULT_CLUSTER)
+    namespace = models.CharField(max_length=63)
+    name = models.CharField(max_length=63)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_STOPPED)
+    replicas = models.PositiveIntegerField(default=0)
+    ready_replicas = models.PositiveIntegerField(default=0)
+    hibernated = models.BooleanField(default=False)
+    template = models.CharField(max_length=63, blank=True)
+    template_version = models.PositiveIntegerField(null=True, blank=True)
+    # resourceVersion of the StatefulSet last synced, so unchanged objects are skipped
+    resource_version = models.CharField(max_length=32, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set once the StatefulSet is gone; the row is kept for its status history
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['cluster', 'namespace', 'name']
+        constraints = [
+            models.UniqueConstraint(fields=['cluster', 'namespace', 'name'], name='unique_server_name'),
+        ]
+        indexes = [
+            # Listing live servers in order, optionally by cluster, namespace or name prefix
+            models.Index(fields=['deleted_at', 'cluster', 'namespace', 'name'], name='server_list_idx'),
+            models.Index(fields=['deleted_at', 'status', 'cluster', 'namespace', 'name'], name='server_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cluster}/{self.namespace}/{self.name}"
+
+    def as_dict(self):
+        """Same shape as ``server_utils.statefulset_summary``."""
+        return {
+            "cluster": self.cluster,
+            "name": self.name,
+            "status": self.status,
+            "running_replicas": self.ready_replicas,
+            "replicas": self.replicas,
+            "hibernated": self.hibernated,
+            "namespace": self.namespace
+        }
+
+
+class ServerConfig(models.Model):
+    """The settings a server runs with (the image environment, e.g. MEMORY)."""
+
+    server = models.OneToOneField(Server, on_delete=models.CASCADE, related_name='config')
+    env = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Config of {self.server}"
+
+
+class ServerStatusChange(models.Model):
+    """One entry in a server's status history."""
+
+    server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name='status_history')
+    status = models.CharField(max_length=16, choices=Server.STATUS_CHOICES)
+    replicas = models.PositiveIntegerField(default=0)
+    ready_replicas = models.PositiveIntegerField(default=0)
+    hibernated = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-changed_at', '-id']
+        indexes = [
+            models.Index(fields=['server', '-changed_at'], name='server_history_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.server} {self.status} at {self.changed_at}"
+
+    def as_dict(self):
+        return {
+            "status": self.status,
+            "replicas": self.replicas,
+            "running_replicas": self.ready_replicas,
+            "hibernated": self.hibernated,
+            "changed_at": self.changed_at.isoformat()
+        }
@@ -0,0 +1,165 @@
+"""Node view model: capacity, allocation and server placement per node.
+
+Views are built from the node, pod and StatefulSet informer caches, so
+rendering the overview never lists pods per node. Pods from every
+namespace count towards a node's allocation; managed servers are the pods
+owned by a StatefulSet that mindworld manages.
+"""
+import logging
+from decimal import Decimal
+from kubernetes.utils import parse_quantity
+from .kube_clients import DEFAULT_CLUSTER
+from .server_utils import (
+    SERVER_CPU_REQUEST, SERVER_MEMORY_REQUEST, get_node_informer, get_pod_informer,
+    get_statefulset_informer, is_managed_by_mindworld, wait_for_cache
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _quantity(value):
+    return parse_quantity(value) if value is not None else Decimal(0)
+
+
+def _millicores(value):
+    return int(_quantity(value) * 1000)
+
+
+def node_status(node):
+    """Return "Ready", "NotReady" or "Unknown" from the node's Ready condition."""
+    for condition in node.status.conditions or []:
+        if condition.type == 'Ready':
+            return {'True': 'Ready', 'False': 'NotReady'}.get(condition.status, 'Unknown')
+    return 'Unknown'
+
+
+def node_address(node):
+    """Prefer the internal IP, then the external IP, then any address."""
+    addresses = node.status.addresses or []
+    for address_type in ('InternalIP', 'ExternalIP'):
+        for address in addresses:
+            if address.type == address_type:
+                return address.address
+    return addresses[0].address if addresses else None
+
+
+def pod_requests(pod):
+    """Return the ``(cpu millicores, memory bytes)`` the scheduler reserves for a pod.
+
+    That is the sum over app containers, or the largest init container if
+    bigger, plus the pod overhead. A container with only limits set gets
+    requests equal to its limits.
+    """
+    def container_requests(container):
+        resources = container.resources
+        requests = (resources.requests if resources else None) or {}
+        limits = (resources.limits if resources else None) or {}
+        return (_millicores(requests.get('cpu', limits.get('cpu'))),
+                int(_quantity(requests.get('memory', limits.get('memory')))))
+
+    app = [container_requests(container) for container in pod.spec.containers]
+    init = [container_requests(container) for container in pod.spec.init_containers or []]
+    cpu = max([sum(c for c, _ in app)] + [c for c, _ in init])
+    memory = max([sum(m for _, m in app)] + [m for _, m in init])
+
+    overhead = pod.spec.overhead or {}
+    return cpu + _millicores(overhead.get('cpu')), memory + int(_quantity(overhead.get('memory')))
+
+
+def pod_ready(pod):
+    for condition in pod.status.conditions or []:
+        if condition.type == 'Ready':
+            return condition.status == 'True'
+    return False
+
+
+def managed_statefulset_names(cluster=DEFAULT_CLUSTER):
+    """Return the ``(namespace, name)`` of every managed StatefulSet in the cache."""
+    return {(sts.metadata.namespace, sts.metadata.name)
+            for sts in get_statefulset_informer(cluster).list() if is_managed_by_mindworld(sts)}
+
+
+def server_for_pod(pod, managed):
+    """Return the managed StatefulSet name owning ``pod``, or None."""
+    for owner in pod.metadata.owner_references or []:
+        if owner.kind == 'StatefulSet' and (pod.metadata.namespace, owner.name) in managed:
+            return owner.name
+    return None
+
+
+def node_summary(node, pods, managed):
+    """Build the view model for one node from the pods bound to it."""
+    allocatable = node.status.allocatable or {}
+    capacity = node.status.capacity or {}
+
+    allocated_cpu, allocated_memory = 0, 0
+    servers = []
+    for pod in pods:
+        cpu, memory = pod_requests(pod)
+        allocated_cpu += cpu
+        allocated_memory += memory
+        server = server_for_pod(pod, managed)
+        if server is not None:
+            servers.append({
+                'namespace': pod.metadata.namespace,
+                'name': server,
+                'status': 'Running' if pod_ready(pod) else pod.status.phase
+            })
+
+    allocatable_cpu = _millicores(allocatable.get('cpu'))
+    allocatable_memory = int(_quantity(allocatable.get('memory')))
+    allocatable_pods = int(_quantity(allocatable.get('pods')))
+    free_cpu = max(0, allocatable_cpu - allocated_cpu)
+    free_memory = max(0, allocatable_memory - allocated_memory)
+    free_pods = max(0, allocatable_pods - len(pods))
+
+    # How many more servers with the default requests would still be schedulable here
+    fits = min(free_cpu // max(1, _millicores(SERVER_CPU_REQUEST)),
+               free_memory // max(1, int(_quantity(SERVER_MEMORY_REQUEST))),
+               free_pods)
+    schedulable = node_status(node) == 'Ready' and not node.spec.unschedulable
+
+    return {
+        'name': node.metadata.name,
+        'status': node_status(node),
+        'schedulable': schedulable,
+        'address': node_address(node),
+        'os_image': node.status.node_info.os_image,
+        'kubelet_version': node.status.node_info.kubelet_version,
+        'capacity': {'cpu': _millicores(capacity.get('cpu')), 'memory': int(_quantity(capacity.get('memory')))},
+        'allocatable': {'cpu': allocatable_cpu, 'memory': allocatable_memory, 'pods': allocatable_pods},
+        'allocated': {'cpu': allocated_cpu, 'memory': allocated_memory, 'pods': len(pods)},
+        'headroom': {'cpu': free_cpu, 'memory': free_memory, 'servers': fits if schedulable else 0},
+        'servers': sorted(servers, key=lambda server: (server['namespace'], server['name']))
+    }
+
+
+def pods_by_node(node_names=None, cluster=DEFAULT_CLUSTER):
+    """Group cached pods by the node they are bound to, optionally only for ``node_names``."""
+    grouped = {}
+    for pod in get_pod_informer(cluster).list():
+        node_name = pod.spec.node_name
+        if node_name and (node_names is None or node_name in node_names):
+            grouped.setdefault(node_name, []).append(pod)
+    return grouped
+
+
+def node_summaries(node_names=None, cluster=DEFAULT_CLUSTER):
+    """Return views for all cached nodes of ``cluster``, or only for ``node_names``."""
+    node_informer = get_node_informer(cluster)
+    if node_names is None:
+        nodes = node_informer.list()
+    else:
+        nodes = [node for node in map(node_informer.get, sorted(node_names)) if node is not None]
+
+    managed = managed_statefulset_names(cluster)
+    grouped = pods_by_node(node_names, cluster)
+    return [node_summary(node, grouped.get(node.metadata.name, []), managed) for node in nodes]
+
+
+def list_kubernetes_nodes(cluster=DEFAULT_CLUSTER):
+    """List all Kubernetes nodes of ``cluster`` with their allocation and placed servers."""
+    informers = (get_node_informer(cluster), get_pod_informer(cluster), get_statefulset_informer(cluster))
+    if not all(wait_for_cache(informer) for informer in informers):
+        return []
+    return node_summaries(cluster=cluster)
@@ -0,0 +1,99 @@
+"""Scheduling hints for new servers.
+
+Nodes are scored from the node overview (free allocatable capacity and the
+number of servers already there) and the best ones are written into the
+pod template as preferred node affinity. The hints are soft: the scheduler
+still has the final say, so a stale cache never leaves a server pending.
+"""
+import os
+import logging
+from kubernetes.utils import parse_quantity
+from .kube_clients import DEFAULT_CLUSTER
+from .node_overview import list_kubernetes_nodes
+from .server_utils import APP_LABELS, SERVER_CPU_REQUEST, SERVER_MEMORY_REQUEST, server_memory_mi
+
+logger = logging.getLogger(__name__)
+
+# "pack" fills the busiest node that still fits, "spread" prefers the emptiest
+# and also adds a topology spread constraint across nodes.
+PLACEMENT_STRATEGY = os.getenv('PLACEMENT_STRATEGY', 'pack')
+# How strongly nodes already running many servers are avoided (0 disables).
+PLACEMENT_DENSITY_WEIGHT = float(os.getenv('PLACEMENT_DENSITY_WEIGHT', '0.3'))
+# Number of nodes written into the preferred node affinity.
+PLACEMENT_PREFERRED_NODES = int(os.getenv('PLACEMENT_PREFERRED_NODES', '3'))
+
+HOSTNAME_LABEL = 'kubernetes.io/hostname'
+
+
+def score_node(node, cpu, memory, most_servers, strategy=PLACEMENT_STRATEGY):
+    """Score 1-100 for placing a ``cpu`` millicore / ``memory`` byte server on ``node``.
+
+    Returns None when the node is not schedulable, reports no allocatable
+    CPU or memory (cordoned or virtual nodes) or the server does not fit.
+    """
+    headroom, allocatable = node['headroom'], node['allocatable']
+    if allocatable['cpu'] <= 0 or allocatable['memory'] <= 0:
+        return None
+    if not node['schedulable'] or headroom['cpu'] < cpu or headroom['memory'] < memory:
+        return None
+    if node['allocated']['pods'] >= allocatable['pods']:
+        return None
+
+    # Share of the node that would be in use after adding the server
+    cpu_used = 1 - (headroom['cpu'] - cpu) / allocatable['cpu']
+    memory_used = 1 - (headroom['memory'] - memory) / allocatable['memory']
+    utilisation = (cpu_used + memory_used) / 2
+    fit = utilisation if strategy == 'pack' else 1 - utilisation
+
+    # Minecraft's main thread is CPU bound, so crowding servers on one node costs TPS
+    density = len(node['servers']) / (most_servers + 1)
+    return max(1, min(100, round(100 * (fit - PLACEMENT_DENSITY_WEIGHT * density))))
+
+
+def score_nodes(cpu, memory, strategy=PLACEMENT_STRATEGY, cluster=DEFAULT_CLUSTER):
+    """Return ``[(score, node_name), ...]`` for nodes of ``cluster`` the server fits on, best first."""
+    nodes = list_kubernetes_nodes(cluster)
+    most_servers = max((len(node['servers']) for node in nodes), default=0)
+    scores = []
+    for node in nodes:
+        score = score_node(node, cpu, memory, most_servers, strategy)
+        if score is not None:
+            scores.append((score, node['name']))
+    return sorted(scores, key=lambda item: (-item[0], item[1]))
+
+
+def plan_placement(env_vars, strategy=PLACEMENT_STRATEGY, cluster=DEFAULT_CLUSTER):
+    """Return pod spec scheduling fields for a new server with ``env_vars``."""
+    if env_vars.get('MEMORY'):
+        memory = server_memory_mi(env_vars['MEMORY']) * 1024 ** 2
+    else:
+        memory = int(parse_quantity(SERVER_MEMORY_REQUEST))
+    cpu = int(parse_quantity(SERVER_CPU_REQUEST) * 1000)
+
+    placement = {}
+    if strategy == 'spread':
+        placement['topologySpreadConstraints'] = [{
+            "maxSkew": 1,
+            "topologyKey": HOSTNAME_LABEL,
+            "whenUnsatisfiable": "ScheduleAnyway",
+            "labelSelector": {"matchLabels": APP_LABELS}
+        }]
+
+    scores = score_nodes(cpu, memory, strategy, cluster)[:PLACEMENT_PREFERRED_NODES]
+    if not scores:
+        logger.warning(f"No node has room for a server needing {cpu}m CPU and {memory} bytes, "
+                       f"leaving placement to the scheduler.")
+        return placement
+
+    logger.info(f"Preferred nodes: {', '.join(f'{name} ({score})' for score, name in scores)}")
+    placement['affinity'] = {
+        "nodeAffinity": {
+            "preferredDuringSchedulingIgnoredDuringExecution": [{
+                "weight": score,
+                "preference": {
+                    "matchFields": [{"key": "metadata.name", "operator": "In", "values": [name]}]
+                }
+            } for score, name in scores]
+        }
+    }
+    return placement
@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from .kube_clients import DEFAULT_CLUSTER, get_registry
+from .server_utils import get_pod_name, scale_statefulset
+
+logger = logging.getLogger(__name__)
+
+# How long a restart may take before the job is marked as failed.
+RESTART_TIMEOUT = int(os.getenv('RESTART_TIMEOUT', '600'))
+RESTART_MAX_WORKERS = int(os.getenv('RESTART_MAX_WORKERS', '8'))
+# Number of finished jobs kept around for the status endpoint.
+RESTART_JOB_HISTORY = 500
+
+_executor = ThreadPoolExecutor(max_workers=RESTART_MAX_WORKERS, thread_name_prefix='restart')
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+class RestartJob:
+    """Progress of one server restart: pending -> terminating -> scheduled -> ready (or failed)."""
+
+    def __init__(self, namespace, name, cluster=DEFAULT_CLUSTER):
+        self.id = uuid.uuid4().hex
+        self.cluster = cluster
+        self.namespace = namespace
+        self.name = name
+        self.state = 'pending'
+        self.message = ''
+        self.node = None
+        self.updated_at = time.time()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'cluster': self.cluster,
+            'namespace': self.namespace,
+            'name': self.name,
+            'state': self.state,
+            'message': self.message,
+            'node': self.node,
+            'updated_at': self.updated_at
+        }
+
+    def update(self, state, message=''):
+        if state == self.state and message == self.message:
+            return
+        self.state = state
+        self.message = message
+        self.updated_at = time.time()
+        logger.info(f"Restart of {self.namespace}/{self.name}: {state} {message}".rstrip())
+        try:
+            async_to_sync(get_channel_layer().group_send)("servers", {
+                'type': 'server.restart',
+                'job': self.as_dict()
+            })
+        except Exception as e:
+            logger.error(f"Error publishing restart progress: {e}")
+
+
+def start_restart(namespace, name, cluster=DEFAULT_CLUSTER):
+    """Queue a restart of ``namespace/name`` and return its job immediately."""
+    job = RestartJob(namespace, name, cluster)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > RESTART_JOB_HISTORY:
+            _jobs.popitem(last=False)
+    # Run in the caller's context, so the restart's API calls are traced under the request that started it
+    _executor.submit(contextvars.copy_context().run, _run, job)
+    return job
+
+
+def get_restart_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _is_ready(pod):
+    for condition in pod.status.conditions or []:
+        if condition.type == 'Ready':
+            return condition.status == 'True'
+    return False
+
+
+def _run(job):
+    core_api = get_registry(job.cluster).core_api()
+    pod_name = get_pod_name(job.name)
+
+    try:
+        try:
+            old_uid = core_api.read_namespaced_pod(pod_name, job.namespace).metadata.uid
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            old_uid = None
+
+        if old_uid is None:
+            # Nothing to cycle, the server is stopped: bring it up instead
+            if not scale_statefulset(job.namespace, job.name, replicas=1, cluster=job.cluster):
+                job.update('failed', 'Could not scale the server up.')
+                return
+        else:
+            core_api.delete_namespaced_pod(pod_name, job.namespace)
+            job.update('terminating')
+
+        pod_watch = watch.Watch()
+        for event in pod_watch.stream(core_api.list_namespaced_pod, job.namespace,
+                                      field_selector=f"metadata.name={pod_name}",
+                                      timeout_seconds=RESTART_TIMEOUT):
+            pod = event['object']
+            if pod.metadata.uid == old_uid:
+                continue
+            if event['type'] == 'DELETED':
+                continue
+            if pod.spec.node_name:
+                job.node = pod.spec.node_name
+                if job.state in ('pending', 'terminating'):
+                    job.update('scheduled')
+            if _is_ready(pod):
+                job.update('ready')
+                pod_watch.stop()
+                return
+
+        job.update('failed', f"Server was not ready after {RESTART_TIMEOUT} seconds.")
+    except Exception as e:
+        logger.error(f"Error restarting {job.namespace}/{job.name}: {e}")
+        job.update('failed', str(e))
@@ -0,0 +1,73 @@
+class ConsoleBuffer:
+    """Fixed-size ring buffer of raw console bytes.
+
+    Positions are absolute byte offsets ("sequence numbers") that keep
+    growing for the life of the buffer, so a client can resume from the last
+    offset it saw. Only the most recent ``capacity`` bytes are retained.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = bytearray(capacity)
+        self._end = 0
+        self._start = 0
+
+    @property
+    def start(self):
+        """Oldest sequence number still held in the buffer."""
+        return self._start
+
+    @property
+    def end(self):
+        """Sequence number just past the newest byte."""
+        return self._end
+
+    def append(self, data):
+        """Store ``data`` and return the sequence number just past it."""
+        if len(data) >= self.capacity:
+            self._end += len(data) - self.capacity
+            data = data[-self.capacity:]
+
+        offset = self._end % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self._data[offset:offset + first] = data[:first]
+        self._data[:len(data) - first] = data[first:]
+
+        self._end += len(data)
+        self._start = max(self._start, self._end - self.capacity)
+        return self._end
+
+    def clear(self):
+        """Drop the contents but keep sequence numbers increasing."""
+        self._start = self._end
+
+    def reset(self, seq):
+        """Drop the contents and continue at sequence number ``seq``, e.g. to follow another buffer."""
+        self._start = self._end = seq
+
+    def _slice(self, start, end):
+        if start >= end:
+            return b''
+        offset = start % self.capacity
+        length = end - start
+        if offset + length <= self.capacity:
+            return bytes(self._data[offset:offset + length])
+        return bytes(self._data[offset:]) + bytes(self._data[:length - (self.capacity - offset)])
+
+    def read_from(self, seq):
+        """Return ``(start_seq, data)`` for everything after ``seq`` that is still retained."""
+        start = min(max(seq, self._start), self._end)
+        return start, self._slice(start, self._end)
+
+    def tail_lines(self, lines):
+        """Return ``(start_seq, data)`` covering at most the last ``lines`` lines."""
+        data = self._slice(self._start, self._end)
+        cut = len(data)
+        # A trailing newline ends the last line rather than starting a new one
+        if data.endswith(b'\n'):
+            cut -= 1
+        for _ in range(lines):
+            cut = data.rfind(b'\n', 0, cut)
+            if cut == -1:
+                return self._start, data
+        return self._start + cut + 1, data[cut + 1:]
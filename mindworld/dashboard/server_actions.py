@@ -0,0 +1,128 @@
+import os
+import re
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .kube_clients import DEFAULT_CLUSTER
+from .server_utils import is_managed_by_mindworld, scale_statefulset, set_hibernated, statefulset_informers, wait_for_cache
+from .restart_jobs import start_restart
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrent apiserver patches for one bulk request.
+BULK_MAX_WORKERS = int(os.getenv('BULK_MAX_WORKERS', '10'))
+
+SERVER_ACTIONS = ('start', 'stop', 'restart')
+
+_LABEL_NAME = r'[A-Za-z0-9]([-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?'
+_LABEL_KEY_RE = re.compile(rf'([a-z0-9]([-a-z0-9.]{{0,251}}[a-z0-9])?/)?{_LABEL_NAME}')
+_LABEL_VALUE_RE = re.compile(rf'({_LABEL_NAME})?')
+
+
+def apply_server_action(namespace, name, action, cluster=DEFAULT_CLUSTER):
+    """Run a start/stop/restart action against one server.
+
+    Start and stop return True on success. Restart runs in the background
+    and returns its RestartJob right away.
+    """
+    if action == 'start':
+        return scale_statefulset(namespace, name, replicas=1, cluster=cluster)
+    elif action == 'stop':
+        # A manual stop is not a hibernation, players connecting must not wake it
+        return (scale_statefulset(namespace, name, replicas=0, cluster=cluster)
+                and set_hibernated(namespace, name, False, cluster=cluster))
+    elif action == 'restart':
+        return start_restart(namespace, name, cluster)
+    raise ValueError(f"Unknown action: {action}")
+
+
+def _parse_label_selector(selector):
+    """Parse an equality-based label selector such as ``tier=event,region!=eu,pinned``.
+
+    Raises ValueError for anything else, including set-based selectors
+    (``env in (a,b)``), rather than matching the wrong servers.
+    """
+    requirements = []
+    for term in selector.split(','):
+        term = term.strip()
+        if not term:
+            continue
+        if '!=' in term:
+            key, value = term.split('!=', 1)
+            requirement = (key.strip(), '!=', value.strip())
+        elif '=' in term:
+            key, value = term.split('==', 1) if '==' in term else term.split('=', 1)
+            requirement = (key.strip(), '=', value.strip())
+        elif term.startswith('!'):
+            requirement = (term[1:].strip(), '!', None)
+        else:
+            requirement = (term, 'exists', None)
+        key, _, value = requirement
+        if not _LABEL_KEY_RE.fullmatch(key) or (value is not None and not _LABEL_VALUE_RE.fullmatch(value)):
+            raise ValueError(f"Unsupported label selector term {term!r}, only key=value, key!=value, key and !key "
+                             f"are supported.")
+        requirements.append(requirement)
+    return requirements
+
+
+def _matches(labels, requirements):
+    for key, op, value in requirements:
+        if op == '=' and labels.get(key) != value:
+            return False
+        if op == '!=' and labels.get(key) == value:
+            return False
+        if op == 'exists' and key not in labels:
+            return False
+        if op == '!' and key in labels:
+            return False
+    return True
+
+
+def _server_labels(sts):
+    """Pod template labels overlaid with the StatefulSet's own, so older servers match by their pod labels."""
+    template_metadata = sts.spec.template.metadata
+    return {**((template_metadata.labels if template_metadata else None) or {}), **(sts.metadata.labels or {})}
+
+
+def find_managed_statefulsets(selector, cluster=None):
+    """Return (cluster, namespace, name) for managed StatefulSets whose labels match ``selector``.
+
+    Every cluster is searched unless ``cluster`` is given.
+    """
+    requirements = _parse_label_selector(selector)
+    matches = []
+    for informer_cluster, informer in statefulset_informers().items():
+        if cluster is not None and informer_cluster != cluster:
+            continue
+        if not wait_for_cache(informer):
+            continue
+        matches.extend((informer_cluster, sts.metadata.namespace, sts.metadata.name) for sts in informer.list()
+                       if is_managed_by_mindworld(sts) and _matches(_server_labels(sts), requirements))
+    return matches
+
+
+def _run_operation(operation):
+    cluster, namespace, name, action = operation
+    try:
+        outcome = apply_server_action(namespace, name, action, cluster)
+        if action == 'restart':
+            result = {'status': 'accepted', 'job_id': outcome.id}
+        elif outcome:
+            result = {'status': 'success'}
+        else:
+            result = {'status': 'error', 'message': f"Failed to {action} server"}
+    except Exception as e:
+        logger.error(f"Error running {action} on {namespace}/{name}: {e}")
+        result = {'status': 'error', 'message': str(e)}
+    return {'cluster': cluster, 'namespace': namespace, 'name': name, 'action': action, **result}
+
+
+def run_bulk_server_actions(operations, max_workers=BULK_MAX_WORKERS):
+    """Apply ``(cluster, namespace, name, action)`` operations concurrently and return per-server results."""
+    if not operations:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(operations))) as executor:
+        # Each operation runs in a copy of the caller's context, so its API calls stay in the view's trace
+        futures = [executor.submit(contextvars.copy_context().run, _run_operation, operation)
+                   for operation in operations]
+        return [future.result() for future in futures]
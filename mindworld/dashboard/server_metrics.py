@@ -0,0 +1,266 @@
+"""Per-server resource and gameplay metrics.
+
+A collector thread samples every managed server on a fixed interval:
+CPU and memory from the metrics API (metrics-server), and player count and
+TPS over RCON. Servers and their pods are read from the informer caches.
+Samples are kept in downsampled in-memory time series and pushed to this
+worker's "metrics" group for live dashboards. Only servers of the default
+cluster are sampled, as pod IPs of other clusters are not normally
+reachable from the panel.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from decimal import Decimal
+from channels.layers import get_channel_layer
+from kubernetes.utils import parse_quantity
+from kubernetes_asyncio.client.rest import ApiException
+from .broadcasters import worker_group
+from .console import RconClient
+from .informers import object_key
+from .kube_clients import AsyncClientRegistry
+from .server_utils import (
+    NAMESPACE, WATCH_ALL_NAMESPACES, CONTAINER_NAME, RCON_PORT, APP_SELECTOR, get_pod_informer, get_pod_name,
+    get_statefulset_informer, is_managed_by_mindworld, rcon_password, wait_for_cache
+)
+from .timeseries import TimeSeries
+
+logger = logging.getLogger(__name__)
+
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '15'))
+METRICS_RCON_TIMEOUT = float(os.getenv('METRICS_RCON_TIMEOUT', '5'))
+# (bucket seconds, bucket count): 15s for 1 hour, 1m for 1 day, 15m for 1 week.
+METRICS_TIERS = ((15, 240), (60, 1440), (900, 672))
+# cpu in millicores, memory in bytes.
+METRIC_FIELDS = ('cpu', 'memory', 'players', 'max_players', 'tps')
+
+_FORMATTING_CODE = re.compile(r'§.')
+_PLAYER_COUNT = re.compile(r'There are (\d+)\D+?(\d+)\s+players')
+_PAPER_TPS = re.compile(r'TPS from last 1m, 5m, 15m:\s*\*?([\d.]+)')
+_TICK_TARGET = re.compile(r'Target tick rate:\s*([\d.]+)')
+_TICK_TIME = re.compile(r'Average time per tick:\s*([\d.]+)\s*ms')
+
+# Paper and Spigot have "tps"; vanilla 1.20.3+ reports tick timings through "tick query".
+TPS_COMMANDS = ('tps', 'tick query')
+
+
+def parse_player_count(response):
+    """Return ``(online, max)`` from the output of the ``list`` command."""
+    match = _PLAYER_COUNT.search(_FORMATTING_CODE.sub('', response))
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_tps(response):
+    """Return the ticks per second reported by ``tps`` or ``tick query``, or None."""
+    response = _FORMATTING_CODE.sub('', response)
+    match = _PAPER_TPS.search(response)
+    if match:
+        return float(match.group(1))
+
+    match = _TICK_TIME.search(response)
+    if not match:
+        return None
+    target = _TICK_TARGET.search(response)
+    target = float(target.group(1)) if target else 20.0
+    mspt = float(match.group(1))
+    return target if mspt <= 0 else min(target, 1000.0 / mspt)
+
+
+def _container_usage(pod_metrics):
+    """Sum CPU (millicores) and memory (bytes) of the server container."""
+    cpu, memory = Decimal(0), Decimal(0)
+    for container in pod_metrics.get('containers', []):
+        if container.get('name') != CONTAINER_NAME:
+            continue
+        usage = container.get('usage', {})
+        cpu += parse_quantity(usage.get('cpu', '0'))
+        memory += parse_quantity(usage.get('memory', '0'))
+    return round(float(cpu * 1000), 1), int(memory)
+
+
+class MetricsCollector:
+    """Sample managed servers on an interval and keep their time series.
+
+    Collection runs on its own thread and event loop, with its own
+    Kubernetes clients, so it keeps going whether or not anyone is watching.
+    Live samples are handed to the ASGI event loop of the first consumer that
+    calls ``start()`` for publishing.
+    """
+
+    def __init__(self, group, interval):
+        self.group = group
+        self.interval = interval
+        self._series = {}
+        self._latest = {}
+        self._rcon = {}
+        self._tps_commands = {}
+        self._clients = AsyncClientRegistry()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._publish_loop = None
+        self._metrics_api_missing = False
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call ``await listener(samples, now)`` on the collector loop after every round."""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Start collecting if needed. From the event loop, also publish live samples there."""
+        try:
+            self._publish_loop = self._publish_loop or asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=lambda: asyncio.run(self._run()),
+                                                name="metrics-collector", daemon=True)
+                self._thread.start()
+
+    def series(self, namespace, name):
+        return self._series.get(f"{namespace}/{name}")
+
+    def latest(self):
+        return [self._latest[key] for key in sorted(self._latest)]
+
+    async def _run(self):
+        while True:
+            started = time.time()
+            try:
+                await self.collect(started)
+            except Exception as e:
+                logger.error(f"Error collecting server metrics: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.time() - started)))
+
+    async def collect(self, now):
+        informer, pod_informer = get_statefulset_informer(), get_pod_informer()
+        for cache in (informer, pod_informer):
+            if not await asyncio.to_thread(wait_for_cache, cache):
+                return
+        servers = [sts for sts in informer.list() if is_managed_by_mindworld(sts)]
+        usage = await self._pod_usage()
+
+        running = []
+        for sts in servers:
+            pod = pod_informer.get(f"{sts.metadata.namespace}/{get_pod_name(sts.metadata.name)}")
+            if pod is not None and pod.status.phase == 'Running':
+                running.append((sts, pod))
+        gameplay = await asyncio.gather(*(self._gameplay(sts, pod) for sts, pod in running))
+
+        samples = {}
+        for (sts, pod), (players, max_players, tps) in zip(running, gameplay):
+            cpu, memory = usage.get(object_key(pod), (None, None))
+            sample = {
+                'namespace': sts.metadata.namespace,
+                'name': sts.metadata.name,
+                'timestamp': now,
+                'cpu': cpu,
+                'memory': memory,
+                'players': players,
+                'max_players': max_players,
+                'tps': None if tps is None else round(tps, 2)
+            }
+            key = object_key(sts)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = TimeSeries(METRIC_FIELDS, METRICS_TIERS)
+            series.add(now, sample)
+            samples[key] = sample
+
+        managed = {object_key(sts) for sts in servers}
+        for key in [key for key in self._series if key not in managed]:
+            del self._series[key]
+        for key in [key for key in self._rcon if key not in samples]:
+            await self._close_rcon(key)
+        self._latest = samples
+        await self._publish(list(samples.values()))
+        for listener in self._listeners:
+            try:
+                await listener(list(samples.values()), now)
+            except Exception as e:
+                logger.error(f"Error in metrics listener: {e}")
+
+    async def _pod_usage(self):
+        custom_api = await self._clients.custom_objects_api()
+        try:
+            if WATCH_ALL_NAMESPACES:
+                response = await custom_api.list_cluster_custom_object(
+                    "metrics.k8s.io", "v1beta1", "pods", label_selector=APP_SELECTOR)
+            else:
+                response = await custom_api.list_namespaced_custom_object(
+                    "metrics.k8s.io", "v1beta1", NAMESPACE, "pods", label_selector=APP_SELECTOR)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error(f"Error reading pod metrics: {e}")
+            elif not self._metrics_api_missing:
+                logger.warning("Metrics API not available, CPU and memory will not be collected.")
+            self._metrics_api_missing = e.status == 404
+            return {}
+        self._metrics_api_missing = False
+        return {f"{item['metadata']['namespace']}/{item['metadata']['name']}": _container_usage(item)
+                for item in response.get('items', [])}
+
+    async def _gameplay(self, sts, pod):
+        """Return ``(players, max_players, tps)`` over RCON, or Nones if unavailable."""
+        if not self._exposes_rcon(pod) or not pod.status.pod_ip:
+            return None, None, None
+        key = object_key(sts)
+        try:
+            rcon = await self._rcon_for(key, sts.metadata.name, sts.metadata.namespace, pod.status.pod_ip)
+            players, max_players = parse_player_count(
+                await asyncio.wait_for(rcon.command('list'), METRICS_RCON_TIMEOUT))
+            tps = await self._tps(key, rcon)
+            return players, max_players, tps
+        except Exception as e:
+            logger.debug(f"Could not sample {key} over RCON: {e}")
+            await self._close_rcon(key)
+            return None, None, None
+
+    async def _tps(self, key, rcon):
+        commands = [self._tps_commands[key]] if key in self._tps_commands else TPS_COMMANDS
+        for command in commands:
+            tps = parse_tps(await asyncio.wait_for(rcon.command(command), METRICS_RCON_TIMEOUT))
+            if tps is not None:
+                self._tps_commands[key] = command
+                return tps
+        return None
+
+    def _exposes_rcon(self, pod):
+        for container in pod.spec.containers:
+            if container.name == CONTAINER_NAME:
+                return any(port.container_port == RCON_PORT for port in container.ports or [])
+        return False
+
+    async def _rcon_for(self, key, name, namespace, pod_ip):
+        current = self._rcon.get(key)
+        if current is not None and current[0] == pod_ip:
+            return current[1]
+        await self._close_rcon(key)
+        rcon = await RconClient.connect(pod_ip, RCON_PORT, rcon_password(name, namespace))
+        self._rcon[key] = (pod_ip, rcon)
+        return rcon
+
+    async def _close_rcon(self, key):
+        current = self._rcon.pop(key, None)
+        self._tps_commands.pop(key, None)
+        if current is not None:
+            await current[1].close()
+
+    async def _publish(self, samples):
+        if self._publish_loop is None or self._publish_loop.is_closed():
+            return
+        message = {'type': 'metrics.sample', 'samples': samples}
+        future = asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(self.group, message),
+                                                  self._publish_loop)
+        try:
+            await asyncio.wrap_future(future)
+        except Exception as e:
+            logger.error(f"Error publishing server metrics: {e}")
+
+
+metrics_collector = MetricsCollector(worker_group("metrics"), METRICS_INTERVAL)
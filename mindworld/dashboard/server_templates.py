@@ -0,0 +1,102 @@
+"""Versioned templates for the kinds of server the panel can create.
+
+A template fixes the image and the image settings that make a server type
+(Paper, Fabric, ...). Templates are never edited in place: a changed
+template gets a new version, and a server stays on the version recorded in
+its annotations until it is explicitly moved to another one, so changing a
+template never restarts servers that did not ask for it.
+
+Extra templates can be loaded from the JSON list in SERVER_TEMPLATES_FILE,
+e.g. ``[{"name": "paper", "version": 2, "label": "Paper (Java 21)",
+"image": "itzg/minecraft-server:java21", "env": {"TYPE": "PAPER"}}]``.
+"""
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MINECRAFT_IMAGE = os.getenv('MINECRAFT_IMAGE', 'itzg/minecraft-server')
+DEFAULT_SERVER_TEMPLATE = os.getenv('DEFAULT_SERVER_TEMPLATE', 'vanilla')
+SERVER_TEMPLATES_FILE = os.getenv('SERVER_TEMPLATES_FILE', '')
+TEMPLATE_ANNOTATION = 'mindworld/template'
+TEMPLATE_VERSION_ANNOTATION = 'mindworld/template-version'
+
+
+class ServerTemplate:
+    """One version of a server type: the image and its default settings."""
+
+    def __init__(self, name, version, label, image=MINECRAFT_IMAGE, env=None):
+        self.name = name
+        self.version = int(version)
+        self.label = label
+        self.image = image
+        self.env = dict(env or {})
+
+    def __repr__(self):
+        return f"<ServerTemplate {self.name} v{self.version}>"
+
+    def env_vars(self, overrides):
+        """The template's settings with the server's own ``overrides`` on top."""
+        return {**self.env, **overrides}
+
+    def annotations(self):
+        return {TEMPLATE_ANNOTATION: self.name, TEMPLATE_VERSION_ANNOTATION: str(self.version)}
+
+
+# Vanilla v1 is exactly what servers were created with before templates
+# existed, so those servers map onto it without a restart.
+BUILTIN_TEMPLATES = [
+    ServerTemplate('vanilla', 1, 'Vanilla'),
+    ServerTemplate('paper', 1, 'Paper', env={"TYPE": "PAPER"}),
+    ServerTemplate('fabric', 1, 'Fabric', env={"TYPE": "FABRIC"}),
+    ServerTemplate('forge', 1, 'Forge', env={"TYPE": "FORGE"}),
+]
+
+
+def load_templates(path=SERVER_TEMPLATES_FILE):
+    """Return ``{name: {version: template}}`` for the built-in and configured templates."""
+    templates = list(BUILTIN_TEMPLATES)
+    if path:
+        with open(path) as f:
+            templates.extend(ServerTemplate(**spec) for spec in json.load(f))
+
+    registry = {}
+    for template in templates:
+        versions = registry.setdefault(template.name, {})
+        if template.version in versions:
+            logger.warning(f"Template {template.name} v{template.version} is defined twice, using the last one.")
+        versions[template.version] = template
+    return registry
+
+
+SERVER_TEMPLATES = load_templates()
+
+
+def get_template(name, version=None):
+    """Return template ``name`` at ``version``, or its latest version."""
+    versions = SERVER_TEMPLATES.get(name)
+    if not versions:
+        raise ValueError(f"Unknown server template: {name!r}")
+    if version is None:
+        return versions[max(versions)]
+    if int(version) not in versions:
+        raise ValueError(f"Unknown version {version} of server template {name!r}")
+    return versions[int(version)]
+
+
+def template_choices():
+    """``(name, label)`` of the latest version of every template, for forms."""
+    return [(name, get_template(name).label) for name in sorted(SERVER_TEMPLATES)]
+
+
+def template_for(sts):
+    """Return the template a StatefulSet was created from.
+
+    Servers created before templates existed are vanilla v1.
+    """
+    annotations = sts.metadata.annotations or {}
+    name = annotations.get(TEMPLATE_ANNOTATION)
+    if name is None:
+        return get_template('vanilla', 1)
+    return get_template(name, annotations.get(TEMPLATE_VERSION_ANNOTATION))
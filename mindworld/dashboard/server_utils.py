@@ -1,125 +1,263 @@
 import os
+import json
+import base64
+import time
+import hmac
+import hashlib
 import logging
-from kubernetes import client, config
-from kubernetes.stream import stream
+import threading
+from django.conf import settings
 from kubernetes.client.rest import ApiException
-from websocket import WebSocketConnectionClosedException
+from .informers import Informer
+from .kube_clients import DEFAULT_CLUSTER, cluster_names, get_registry, registry
+from .server_templates import DEFAULT_SERVER_TEMPLATE, get_template, template_for
 
 # Configuration Management
 NAMESPACE = os.getenv('NAMESPACE', 'default')
 CONTAINER_NAME = os.getenv('CONTAINER_NAME', 'minecraft-server')
+INFORMER_SYNC_TIMEOUT = float(os.getenv('INFORMER_SYNC_TIMEOUT', '10'))
+# Watch servers in every namespace of each cluster (needs cluster-wide RBAC)
+# instead of NAMESPACE only. New servers are still created in NAMESPACE by default.
+WATCH_ALL_NAMESPACES = os.getenv('WATCH_ALL_NAMESPACES', 'false').lower() == 'true'
+# Resources requested by every server container. SERVER_MEMORY_REQUEST is only
+# used when a server has no MEMORY (JVM heap) setting to size it from.
+SERVER_CPU_REQUEST = os.getenv('SERVER_CPU_REQUEST', '500m')
+SERVER_MEMORY_REQUEST = os.getenv('SERVER_MEMORY_REQUEST', '2Gi')
+# Container memory on top of the heap for metaspace, threads and direct buffers:
+# the larger of a fraction of the heap and a fixed minimum (MiB).
+SERVER_MEMORY_OVERHEAD_RATIO = float(os.getenv('SERVER_MEMORY_OVERHEAD_RATIO', '0.25'))
+SERVER_MEMORY_OVERHEAD_MIN_MI = int(os.getenv('SERVER_MEMORY_OVERHEAD_MIN_MI', '512'))
+# "rcon" sends commands over RCON and follows the container log, "pipe" uses the
+# image's console named pipe, "screen" needs MINECRAFT_IMAGE to ship screen
+CONSOLE_BACKEND = os.getenv('CONSOLE_BACKEND', 'rcon')
+CONSOLE_BACKEND_ANNOTATION = 'mindworld/console-backend'
+CONSOLE_PIPE = '/tmp/minecraft-console-in'
+CONSOLE_LOG = '/data/logs/latest.log'
+RCON_PORT = 25575
+# Every server pod carries the shared app label plus SERVER_LABEL=<name>, which
+# the server's own StatefulSet and Service select on.
+APP_LABELS = {"app": "minecraft-server"}
+APP_SELECTOR = "app=minecraft-server"
+SERVER_LABEL = 'mindworld/server'
+# Set (to the time) while a server is scaled to zero for being idle; servers
+# annotated HIBERNATE_ANNOTATION="false" are never hibernated.
+HIBERNATED_ANNOTATION = 'mindworld/hibernated'
+HIBERNATE_ANNOTATION = 'mindworld/hibernate'
+# How long to wait for an orphaning StatefulSet delete during label migration.
+LABEL_MIGRATION_TIMEOUT = 30
+# Server objects are written with server-side apply under this field manager.
+FIELD_MANAGER = 'mindworld'
+APPLY_CONTENT_TYPE = 'application/apply-patch+yaml'
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_kube_config():
-    """Load Kubernetes configuration."""
-    try:
-        config.load_kube_config()
-        #logger.info("Kubernetes configuration loaded successfully.")
-    except Exception as e:
-        #logger.error(f"Failed to load Kubernetes configuration: {e}")
-        raise
+def load_kube_config(cluster=DEFAULT_CLUSTER):
+    """Load Kubernetes configuration (once per process, see kube_clients)."""
+    get_registry(cluster).api_client()
 
-def get_statefulsets_managed_by_mindworld():
-    load_kube_config()
-    api_instance = client.AppsV1Api()
-    
-    try:
-        statefulsets = api_instance.list_namespaced_stateful_set(namespace=NAMESPACE)
-        
-        managed_statefulsets = []
-        
-        for sts in statefulsets.items:
-            annotations = sts.metadata.annotations
-            if annotations and annotations.get("managed-by") == "mindworld":
-                managed_statefulsets.append({
-                    "name": sts.metadata.name,
-                    "status": "Running" if sts.status.ready_replicas == sts.spec.replicas else "Stopped",
-                    "running_replicas": sts.status.ready_replicas,
-                    "replicas": sts.spec.replicas,
-                    "namespace": sts.metadata.namespace
-                })
-        
-        return managed_statefulsets
+_informers = {}
+_informers_lock = threading.Lock()
+
+def _get_informer(kind, cluster, list_func_factory, **list_kwargs):
+    """Return the process-wide ``kind`` informer of ``cluster``, starting it on first use."""
+    name = kind if cluster == DEFAULT_CLUSTER else f"{kind}@{cluster}"
+    with _informers_lock:
+        informer = _informers.get(name)
+        if informer is None:
+            load_kube_config(cluster)
+            informer = Informer(name, list_func_factory, **list_kwargs)
+            informer.start()
+            _informers[name] = informer
+    return informer
+
+def get_statefulset_informer(cluster=DEFAULT_CLUSTER):
+    clients = get_registry(cluster)
+    if WATCH_ALL_NAMESPACES:
+        return _get_informer("statefulsets", cluster, lambda: clients.apps_api().list_stateful_set_for_all_namespaces)
+    return _get_informer("statefulsets", cluster, lambda: clients.apps_api().list_namespaced_stateful_set,
+                         namespace=NAMESPACE)
+
+def get_node_informer(cluster=DEFAULT_CLUSTER):
+    clients = get_registry(cluster)
+    return _get_informer("nodes", cluster, lambda: clients.core_api().list_node)
+
+def get_pod_informer(cluster=DEFAULT_CLUSTER):
+    clients = get_registry(cluster)
+    # Pods in every namespace count towards node allocation; finished pods do not
+    return _get_informer("pods", cluster, lambda: clients.core_api().list_pod_for_all_namespaces,
+                         field_selector="status.phase!=Succeeded,status.phase!=Failed")
+
+def statefulset_informers():
+    """Return ``{cluster: StatefulSet informer}`` for every configured cluster."""
+    return {cluster: get_statefulset_informer(cluster) for cluster in cluster_names()}
+
+def wait_for_cache(informer):
+    if not informer.wait_for_sync(INFORMER_SYNC_TIMEOUT):
+        logger.error(f"Timed out waiting for the {informer.name} cache to sync.")
+        return False
+    return True
+
+def is_managed_by_mindworld(sts):
+    annotations = sts.metadata.annotations
+    return bool(annotations) and annotations.get("managed-by") == "mindworld"
+
+def is_hibernated(sts):
+    """True if the server was scaled to zero for being idle and may be woken on connect."""
+    annotations = sts.metadata.annotations or {}
+    return not sts.spec.replicas and HIBERNATED_ANNOTATION in annotations
 
+def allows_hibernation(sts):
+    annotations = sts.metadata.annotations or {}
+    return annotations.get(HIBERNATE_ANNOTATION, "true").lower() != "false"
+
+def statefulset_summary(sts, cluster=DEFAULT_CLUSTER):
+    return {
+        "cluster": cluster,
+        "name": sts.metadata.name,
+        "status": "Running" if sts.status.ready_replicas == sts.spec.replicas else "Stopped",
+        "running_replicas": sts.status.ready_replicas,
+        "replicas": sts.spec.replicas,
+        "hibernated": is_hibernated(sts),
+        "namespace": sts.metadata.namespace
+    }
+
+def hibernation_patch(hibernated):
+    """Metadata patch that sets or clears the hibernation annotation."""
+    return {"metadata": {"annotations": {HIBERNATED_ANNOTATION: str(int(time.time())) if hibernated else None}}}
+
+def set_hibernated(namespace, name, hibernated, cluster=DEFAULT_CLUSTER):
+    """Mark or unmark a server as hibernated, returning True on success."""
+    try:
+        get_registry(cluster).apps_api().patch_namespaced_stateful_set(name, namespace, hibernation_patch(hibernated))
+        return True
     except ApiException as e:
-        logger.error(f"Exception when calling AppsV1Api->list_namespaced_stateful_set: {e}")
-        return []
+        logger.error(f"Exception when calling AppsV1Api->patch_namespaced_stateful_set: {e}")
+        return False
+
+def scale_statefulset(namespace, name, replicas, cluster=DEFAULT_CLUSTER):
+    """Scale a StatefulSet, returning True on success."""
+    api_instance = get_registry(cluster).apps_api()
 
-def scale_statefulset(namespace, name, replicas):
-    load_kube_config()
-    api_instance = client.AppsV1Api()
-    
     try:
         body = {'spec': {'replicas': replicas}}
         api_instance.patch_namespaced_stateful_set_scale(name, namespace, body)
         logger.info(f"Scaled {name} to {replicas} replicas.")
+        return True
     except ApiException as e:
         logger.error(f"Exception when calling AppsV1Api->patch_namespaced_stateful_set_scale: {e}")
+        return False
+
+def server_labels(name):
+    """Labels of the server ``name``: on its StatefulSet and pods, and the StatefulSet/Service selector."""
+    return {**APP_LABELS, SERVER_LABEL: name}
+
+_JVM_MEMORY_UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+def parse_jvm_memory(value):
+    """Parse a JVM heap size such as ``2G`` or ``1536m`` (the image's MEMORY) into bytes."""
+    value = str(value).strip()
+    unit = value[-1:].lower()
+    if unit in _JVM_MEMORY_UNITS and value[:-1].isdigit():
+        return int(value[:-1]) * _JVM_MEMORY_UNITS[unit]
+    if value.isdigit():
+        return int(value)
+    raise ValueError(f"Invalid memory size: {value!r}")
+
+def server_memory_mi(heap_memory):
+    """Container memory in MiB for a server whose JVM heap is ``heap_memory``."""
+    heap_mi = -(-parse_jvm_memory(heap_memory) // 1024 ** 2)
+    return heap_mi + max(SERVER_MEMORY_OVERHEAD_MIN_MI, int(heap_mi * SERVER_MEMORY_OVERHEAD_RATIO))
 
-def create_or_update_statefulset_and_service(name, env_vars):
-    load_kube_config()
-    api_instance = client.AppsV1Api()
-    core_api_instance = client.CoreV1Api()
+def server_resources(env_vars):
+    """Requests and limits for a server container, sized from its MEMORY setting.
 
+    Requests equal limits for memory so the heap always fits and the pod is
+    not the first to be evicted under node memory pressure.
+    """
+    memory = f"{server_memory_mi(env_vars['MEMORY'])}Mi" if env_vars.get('MEMORY') else SERVER_MEMORY_REQUEST
+    return {
+        "requests": {"cpu": SERVER_CPU_REQUEST, "memory": memory},
+        "limits": {"cpu": "1", "memory": memory}
+    }
+
+def build_statefulset_manifest(name, env_vars, placement=None, template=None):
+    """Build the StatefulSet manifest for a Minecraft server.
+
+    ``template`` is the ServerTemplate providing the image and default
+    settings (DEFAULT_SERVER_TEMPLATE if not given). ``placement`` holds pod
+    spec scheduling fields (``affinity``, ``topologySpreadConstraints``) to
+    add to the pod template.
+    """
+    template = template or get_template(DEFAULT_SERVER_TEMPLATE)
     # Convert all environment variable values to strings
-    env_vars = {key: str(value) for key, value in env_vars.items()}
+    env_vars = {key: str(value) for key, value in template.env_vars(env_vars).items()}
 
     # Generate service names
     statefulset_name = name
     service_name = f"{name}-service"
 
-    statefulset_manifest = {
+    container = {
+        "name": "minecraft-server",
+        "image": template.image,
+        "env": [{"name": key, "value": value} for key, value in env_vars.items()],
+        "ports": [{"containerPort": 25565}],
+        "stdin": True,
+        "tty": True,
+        "volumeMounts": [{"mountPath": "/data", "name": "minecraft-data"}],
+        "resources": server_resources(env_vars),
+        "livenessProbe": {
+            "exec": {"command": ["mc-health"]},
+            "initialDelaySeconds": 120,
+            "periodSeconds": 60
+        },
+        "readinessProbe": {
+            "exec": {"command": ["mc-health"]},
+            "initialDelaySeconds": 20,
+            "periodSeconds": 10,
+            "failureThreshold": 12
+        }
+    }
+    if CONSOLE_BACKEND == "screen":
+        container["command"] = ["/bin/sh", "-c", "screen -dmS minecraft /start && tail -f /dev/null"]
+    else:
+        # The named pipe is also the fallback when RCON cannot be reached
+        container["env"].append({"name": "CREATE_CONSOLE_IN_PIPE", "value": "TRUE"})
+    if CONSOLE_BACKEND == "rcon":
+        container["ports"].append({"containerPort": RCON_PORT, "name": "rcon"})
+        container["env"].extend([
+            {"name": "ENABLE_RCON", "value": "TRUE"},
+            {"name": "RCON_PASSWORD", "valueFrom": {"secretKeyRef": {"name": rcon_secret_name(name), "key": "password"}}}
+        ])
+
+    return {
         "apiVersion": "apps/v1",
         "kind": "StatefulSet",
         "metadata": {
             "name": statefulset_name,
+            "labels": server_labels(name),
             "annotations": {
-                "managed-by": "mindworld"
+                "managed-by": "mindworld",
+                **template.annotations()
             }
         },
         "spec": {
             "serviceName": service_name,
             "replicas": 1,
             "selector": {
-                "matchLabels": {
-                    "app": "minecraft-server"
-                }
+                "matchLabels": server_labels(name)
             },
             "template": {
                 "metadata": {
-                    "labels": {
-                        "app": "minecraft-server"
+                    "labels": server_labels(name),
+                    "annotations": {
+                        CONSOLE_BACKEND_ANNOTATION: CONSOLE_BACKEND
                     }
                 },
                 "spec": {
-                    "containers": [{
-                        "name": "minecraft-server",
-                        "image": "itzg/minecraft-server",
-                        "env": [{"name": key, "value": value} for key, value in env_vars.items()],
-                        "ports": [{"containerPort": 25565}],
-                        "command": ["/bin/sh", "-c", "apt-get update && apt-get install -y screen && screen -dmS minecraft /start && tail -f /dev/null"],
-                        "stdin": True,
-                        "tty": True,
-                        "volumeMounts": [{"mountPath": "/data", "name": "minecraft-data"}],
-                        "resources": {
-                            "requests": {"cpu": "500m", "memory": "2Gi"},
-                            "limits": {"cpu": 1, "memory": "2Gi"}
-                        },
-                        "livenessProbe": {
-                            "exec": {"command": ["mc-health"]},
-                            "initialDelaySeconds": 120,
-                            "periodSeconds": 60
-                        },
-                        "readinessProbe": {
-                            "exec": {"command": ["mc-health"]},
-                            "initialDelaySeconds": 20,
-                            "periodSeconds": 10,
-                            "failureThreshold": 12
-                        }
-                    }]
+                    "containers": [container],
+                    **(placement or {})
                 }
             },
             "volumeClaimTemplates": [{
@@ -132,7 +270,37 @@ def create_or_update_statefulset_and_service(name, env_vars):
         }
     }
 
-    service_manifest = {
+def rcon_secret_name(name):
+    return f"{name}-rcon"
+
+def rcon_password(name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Derive the RCON password for a server, so the panel never has to read it back."""
+    server = f"{namespace}/{name}" if cluster == DEFAULT_CLUSTER else f"{cluster}/{namespace}/{name}"
+    return hmac.new(settings.SECRET_KEY.encode(), f"rcon:{server}".encode(), hashlib.sha256).hexdigest()
+
+def build_rcon_secret_manifest(name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Build the Secret holding a server's RCON password."""
+    return {
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "metadata": {
+            "name": rcon_secret_name(name),
+            "annotations": {
+                "managed-by": "mindworld"
+            }
+        },
+        "type": "Opaque",
+        # data rather than stringData, so the manifest compares equal to what is read back
+        "data": {
+            "password": base64.b64encode(rcon_password(name, namespace, cluster).encode()).decode()
+        }
+    }
+
+def build_service_manifest(name):
+    """Build the ClusterIP Service manifest for a Minecraft server."""
+    service_name = f"{name}-service"
+
+    return {
         "apiVersion": "v1",
         "kind": "Service",
         "metadata": {
@@ -142,9 +310,7 @@ def create_or_update_statefulset_and_service(name, env_vars):
             }
         },
         "spec": {
-            "selector": {
-                "app": "minecraft-server"
-            },
+            "selector": server_labels(name),
             "ports": [{
                 "protocol": "TCP",
                 "port": 25565,
@@ -154,99 +320,222 @@ def create_or_update_statefulset_and_service(name, env_vars):
         }
     }
 
+def to_manifest(obj):
+    """Turn a client model into the plain dict a manifest would be."""
+    # Serialisation is local, any cluster's client will do
+    return registry.api_client().sanitize_for_serialization(obj)
+
+def manifest_diff(desired, current, path=""):
+    """Return the paths of fields set in ``desired`` that differ in ``current``.
+
+    Only fields present in ``desired`` are compared, so defaults filled in
+    by the API server and fields owned by other controllers never count as
+    changes. Lists must match item by item.
+    """
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return [path or "."]
+        changes = []
+        for key, value in desired.items():
+            changes.extend(manifest_diff(value, current.get(key), f"{path}.{key}" if path else key))
+        return changes
+    if isinstance(desired, list):
+        if not isinstance(current, list) or len(desired) != len(current):
+            return [path]
+        changes = []
+        for index, (item, current_item) in enumerate(zip(desired, current)):
+            changes.extend(manifest_diff(item, current_item, f"{path}[{index}]"))
+        return changes
+    return [] if desired == current else [path]
+
+def _read_current(read, name, namespace=NAMESPACE):
+    """Read an object as a manifest dict, or None if it does not exist."""
     try:
-        api_instance.replace_namespaced_stateful_set(name=statefulset_name, namespace=NAMESPACE, body=statefulset_manifest)
-        logger.info("StatefulSet updated successfully!")
+        return to_manifest(read(name, namespace))
     except ApiException as e:
         if e.status == 404:
-            try:
-                api_instance.create_namespaced_stateful_set(namespace=NAMESPACE, body=statefulset_manifest)
-                logger.info("StatefulSet created successfully!")
-            except ApiException as e:
-                logger.error(f"Error creating StatefulSet: {e}")
-        else:
-            logger.error(f"Error updating StatefulSet: {e}")
+            return None
+        raise
+
+def _apply(patch, name, body, current, kind, namespace=NAMESPACE):
+    """Server-side apply ``body``, unless ``current`` already matches it.
 
+    Skipping unchanged objects saves the write and, for the StatefulSet, the
+    rolling restart a new revision would cause. Returns True if written.
+    """
+    if current is not None:
+        changes = manifest_diff(body, current)
+        if not changes:
+            logger.info(f"{kind} {name} is up to date, skipping.")
+            return False
+        logger.info(f"{kind} {name} changed: {', '.join(changes)}")
     try:
-        core_api_instance.replace_namespaced_service(name=service_name, namespace=NAMESPACE, body=service_manifest)
-        logger.info("ClusterIP service updated successfully!")
+        patch(name=name, namespace=namespace, body=body, field_manager=FIELD_MANAGER, force=True,
+              _content_type=APPLY_CONTENT_TYPE)
+        logger.info(f"{kind} {'updated' if current is not None else 'created'} successfully!")
+        return True
     except ApiException as e:
-        if e.status == 404:
-            try:
-                core_api_instance.create_namespaced_service(namespace=NAMESPACE, body=service_manifest)
-                logger.info("ClusterIP service created successfully!")
-            except ApiException as e:
-                logger.error(f"Error creating ClusterIP service: {e}")
-        else:
-            logger.error(f"Error updating ClusterIP service: {e}")
+        logger.error(f"Error applying {kind}: {e}")
+        return False
 
-def get_pod_name(statefulset_name):
-    """Get the name of the pod running the Minecraft server."""
-    return f"{statefulset_name}-0"
+PLACEMENT_FIELDS = ('affinity', 'topologySpreadConstraints')
+
+def template_placement(sts):
+    """Return the scheduling fields of an existing StatefulSet's pod template."""
+    pod_spec = to_manifest(sts.spec.template.spec)
+    return {field: pod_spec[field] for field in PLACEMENT_FIELDS if pod_spec.get(field)}
+
+def create_or_update_statefulset_and_service(name, env_vars, placement=None, template=None,
+                                            namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Create or update a server. ``placement`` only applies to new servers.
 
-def attach_to_console(pod_name):
-    """Attach to the Minecraft server console using WebSocket."""
+    Existing servers keep the scheduling fields they were created with, so an
+    update does not move them to another node, and stay on their template
+    version unless ``template`` is given. Their replica count is left to
+    start, stop and hibernation. Objects that already match are not written.
+    """
+    clients = get_registry(cluster)
+    api_instance = clients.apps_api()
+    core_api_instance = clients.core_api()
+
+    existing = None
     try:
-        logger.info("Connecting to the Minecraft server console...")
-        # Check for existing screen sessions
-        screen_list_command = ['screen', '-ls']
-        response = stream(client.CoreV1Api().connect_get_namespaced_pod_exec,
-                          pod_name,
-                          NAMESPACE,
-                          command=screen_list_command,
-                          container=CONTAINER_NAME,
-                          stderr=True, stdin=False,
-                          stdout=True, tty=False)
-        screens = response.splitlines()
-        minecraft_screen = None
-
-        for screen in screens:
-            if 'minecraft' in screen:
-                minecraft_screen = screen.split('.')[0].strip()
-                break
+        existing = api_instance.read_namespaced_stateful_set(name, namespace)
+        placement = template_placement(existing)
+        template = template or template_for(existing)
+        if needs_label_migration(existing):
+            # The selector is immutable, so it cannot be applied in place
+            migrate_server_labels(name, namespace, cluster)
+            existing = api_instance.read_namespaced_stateful_set(name, namespace)
+    except ApiException as e:
+        if e.status != 404:
+            # Applying blind could restart or resize a server we could not look at
+            logger.error(f"Error reading StatefulSet {name}: {e}")
+            return
 
-        if not minecraft_screen:
-            raise Exception("No Minecraft screen session found.")
+    statefulset_name = name
+    service_name = f"{name}-service"
+    statefulset_manifest = build_statefulset_manifest(name, env_vars, placement, template)
+    service_manifest = build_service_manifest(name)
+    if existing is not None:
+        del statefulset_manifest["spec"]["replicas"]
+        existing = to_manifest(existing)
 
-        exec_command = ['screen', '-x', minecraft_screen]
-        ws_client = stream(client.CoreV1Api().connect_get_namespaced_pod_exec,
-                           pod_name,
-                           NAMESPACE,
-                           command=exec_command,
-                           container=CONTAINER_NAME,
-                           stderr=True, stdin=True,
-                           stdout=True, tty=True,
-                           _preload_content=False)
+    if CONSOLE_BACKEND == "rcon":
+        secret_name = rcon_secret_name(name)
+        _apply(core_api_instance.patch_namespaced_secret, secret_name, build_rcon_secret_manifest(name, namespace, cluster),
+               _read_current(core_api_instance.read_namespaced_secret, secret_name, namespace), "RCON secret", namespace)
+    _apply(api_instance.patch_namespaced_stateful_set, statefulset_name, statefulset_manifest,
+           existing, "StatefulSet", namespace)
+    _apply(core_api_instance.patch_namespaced_service, service_name, service_manifest,
+           _read_current(core_api_instance.read_namespaced_service, service_name, namespace), "ClusterIP service",
+           namespace)
 
-        logger.info("WebSocket connection established.")
+def needs_label_migration(sts):
+    """True for StatefulSets created with the old selector shared by every server."""
+    return (sts.spec.selector.match_labels or {}).get(SERVER_LABEL) != sts.metadata.name
 
-        return ws_client
+def _recreatable_manifest(sts, labels):
+    manifest = to_manifest(sts)
+    manifest.pop("status", None)
+    metadata = manifest["metadata"]
+    manifest["metadata"] = {key: metadata[key] for key in ("name", "namespace", "labels", "annotations") if key in metadata}
+    manifest["metadata"]["labels"] = {**manifest["metadata"].get("labels", {}), **labels}
+    manifest["spec"]["selector"] = {"matchLabels": labels}
+    template_metadata = manifest["spec"]["template"].setdefault("metadata", {})
+    template_metadata["labels"] = {**template_metadata.get("labels", {}), **labels}
+    return manifest
 
-    except Exception as e:
-        logger.error(f"Error attaching to console: {e}")
-        raise
+def migrate_server_labels(name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Move a server from the shared ``app`` selector onto its own labels.
 
-def list_kubernetes_nodes():
-    """List all Kubernetes nodes."""
-    load_kube_config()
-    api_instance = client.CoreV1Api()
-    
-    try:
-        nodes = api_instance.list_node()
-        node_list = []
-        
-        for node in nodes.items:
-            node_info = {
-                "name": node.metadata.name,
-                "status": node.status.conditions[-1].type,
-                "address": node.status.addresses[0].address,
-                "os_image": node.status.node_info.os_image,
-                "kubelet_version": node.status.node_info.kubelet_version
-            }
-            node_list.append(node_info)
-        
-        return node_list
+    The pod is labelled first and the Service narrowed to it, so player
+    traffic never loses its endpoint. The StatefulSet selector cannot be
+    changed in place, so the StatefulSet is deleted with orphan propagation
+    (pod and volume stay) and recreated from its own spec with the new
+    selector; it adopts the pod and rolls it once onto the new template.
+    Returns True if the server was migrated.
+    """
+    clients = get_registry(cluster)
+    api_instance = clients.apps_api()
+    core_api_instance = clients.core_api()
+    sts = api_instance.read_namespaced_stateful_set(name, namespace)
+    if not needs_label_migration(sts):
+        return False
 
+    labels = server_labels(name)
+    manifest = _recreatable_manifest(sts, labels)
+    try:
+        core_api_instance.patch_namespaced_pod(get_pod_name(name), namespace, {"metadata": {"labels": labels}})
     except ApiException as e:
-        logger.error(f"Exception when calling CoreV1Api->list_node: {e}")
-        return []
\ No newline at end of file
+        if e.status != 404:
+            raise
+    try:
+        core_api_instance.patch_namespaced_service(f"{name}-service", namespace, {"spec": {"selector": labels}})
+    except ApiException as e:
+        if e.status != 404:
+            raise
+
+    api_instance.delete_namespaced_stateful_set(name, namespace, propagation_policy="Orphan")
+    deadline = time.monotonic() + LABEL_MIGRATION_TIMEOUT
+    while True:
+        try:
+            api_instance.read_namespaced_stateful_set(name, namespace)
+        except ApiException as e:
+            if e.status == 404:
+                break
+            raise
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"StatefulSet {name} was not deleted within {LABEL_MIGRATION_TIMEOUT} seconds.")
+        time.sleep(0.5)
+
+    try:
+        api_instance.create_namespaced_stateful_set(namespace, body=manifest)
+    except ApiException:
+        # The pod and volume are still there; log the spec so it can be recreated by hand
+        logger.error(f"Could not recreate StatefulSet {name} during label migration: {json.dumps(manifest)}")
+        raise
+    logger.info(f"Migrated {name} to per-server labels.")
+    return True
+
+def get_pod_name(statefulset_name):
+    """Get the name of the pod running the Minecraft server."""
+    return f"{statefulset_name}-0"
+
+def get_statefulset_name(pod_name):
+    """Inverse of get_pod_name."""
+    return pod_name.rsplit('-', 1)[0]
+
+def console_backend_for(statefulset_name, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Return the console backend a server was created with.
+
+    Servers created before the backend annotation existed run under screen.
+    """
+    informer = get_statefulset_informer(cluster)
+    if not wait_for_cache(informer):
+        return CONSOLE_BACKEND
+    sts = informer.get(f"{namespace}/{statefulset_name}")
+    if sts is None:
+        return CONSOLE_BACKEND
+    return template_console_backend(sts)
+
+def template_console_backend(sts):
+    annotations = sts.spec.template.metadata.annotations or {}
+    return annotations.get(CONSOLE_BACKEND_ANNOTATION, "screen")
+
+def pipe_console_command():
+    """Command that follows the server log and forwards stdin into the console pipe.
+
+    The log follower is stopped as soon as stdin closes, so nothing is left
+    running in the container after the session ends.
+    """
+    script = (f"tail -n 100 -F {CONSOLE_LOG} & TAIL=$!; "
+              f"cat > {CONSOLE_PIPE}; kill $TAIL")
+    return ["/bin/sh", "-c", script]
+
+def find_minecraft_screen(screen_list_output):
+    """Return the id of the Minecraft screen session from ``screen -ls`` output."""
+    for screen in screen_list_output.splitlines():
+        if 'minecraft' in screen:
+            return screen.split('.')[0].strip()
+    return None
@@ -1,3 +1,1144 @@
+import io
+import json
+import struct
+import asyncio
+import threading
+import contextvars
+import tarfile
+import tempfile
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, mock, skipUnless
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
 from django.test import TestCase
+from kubernetes import client
+from prometheus_client import REGISTRY
+from . import backups
+from .backups import ChunkWriter, LocalBackupStore, snapshot_tar, tar_size
+from .broadcasters import NodeOverviewPublisher, ServerStatusPublisher, worker_group
+from .catalog import list_servers, reconcile, status_history
+from . import console
+from .console import RconClient, RconError, RconTransport, open_console
+from . import console_hub
+from .console_hub import ConsoleHub, SharedConsoleHub
+from .forms import CreateServerForm
+from .files import DATA_ROOT, resolve_path
+from . import hibernation
+from .hibernation import IdleScaler, hibernate_server
+from . import informers
+from .informers import Informer
+from .instrumentation import instrument_api_client, request_verb_and_resource
+from .kube_clients import DEFAULT_CLUSTER, get_async_registry, get_registry, parse_clusters, registry
+from .models import Server
+from .node_overview import node_summary, pod_requests
+from .placement import plan_placement, score_node
+from .routing import websocket_urlpatterns
+from . import restart_jobs
+from .restart_jobs import RESTART_TIMEOUT, RestartJob
+from .server_actions import run_bulk_server_actions
+from .scrollback import ConsoleBuffer
+from .server_templates import get_template
+from . import server_utils
+from .server_utils import (
+    HIBERNATE_ANNOTATION, HIBERNATED_ANNOTATION, SERVER_LABEL, build_statefulset_manifest, manifest_diff,
+    migrate_server_labels, server_labels
+)
+from .timeseries import TimeSeries
+from .views import _parse_range
+from . import warm_pool
+from .wake_proxy import Handshake, WakeProxy
+from .warm_pool import POOL_LABEL, POOL_RECLAIM_POLICY_ANNOTATION, build_pool_manifest, parse_pool_sizes
 
-# Create your tests here.
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class FakeRedisChannelLayer(RedisChannelLayer):
+    """Redis channel layer backed by an in-process fakeredis server.
+
+    Layers built on the same server behave like workers sharing one Redis.
+    """
+
+    def __init__(self, server, **kwargs):
+        super().__init__(hosts=["redis://fakeredis"], **kwargs)
+        self.server = server
+
+    def create_pool(self, index):
+        return fakeredis.FakeAsyncRedis(server=self.server).connection_pool
+
+
+class FakeConsole:
+    def __init__(self):
+        self.output = asyncio.Queue()
+        self.written = []
+        self.closed = False
+
+    async def read(self):
+        return await self.output.get()
+
+    async def write(self, text):
+        self.written.append(text)
+
+    async def close(self):
+        self.closed = True
+        self.output.put_nowait(None)
+
+
+def fake_attach(consoles):
+    async def attach(*args):
+        consoles.append(FakeConsole())
+        return consoles[-1]
+    return attach
+
+
+@skipUnless(fakeredis is not None, "fakeredis is not installed")
+class RedisChannelLayerTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.worker_a = FakeRedisChannelLayer(server)
+        self.worker_b = FakeRedisChannelLayer(server)
+
+    async def asyncTearDown(self):
+        await self.worker_a.flush()
+        await self.worker_a.close_pools()
+        await self.worker_b.close_pools()
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=2)
+
+    async def test_group_send_reaches_consumers_on_other_workers(self):
+        channel_a = await self.worker_a.new_channel()
+        channel_b = await self.worker_b.new_channel()
+        await self.worker_a.group_add("servers", channel_a)
+        await self.worker_b.group_add("servers", channel_b)
+
+        job = {'id': 'abc', 'namespace': 'default', 'name': 'survival', 'state': 'ready'}
+        await self.worker_a.group_send("servers", {'type': 'server.restart', 'job': job})
+
+        self.assertEqual((await self.receive(self.worker_a, channel_a))['job'], job)
+        self.assertEqual((await self.receive(self.worker_b, channel_b))['job'], job)
+
+    async def test_worker_groups_stay_on_their_worker(self):
+        with mock.patch('dashboard.broadcasters.WORKER_ID', 'worker-b'):
+            other_group = worker_group("nodes")
+        self.assertNotEqual(worker_group("nodes"), other_group)
+
+        local = await self.worker_a.new_channel()
+        remote = await self.worker_b.new_channel()
+        await self.worker_a.group_add(worker_group("nodes"), local)
+        await self.worker_b.group_add(other_group, remote)
+
+        await self.worker_a.group_send(worker_group("nodes"), {'type': 'node.status', 'data': []})
+
+        self.assertEqual((await self.receive(self.worker_a, local))['type'], 'node.status')
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.worker_b.receive(remote), timeout=0.2)
+
+    async def test_server_status_delta_survives_serialization(self):
+        publisher = ServerStatusPublisher("servers", 0)
+        summary = {'cluster': 'default', 'name': 'survival', 'namespace': 'default', 'replicas': 1,
+                   'ready_replicas': None}
+        publisher._pending = {
+            ('default', 'default/survival'): ('default', 'default', 'survival', summary),
+            ('default', 'default/creative'): ('default', 'default', 'creative', None),
+        }
+        channel = await self.worker_b.new_channel()
+        await self.worker_b.group_add("servers", channel)
+
+        with mock.patch('dashboard.broadcasters.get_channel_layer', return_value=self.worker_a):
+            await publisher._flush()
+
+        message = await self.receive(self.worker_b, channel)
+        self.assertEqual(message['servers'], [summary])
+        self.assertEqual(message['removed'], [{'cluster': 'default', 'namespace': 'default', 'name': 'creative'}])
+        self.assertTrue(message['partial'])
+
+    async def test_console_frames_keep_raw_bytes(self):
+        hub = ConsoleHub("survival", "rcon")
+        hub.buffer.append("[Server] Done (3.2s)!\n".encode('utf-8'))
+        hub.buffer.append("§a colour codes\n".encode('utf-8'))
+        channel = await self.worker_b.new_channel()
+        await self.worker_b.group_add(hub.group, channel)
+
+        await hub._send_frame(self.worker_a)
+
+        message = await self.receive(self.worker_b, channel)
+        self.assertEqual(message['type'], 'console.output')
+        self.assertEqual(message['start'], 0)
+        self.assertEqual(message['seq'], hub.buffer.end)
+        self.assertEqual(message['data'].decode('utf-8'), "[Server] Done (3.2s)!\n§a colour codes\n")
+
+    async def test_one_console_upstream_across_workers(self):
+        consoles = []
+        leader = SharedConsoleHub("survival", "rcon", channel_layer=self.worker_a)
+        follower = SharedConsoleHub("survival", "rcon", channel_layer=self.worker_b)
+        viewer = await self.worker_b.new_channel()
+        with mock.patch.object(console_hub, 'attach_to_console', fake_attach(consoles)):
+            await leader.join(await self.worker_a.new_channel())
+            consoles[0].output.put_nowait("[Server] Done!\n")
+            await asyncio.sleep(0.2)
+            await follower.join(viewer)
+
+            self.assertEqual(len(consoles), 1)
+            self.assertEqual(follower.stream_id, leader.stream_id)
+            self.assertEqual(follower.scrollback()[2], b"[Server] Done!\n")
+
+            await follower.write("list\n")
+            consoles[0].output.put_nowait("There are 0 of a max of 20 players online\n")
+            message = await self.receive(self.worker_b, viewer)
+            self.assertEqual(message['data'], b"There are 0 of a max of 20 players online\n")
+            self.assertEqual(consoles[0].written, ["list\n"])
+
+            await leader._teardown()
+            await follower._teardown()
+
+
+class NodeOverviewPublisherTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.informers = {kind: Informer(kind, mock.Mock()) for kind in ("nodes", "pods", "statefulsets")}
+        self.views = {}
+        self.channel_layer = SimpleNamespace(group_send=mock.AsyncMock())
+        patchers = [
+            mock.patch('dashboard.broadcasters.get_node_informer', return_value=self.informers["nodes"]),
+            mock.patch('dashboard.broadcasters.get_pod_informer', return_value=self.informers["pods"]),
+            mock.patch('dashboard.broadcasters.get_statefulset_informer', return_value=self.informers["statefulsets"]),
+            mock.patch('dashboard.broadcasters.get_channel_layer', return_value=self.channel_layer),
+            mock.patch('dashboard.broadcasters.node_summaries', side_effect=lambda names: [
+                self.views[name] for name in sorted(names) if name in self.views]),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.publisher = NodeOverviewPublisher("nodes.test", 0.01)
+
+    def node_event(self, name):
+        self.informers["nodes"]._notify("MODIFIED", SimpleNamespace(metadata=SimpleNamespace(name=name)), None)
+
+    async def flushed(self):
+        await asyncio.sleep(0.05)
+        sent = [call.args[1] for call in self.channel_layer.group_send.call_args_list]
+        self.channel_layer.group_send.reset_mock()
+        return sent
+
+    async def test_changed_views_are_coalesced(self):
+        self.views = {'node-1': {'name': 'node-1', 'servers': []}, 'node-2': {'name': 'node-2', 'servers': []}}
+        self.publisher.subscribe()
+        self.node_event('node-1')
+        self.node_event('node-2')
+        self.node_event('node-1')
+        self.assertEqual(await self.flushed(), [{'type': 'node.status', 'nodes': list(self.views.values()),
+                                                 'removed': [], 'partial': True}])
+
+        # Unchanged views are not sent again, deleted nodes are reported as removed
+        self.views = {'node-1': {'name': 'node-1', 'servers': ['lobby']}}
+        self.node_event('node-1')
+        self.node_event('node-2')
+        self.assertEqual(await self.flushed(), [{'type': 'node.status', 'nodes': [self.views['node-1']],
+                                                 'removed': ['node-2'], 'partial': True}])
+        self.node_event('node-1')
+        self.assertEqual(await self.flushed(), [])
+
+    async def test_views_are_only_built_while_subscribed(self):
+        self.views = {'node-1': {'name': 'node-1', 'servers': []}}
+        self.publisher.subscribe()
+        self.publisher.subscribe()
+        self.publisher.unsubscribe()
+        self.node_event('node-1')
+        self.assertEqual(len(await self.flushed()), 1)
+
+        self.publisher.unsubscribe()
+        self.assertEqual([informer._handlers for informer in self.informers.values()], [[], [], []])
+        self.node_event('node-1')
+        self.assertEqual(await self.flushed(), [])
+
+        # A new subscriber got a full snapshot on connect, so the next change is sent in full again
+        self.publisher.subscribe()
+        self.node_event('node-1')
+        self.assertEqual(len(await self.flushed()), 1)
+        self.publisher.unsubscribe()
+
+
+class ConsoleTests(IsolatedAsyncioTestCase):
+    def test_buffer_keeps_the_newest_bytes(self):
+        buffer = ConsoleBuffer(8)
+        buffer.append(b"abcdef")
+        buffer.append(b"ghij")
+
+        self.assertEqual((buffer.start, buffer.end), (2, 10))
+        self.assertEqual(buffer.read_from(0), (2, b"cdefghij"))
+        self.assertEqual(buffer.read_from(7), (7, b"hij"))
+        buffer.append(b"0123456789")
+        self.assertEqual(buffer.read_from(0), (12, b"23456789"))
+
+    def test_buffer_replays_whole_lines(self):
+        buffer = ConsoleBuffer(64)
+        buffer.append(b"one\ntwo\nthree\n")
+
+        self.assertEqual(buffer.tail_lines(2), (4, b"two\nthree\n"))
+        self.assertEqual(buffer.tail_lines(10), (0, b"one\ntwo\nthree\n"))
+        buffer.clear()
+        self.assertEqual(buffer.read_from(0), (14, b""))
+
+    def test_scrollback_resumes_or_reports_lost_output(self):
+        hub = ConsoleHub("survival", "rcon")
+        hub.buffer = ConsoleBuffer(16)
+        hub.buffer.append(b"line one\n")
+        seen = hub.buffer.end
+        hub.buffer.append(b"two\n")
+
+        self.assertEqual(hub.scrollback(seen), (9, 13, b"two\n", True))
+        hub.buffer.append(b"a long third line\n")
+        start, end, data, resumed = hub.scrollback(seen)
+        self.assertFalse(resumed)
+        self.assertEqual((start, end), (hub.buffer.start, hub.buffer.end))
+
+    async def test_reconnect_within_grace_keeps_the_console(self):
+        consoles = []
+        hub = ConsoleHub("survival", "rcon")
+        with mock.patch.object(console_hub, 'attach_to_console', fake_attach(consoles)), \
+                mock.patch.object(console_hub, 'CONSOLE_IDLE_GRACE', 0.05):
+            await hub.join("viewer")
+            hub.buffer.append(b"[Server] Done!\n")
+            seq = hub.buffer.end
+            await hub.leave("viewer")
+            await hub.join("viewer")
+
+            self.assertEqual(len(consoles), 1)
+            self.assertTrue(hub.scrollback(seq)[3])
+
+            await hub.leave("viewer")
+            await asyncio.sleep(0.1)
+            self.assertTrue(consoles[0].closed)
+            self.assertTrue(hub.is_idle())
+
+
+class FakeRconServer:
+    """The server end of an RCON connection, used as the client's writer.
+
+    Responses are split into 4096 byte packets like Minecraft does, and
+    unknown packet types are answered with "Unknown request".
+    """
+
+    def __init__(self, password, responses):
+        self.reader = asyncio.StreamReader()
+        self.password = password
+        self.responses = responses
+        self.closed = False
+
+    def reply(self, request_id, body):
+        payload = struct.pack('<ii', request_id, 0) + body + b'\x00\x00'
+        self.reader.feed_data(struct.pack('<i', len(payload)) + payload)
+
+    def write(self, data):
+        while data:
+            length, = struct.unpack('<i', data[:4])
+            request_id, packet_type = struct.unpack('<ii', data[4:12])
+            body = data[12:4 + length - 2].decode('utf-8')
+            data = data[4 + length:]
+            if packet_type == console.RCON_TYPE_LOGIN:
+                self.reply(request_id if body == self.password else -1, b'')
+            elif packet_type == console.RCON_TYPE_COMMAND:
+                response = self.responses[body].encode('utf-8')
+                for offset in range(0, len(response), 4096):
+                    self.reply(request_id, response[offset:offset + 4096])
+            else:
+                self.reply(request_id, f"Unknown request {packet_type:x}".encode('utf-8'))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class ConsoleTransportTests(IsolatedAsyncioTestCase):
+    async def connect(self, server, password):
+        open_connection = mock.AsyncMock(return_value=(server.reader, server))
+        with mock.patch.object(console.asyncio, 'open_connection', open_connection):
+            return await RconClient.connect("10.0.0.5", console.RCON_PORT, password)
+
+    async def test_rcon_commands_and_multi_packet_responses(self):
+        # 3 byte characters, so a packet boundary falls inside one
+        banlist = "§" * 3000
+        server = FakeRconServer("secret", {'list': "There are 0 of a max of 20 players online: ", 'banlist': banlist})
+        rcon = await self.connect(server, "secret")
+
+        self.assertEqual(await rcon.command('banlist'), banlist)
+        self.assertEqual(await rcon.command('list'), "There are 0 of a max of 20 players online: ")
+        await rcon.close()
+        self.assertTrue(server.closed)
+
+    async def test_rcon_authentication_failure(self):
+        server = FakeRconServer("secret", {})
+        with self.assertRaises(RconError):
+            await self.connect(server, "wrong")
+        self.assertTrue(server.closed)
+
+    async def test_rcon_transport_merges_log_and_command_output(self):
+        server = FakeRconServer("secret", {'list': "There are 0 of a max of 20 players online: "})
+        rcon = await self.connect(server, "secret")
+        log_response = SimpleNamespace(content=_stream(b"[Server thread/INFO]: Done\n", size=1024),
+                                       release=mock.Mock())
+        transport = RconTransport(rcon, log_response)
+
+        self.assertEqual(await transport.read(), "[Server thread/INFO]: Done\n")
+        self.assertIsNone(await transport.read())
+        await transport.write("list\n\n")
+        self.assertEqual(await transport.read(), "There are 0 of a max of 20 players online: \n")
+        await transport.close()
+        log_response.release.assert_called_once()
+
+    async def test_unreachable_rcon_falls_back_to_the_console_pipe(self):
+        pipe = object()
+        with mock.patch.object(console.RconTransport, 'open', side_effect=ConnectionRefusedError()), \
+                mock.patch.object(console.ExecTransport, 'open', return_value=pipe) as open_exec:
+            self.assertIs(await open_console("lobby", "lobby-0", "rcon"), pipe)
+        open_exec.assert_called_once_with("lobby-0", console.pipe_console_command(), tty=False,
+                                          namespace="default", cluster="default")
+
+        with mock.patch.object(console.RconTransport, 'open', side_effect=RconError("Pod lobby-0 has no IP yet.")), \
+                mock.patch.object(console.ExecTransport, 'open', return_value=pipe):
+            self.assertIs(await open_console("lobby", "lobby-0", "rcon"), pipe)
+
+
+def fake_statefulset(name, replicas=1, ready=1, resource_version="1", managed=True, labels=None, pod_labels=None):
+    container = SimpleNamespace(name="minecraft-server", env=[
+        SimpleNamespace(name="MEMORY", value="2G", value_from=None),
+        SimpleNamespace(name="RCON_PASSWORD", value=None, value_from=object()),
+    ])
+    return SimpleNamespace(
+        metadata=SimpleNamespace(namespace="default", name=name, resource_version=resource_version, labels=labels,
+                                 annotations={"managed-by": "mindworld"} if managed else {}),
+        spec=SimpleNamespace(replicas=replicas, template=SimpleNamespace(metadata=SimpleNamespace(labels=pod_labels),
+                                                                         spec=SimpleNamespace(containers=[container]))),
+        status=SimpleNamespace(ready_replicas=ready)
+    )
+
+
+@mock.patch('dashboard.catalog.CONTAINER_NAME', 'minecraft-server')
+class ServerCatalogTests(TestCase):
+    def test_reconcile_mirrors_managed_statefulsets(self):
+        reconcile([fake_statefulset("lobby"), fake_statefulset("creative", replicas=0, ready=None),
+                   fake_statefulset("other", managed=False)])
+
+        total, servers = list_servers()
+        self.assertEqual(total, 2)
+        self.assertEqual([server['name'] for server in servers], ["creative", "lobby"])
+        self.assertEqual(list_servers(status="Running")[1][0]['name'], "lobby")
+        self.assertEqual(Server.objects.get(name="lobby").config.env, {"MEMORY": "2G"})
+
+    def test_status_changes_and_deletions_are_recorded(self):
+        reconcile([fake_statefulset("lobby")])
+        reconcile([fake_statefulset("lobby", resource_version="2")])
+        reconcile([fake_statefulset("lobby", replicas=0, ready=None, resource_version="3")])
+        reconcile([])
+
+        self.assertEqual(list_servers(), (0, []))
+        history = status_history("default", "lobby")
+        self.assertEqual([change['status'] for change in history], ["Deleted", "Stopped", "Running"])
+
+    def test_clusters_are_reconciled_separately(self):
+        reconcile([fake_statefulset("lobby")])
+        reconcile([fake_statefulset("lobby", replicas=0, ready=None)], cluster="eu")
+        reconcile([], cluster="eu")
+
+        total, servers = list_servers()
+        self.assertEqual(total, 1)
+        self.assertEqual((servers[0]['cluster'], servers[0]['status']), ("default", "Running"))
+        self.assertEqual(status_history("default", "lobby", cluster="eu")[0]['status'], "Deleted")
+
+
+class ManifestDiffTests(TestCase):
+    def test_only_desired_fields_are_compared(self):
+        desired = {'spec': {'replicas': 1, 'template': {'spec': {'containers': [{'name': "minecraft-server"}]}}}}
+        container = {'name': "minecraft-server", 'imagePullPolicy': "Always"}
+        current = {'spec': {'replicas': 1, 'revisionHistoryLimit': 10,
+                            'template': {'spec': {'containers': [container]}}},
+                   'status': {'readyReplicas': 1}}
+        self.assertEqual(manifest_diff(desired, current), [])
+
+    def test_changed_fields_are_reported_by_path(self):
+        containers = [{'image': "paper"}, {'image': "proxy"}]
+        desired = {'metadata': {'labels': {'env': "event"}},
+                   'spec': {'replicas': 1, 'template': {'spec': {'containers': containers}}}}
+        current = {'metadata': {},
+                   'spec': {'replicas': 0, 'template': {'spec': {'containers': [{'image': "vanilla"}]}}}}
+        self.assertEqual(manifest_diff(desired, current),
+                         ["metadata.labels", "spec.replicas", "spec.template.spec.containers"])
+        self.assertEqual(manifest_diff({'env': [{'name': "MEMORY", 'value': "4G"}]},
+                                       {'env': [{'name': "MEMORY", 'value': "2G"}]}), ["env[0].value"])
+        self.assertEqual(manifest_diff({'spec': {}}, None), ["."])
+
+
+def legacy_statefulset(name, selector):
+    return client.V1StatefulSet(
+        metadata=client.V1ObjectMeta(name=name, namespace="default", uid="1234", resource_version="7",
+                                     annotations={"managed-by": "mindworld"}),
+        spec=client.V1StatefulSetSpec(
+            selector=client.V1LabelSelector(match_labels=selector), service_name=f"{name}-service",
+            template=client.V1PodTemplateSpec(metadata=client.V1ObjectMeta(labels={"app": "minecraft-server"}),
+                                              spec=client.V1PodSpec(containers=[]))),
+        status=client.V1StatefulSetStatus(replicas=1))
+
+
+class LabelMigrationTests(TestCase):
+    def setUp(self):
+        self.apps_api = mock.MagicMock()
+        self.core_api = mock.MagicMock()
+        clients = SimpleNamespace(apps_api=lambda: self.apps_api, core_api=lambda: self.core_api)
+        patchers = [mock.patch.object(server_utils, 'get_registry', return_value=clients),
+                    mock.patch.object(server_utils, 'registry', SimpleNamespace(api_client=client.ApiClient))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_statefulset_is_recreated_with_its_own_selector(self):
+        self.apps_api.read_namespaced_stateful_set.side_effect = [
+            legacy_statefulset("lobby", {"app": "minecraft-server"}), server_utils.ApiException(status=404)]
+
+        self.assertTrue(migrate_server_labels("lobby"))
+
+        labels = {"app": "minecraft-server", SERVER_LABEL: "lobby"}
+        self.core_api.patch_namespaced_pod.assert_called_once_with("lobby-0", "default",
+                                                                   {"metadata": {"labels": labels}})
+        self.core_api.patch_namespaced_service.assert_called_once_with("lobby-service", "default",
+                                                                       {"spec": {"selector": labels}})
+        self.apps_api.delete_namespaced_stateful_set.assert_called_once_with("lobby", "default",
+                                                                             propagation_policy="Orphan")
+        manifest = self.apps_api.create_namespaced_stateful_set.call_args.kwargs['body']
+        self.assertEqual(manifest['metadata'], {'name': "lobby", 'namespace': "default", 'labels': labels,
+                                                'annotations': {"managed-by": "mindworld"}})
+        self.assertEqual(manifest['spec']['selector'], {'matchLabels': labels})
+        self.assertEqual(manifest['spec']['template']['metadata']['labels'], labels)
+        self.assertNotIn('status', manifest)
+
+    def test_migrated_servers_are_left_alone(self):
+        self.apps_api.read_namespaced_stateful_set.return_value = legacy_statefulset(
+            "lobby", {"app": "minecraft-server", SERVER_LABEL: "lobby"})
+
+        self.assertFalse(migrate_server_labels("lobby"))
+        self.core_api.patch_namespaced_pod.assert_not_called()
+        self.apps_api.delete_namespaced_stateful_set.assert_not_called()
+
+
+def player_sample(name, players):
+    return {'namespace': "default", 'name': name, 'players': players}
+
+
+class IdleScalerTests(IsolatedAsyncioTestCase):
+    def test_disabled_without_an_idle_period(self):
+        with mock.patch.object(hibernation, 'metrics_collector') as collector:
+            IdleScaler(0).start()
+        collector.add_listener.assert_not_called()
+        collector.start.assert_not_called()
+
+    async def test_servers_are_hibernated_after_the_idle_period(self):
+        scaler = IdleScaler(100)
+        with mock.patch.object(hibernation, 'hibernate_server', return_value=True) as hibernate:
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 0)
+            await scaler.observe([player_sample("lobby", 3), player_sample("creative", None)], 60)
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 120)
+            hibernate.assert_not_called()
+
+            # Idle since the players left at 60, while an unreadable player count keeps a server up
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 160)
+            hibernate.assert_called_once_with("default", "lobby")
+
+            # A hibernated server drops out of the samples and gets a new idle period when it is back
+            await scaler.observe([player_sample("creative", None)], 170)
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 200)
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 280)
+            hibernate.assert_called_once()
+            await scaler.observe([player_sample("lobby", 0), player_sample("creative", None)], 300)
+        self.assertEqual(hibernate.call_args_list, [mock.call("default", "lobby")] * 2)
+
+    def test_only_running_servers_that_allow_it_are_hibernated(self):
+        statefulsets = {
+            "default/lobby": fake_statefulset("lobby"),
+            "default/stopped": fake_statefulset("stopped", replicas=0, ready=None),
+            "default/pinned": fake_statefulset("pinned"),
+        }
+        statefulsets["default/pinned"].metadata.annotations[HIBERNATE_ANNOTATION] = "false"
+        informer = SimpleNamespace(get=statefulsets.get)
+        with mock.patch.object(hibernation, 'get_statefulset_informer', return_value=informer), \
+                mock.patch.object(hibernation, 'set_hibernated', return_value=True) as set_hibernated, \
+                mock.patch.object(hibernation, 'scale_statefulset', return_value=True) as scale:
+            self.assertFalse(hibernate_server("default", "stopped"))
+            self.assertFalse(hibernate_server("default", "pinned"))
+            self.assertFalse(hibernate_server("default", "missing"))
+            set_hibernated.assert_not_called()
+
+            self.assertTrue(hibernate_server("default", "lobby"))
+            set_hibernated.assert_called_once_with("default", "lobby", True)
+            scale.assert_called_once_with("default", "lobby", replicas=0)
+
+            scale.return_value = False
+            self.assertFalse(hibernate_server("default", "lobby"))
+            set_hibernated.assert_called_with("default", "lobby", False)
+
+
+class CreateServerFormTests(TestCase):
+    def form(self, memory):
+        return CreateServerForm({'serverName': "lobby", 'template': "paper", 'memory': memory,
+                                 'maxPlayers': 20, 'eula': True})
+
+    def test_memory_must_be_a_usable_heap_size(self):
+        self.assertTrue(self.form(" 1536m ").is_valid())
+        self.assertTrue(self.form("512M").is_valid())
+        for memory in ("0", "0G", "256M", "2 GB", "-1G"):
+            with self.subTest(memory=memory):
+                form = self.form(memory)
+                self.assertFalse(form.is_valid())
+                self.assertIn('memory', form.errors)
+
+
+class BulkServerActionTests(TestCase):
+    def post(self, payload):
+        return self.client.post('/api/servers/bulk/', json.dumps(payload), content_type='application/json')
+
+    def test_malformed_requests_are_rejected(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post({'servers': ["lobby"]}).status_code, 400)
+        self.assertEqual(self.post({'servers': {'name': "lobby"}}).status_code, 400)
+        self.assertEqual(self.post({'selector': 7, 'action': 'stop'}).status_code, 400)
+
+    def test_set_based_selectors_are_rejected(self):
+        with mock.patch('dashboard.views.run_bulk_server_actions') as run:
+            response = self.post({'selector': 'env in (event,summer)', 'action': 'stop'})
+        self.assertEqual(response.status_code, 400)
+        run.assert_not_called()
+
+    def test_selector_applies_the_action_to_matching_servers(self):
+        statefulsets = [
+            fake_statefulset("lobby", labels={**server_labels("lobby"), 'tier': "event"}),
+            fake_statefulset("creative", pod_labels={'app': "minecraft-server"}),
+            fake_statefulset("other", labels={'app': "minecraft-server"}, managed=False),
+        ]
+        informer = SimpleNamespace(list=lambda: statefulsets, wait_for_sync=lambda timeout=None: True)
+        with mock.patch('dashboard.server_actions.statefulset_informers', return_value={'default': informer}), \
+                mock.patch('dashboard.server_actions.scale_statefulset', return_value=True) as scale:
+            response = self.post({'selector': 'app=minecraft-server', 'action': 'start'})
+            self.post({'selector': 'tier=event', 'action': 'start'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(result['name'] for result in response.json()['results']), ["creative", "lobby"])
+        self.assertEqual(sorted(call.args[1] for call in scale.call_args_list), ["creative", "lobby", "lobby"])
+        self.assertEqual(build_statefulset_manifest("lobby", {})['metadata']['labels'], server_labels("lobby"))
+
+
+def fake_pod(uid, node=None, ready=False):
+    return SimpleNamespace(metadata=SimpleNamespace(uid=uid), spec=SimpleNamespace(node_name=node),
+                           status=SimpleNamespace(conditions=[SimpleNamespace(type='Ready', status=str(ready))]))
+
+
+class RestartJobTests(TestCase):
+    def setUp(self):
+        self.core_api = mock.MagicMock()
+        self.core_api.read_namespaced_pod.return_value = fake_pod("old", node="node-1", ready=True)
+        self.published = []
+        channel_layer = SimpleNamespace(group_send=mock.AsyncMock(
+            side_effect=lambda group, message: self.published.append((group, message['job']['state']))))
+        clients = SimpleNamespace(core_api=lambda: self.core_api)
+        patchers = [
+            mock.patch.object(restart_jobs, 'get_registry', return_value=clients),
+            mock.patch.object(restart_jobs, 'get_channel_layer', return_value=channel_layer),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def restart(self, *events):
+        self.pod_watch = mock.MagicMock()
+        self.pod_watch.stream.return_value = iter([{'type': event_type, 'object': pod} for event_type, pod in events])
+        job = RestartJob("default", "lobby")
+        with mock.patch.object(restart_jobs.watch, 'Watch', return_value=self.pod_watch):
+            restart_jobs._run(job)
+        return job
+
+    def test_pod_is_replaced_until_ready(self):
+        job = self.restart(("MODIFIED", fake_pod("old", node="node-1")), ("DELETED", fake_pod("old", node="node-1")),
+                           ("ADDED", fake_pod("new")), ("MODIFIED", fake_pod("new", node="node-2")),
+                           ("MODIFIED", fake_pod("new", node="node-2", ready=True)))
+
+        self.core_api.delete_namespaced_pod.assert_called_once_with("lobby-0", "default")
+        self.assertEqual(self.pod_watch.stream.call_args.kwargs['field_selector'], "metadata.name=lobby-0")
+        self.assertEqual(self.published, [("servers", 'terminating'), ("servers", 'scheduled'), ("servers", 'ready')])
+        self.assertEqual((job.state, job.node), ('ready', "node-2"))
+
+    def test_stopped_server_is_started(self):
+        self.core_api.read_namespaced_pod.side_effect = restart_jobs.ApiException(status=404)
+        with mock.patch.object(restart_jobs, 'scale_statefulset', return_value=True) as scale:
+            job = self.restart(("ADDED", fake_pod("new", node="node-1", ready=True)))
+
+        scale.assert_called_once_with("default", "lobby", replicas=1, cluster="default")
+        self.core_api.delete_namespaced_pod.assert_not_called()
+        self.assertEqual([state for _, state in self.published], ['scheduled', 'ready'])
+
+        with mock.patch.object(restart_jobs, 'scale_statefulset', return_value=False):
+            job = self.restart()
+        self.assertEqual((job.state, job.message), ('failed', "Could not scale the server up."))
+
+    def test_pod_that_never_becomes_ready_fails_the_job(self):
+        job = self.restart(("ADDED", fake_pod("new", node="node-1")))
+
+        self.assertEqual([state for _, state in self.published], ['terminating', 'scheduled', 'failed'])
+        self.assertEqual(job.message, f"Server was not ready after {RESTART_TIMEOUT} seconds.")
+
+    def test_api_errors_fail_the_job(self):
+        self.core_api.delete_namespaced_pod.side_effect = restart_jobs.ApiException(status=403, reason="Forbidden")
+        job = self.restart()
+
+        self.assertEqual(job.state, 'failed')
+        self.assertIn("Forbidden", job.message)
+        self.assertEqual(self.published, [("servers", 'failed')])
+
+
+def k8s_container(requests=None, limits=None):
+    return SimpleNamespace(resources=SimpleNamespace(requests=requests, limits=limits))
+
+
+def k8s_pod(containers, init_containers=None, overhead=None, namespace="default", owner=None, ready=True):
+    owner_references = [SimpleNamespace(kind="StatefulSet", name=owner)] if owner else None
+    return SimpleNamespace(
+        metadata=SimpleNamespace(namespace=namespace, owner_references=owner_references),
+        spec=SimpleNamespace(containers=containers, init_containers=init_containers, overhead=overhead),
+        status=SimpleNamespace(phase="Running" if ready else "Pending",
+                               conditions=[SimpleNamespace(type="Ready", status=str(ready))]))
+
+
+def k8s_node(ready="True", unschedulable=None):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name="node-1"),
+        spec=SimpleNamespace(unschedulable=unschedulable),
+        status=SimpleNamespace(
+            allocatable={'cpu': "4", 'memory': "8Gi", 'pods': "110"}, capacity={'cpu': "4", 'memory': "8Gi"},
+            conditions=[SimpleNamespace(type="Ready", status=ready)],
+            addresses=[SimpleNamespace(type="Hostname", address="node-1"),
+                       SimpleNamespace(type="InternalIP", address="10.0.0.1")],
+            node_info=SimpleNamespace(os_image="Ubuntu 24.04", kubelet_version="v1.33.1")))
+
+
+class NodeOverviewTests(TestCase):
+    def test_pod_requests(self):
+        app = [k8s_container(requests={'cpu': "250m", 'memory': "512Mi"}),
+               k8s_container(limits={'cpu': "250m", 'memory': "256Mi"})]
+        self.assertEqual(pod_requests(k8s_pod(app)), (500, 768 * 1024 ** 2))
+
+        # The largest init container counts if it asks for more than the app containers together
+        init = [k8s_container(requests={'cpu': "1", 'memory': "1Gi"}), k8s_container(requests={'cpu': "100m"})]
+        self.assertEqual(pod_requests(k8s_pod(app, init_containers=init)), (1000, 1024 ** 3))
+        init = [k8s_container(requests={'cpu': "100m", 'memory': "1Gi"})]
+        self.assertEqual(pod_requests(k8s_pod(app, init_containers=init)), (500, 1024 ** 3))
+
+        overhead = {'cpu': "100m", 'memory': "64Mi"}
+        self.assertEqual(pod_requests(k8s_pod(app, overhead=overhead)), (600, 832 * 1024 ** 2))
+
+    def test_node_summary(self):
+        pods = [k8s_pod([k8s_container(requests={'cpu': "1", 'memory': "2Gi"})], owner="lobby"),
+                k8s_pod([k8s_container(requests={'cpu': "500m", 'memory': "1Gi"})], owner="creative", ready=False),
+                k8s_pod([k8s_container(requests={'cpu': "500m", 'memory': "1Gi"})], namespace="kube-system",
+                        owner="etcd")]
+        summary = node_summary(k8s_node(), pods, {("default", "lobby"), ("default", "creative")})
+
+        self.assertEqual((summary['status'], summary['schedulable'], summary['address']), ("Ready", True, "10.0.0.1"))
+        self.assertEqual(summary['allocated'], {'cpu': 2000, 'memory': 4 * 1024 ** 3, 'pods': 3})
+        # Default server requests are 500m and 2Gi, memory runs out first
+        self.assertEqual(summary['headroom'], {'cpu': 2000, 'memory': 4 * 1024 ** 3, 'servers': 2})
+        self.assertEqual(summary['servers'], [{'namespace': "default", 'name': "creative", 'status': "Pending"},
+                                              {'namespace': "default", 'name': "lobby", 'status': "Running"}])
+
+    def test_unavailable_nodes_have_no_server_headroom(self):
+        summary = node_summary(k8s_node(ready="False"), [], set())
+        self.assertEqual((summary['status'], summary['schedulable'], summary['headroom']['servers']),
+                         ("NotReady", False, 0))
+        self.assertEqual(node_summary(k8s_node(ready="Unknown"), [], set())['status'], "Unknown")
+        self.assertFalse(node_summary(k8s_node(unschedulable=True), [], set())['schedulable'])
+
+
+def fake_node(name, cpu=4000, memory=8 * 1024 ** 3, allocated_cpu=0, allocated_memory=0, servers=0):
+    return {
+        'name': name,
+        'schedulable': True,
+        'allocatable': {'cpu': cpu, 'memory': memory, 'pods': 110},
+        'allocated': {'cpu': allocated_cpu, 'memory': allocated_memory, 'pods': servers},
+        'headroom': {'cpu': cpu - allocated_cpu, 'memory': memory - allocated_memory},
+        'servers': [f"{name}-server-{index}" for index in range(servers)]
+    }
+
+
+class PlacementTests(TestCase):
+    def test_pack_prefers_busy_nodes_and_spread_empty_ones(self):
+        busy = fake_node('busy', allocated_cpu=2000, allocated_memory=4 * 1024 ** 3)
+        empty = fake_node('empty')
+        server = (1000, 2 * 1024 ** 3)
+
+        self.assertGreater(score_node(busy, *server, 0, 'pack'), score_node(empty, *server, 0, 'pack'))
+        self.assertGreater(score_node(empty, *server, 0, 'spread'), score_node(busy, *server, 0, 'spread'))
+        self.assertIsNone(score_node(fake_node('full', allocated_cpu=3500), *server, 0, 'pack'))
+
+    def test_nodes_without_allocatable_capacity_are_skipped(self):
+        virtual = fake_node('virtual', cpu=0, memory=0)
+        virtual['headroom'] = {'cpu': 10 ** 6, 'memory': 10 ** 12}
+        self.assertIsNone(score_node(virtual, 0, 0, 0))
+
+        with mock.patch('dashboard.placement.list_kubernetes_nodes', return_value=[virtual, fake_node('node-1')]):
+            placement = plan_placement({'MEMORY': '2G'}, strategy='spread')
+        preferred = placement['affinity']['nodeAffinity']['preferredDuringSchedulingIgnoredDuringExecution']
+        self.assertEqual([term['preference']['matchFields'][0]['values'] for term in preferred], [['node-1']])
+        self.assertIn('topologySpreadConstraints', placement)
+
+    def test_no_fitting_node_leaves_placement_to_the_scheduler(self):
+        with mock.patch('dashboard.placement.list_kubernetes_nodes', return_value=[fake_node('small', cpu=100)]):
+            self.assertEqual(plan_placement({'MEMORY': '2G'}, strategy='pack'), {})
+
+
+class TimeSeriesTests(TestCase):
+    def test_samples_are_downsampled_per_tier(self):
+        series = TimeSeries(('cpu', 'players'), [(60, 4), (15, 4)])
+        for timestamp, cpu in ((1800, 1.0), (1805, 3.0), (1815, 2.0)):
+            series.add(timestamp, {'cpu': cpu, 'players': None})
+
+        with mock.patch('dashboard.timeseries.time.time', return_value=1830):
+            self.assertEqual(series.query(1800, 1830),
+                             (15, {'cpu': [[1800, 2.0, 3.0], [1815, 2.0, 2.0]], 'players': []}))
+            self.assertEqual(series.query(1800, 1830, step=60), (60, {'cpu': [[1800, 2.0, 3.0]], 'players': []}))
+
+    def test_old_buckets_are_reused(self):
+        series = TimeSeries(('cpu',), [(15, 4)])
+        series.add(1800, {'cpu': 1.0})
+        series.add(1860, {'cpu': 5.0})
+
+        with mock.patch('dashboard.timeseries.time.time', return_value=1860):
+            self.assertEqual(series.query(1800, 1800), (15, {'cpu': []}))
+            self.assertEqual(series.query(1800, 1860), (15, {'cpu': [[1860, 5.0, 5.0]]}))
+
+
+class ServerMetricsViewTests(TestCase):
+    def test_non_finite_ranges_are_rejected(self):
+        with mock.patch('dashboard.views.metrics_collector') as collector:
+            for query in ('start=nan', 'end=inf', 'start=-inf&end=10', 'step=nan'):
+                response = self.client.get(f'/api/servers/default/lobby/metrics/?{query}')
+                self.assertEqual(response.status_code, 400, query)
+        collector.series.assert_not_called()
+
+
+async def _stream(data, size=700):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+@mock.patch.object(backups, 'BACKUP_CHUNK_SIZE', 1024)
+class BackupTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.store = LocalBackupStore(self.tempdir.name)
+        self.files = {
+            'level.dat': b'level' * 100,
+            'world/region/r.0.0.mca': bytes(range(256)) * 20,
+            'world/' + 'long-name-' * 12 + '.json': b'{}',
+        }
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _tar(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w', format=tarfile.GNU_FORMAT) as tar:
+            for path, data in self.files.items():
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                info.mtime = 1700000000
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    async def test_unchanged_chunks_are_not_uploaded_again(self):
+        first = ChunkWriter(self.store)
+        stored = await first.store_tar(_stream(self._tar()))
+        self.assertEqual(set(stored), set(self.files))
+        self.assertEqual(len(stored['world/region/r.0.0.mca']['chunks']), 5)
+
+        # One sector of the region file rewritten in place
+        region = bytearray(self.files['world/region/r.0.0.mca'])
+        region[2048:2052] = b'edit'
+        self.files['world/region/r.0.0.mca'] = bytes(region)
+        second = ChunkWriter(self.store)
+        await second.store_tar(_stream(self._tar()))
+        self.assertEqual(second.uploaded_chunks, 1)
+        self.assertEqual(second.uploaded_bytes, 1024)
+
+    async def test_snapshot_tar_restores_the_stored_files(self):
+        stored = await ChunkWriter(self.store).store_tar(_stream(self._tar()))
+        files = [{'path': path, **entry} for path, entry in sorted(stored.items())]
+
+        data = b''.join([chunk async for chunk in snapshot_tar(self.store, files)])
+        self.assertEqual(len(data), tar_size(files))
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            restored = {member.name: tar.extractfile(member).read() for member in tar.getmembers()}
+        self.assertEqual(restored, self.files)
+
+    async def test_failed_restore_leaves_the_server_stopped(self):
+        manifest = {'id': '20240101T000000000000Z', 'files': [], 'stats': {}}
+        self.store.put('snapshots/default/survival/20240101T000000000000Z.json', json.dumps(manifest).encode())
+        volume_pod = mock.MagicMock()
+        volume_pod.__aenter__ = mock.AsyncMock()
+        volume_pod.__aexit__ = mock.AsyncMock(return_value=False)
+        scale = mock.AsyncMock(return_value=True)
+        check_managed = mock.AsyncMock(return_value=fake_statefulset("survival"))
+        job = backups.BackupJob('restore', 'default', 'survival', manifest['id'])
+
+        with mock.patch.object(backups, 'get_backup_store', return_value=self.store), \
+                mock.patch.object(backups, '_check_managed', check_managed), \
+                mock.patch.object(backups, '_wait_for_pod', mock.AsyncMock()), \
+                mock.patch.object(backups, '_VolumePod', return_value=volume_pod), \
+                mock.patch.object(backups, 'restore_volume', mock.AsyncMock(side_effect=backups.BackupError("boom"))), \
+                mock.patch.object(backups, 'scale_statefulset', scale):
+            await backups.run_job(job)
+
+        self.assertEqual(job.state, 'failed')
+        scale.assert_awaited_once_with('default', 'survival', 0, 'default')
+
+    def test_latest_snapshot_reads_one_manifest(self):
+        for snapshot_id in ('20240101T000000000000Z', '20240102T000000000000Z'):
+            self.store.put(f'snapshots/default/survival/{snapshot_id}.json', json.dumps({'id': snapshot_id}).encode())
+
+        with mock.patch.object(self.store, 'get', wraps=self.store.get) as get:
+            latest = backups.latest_snapshot(self.store, 'default', 'survival')
+        self.assertEqual(latest['id'], '20240102T000000000000Z')
+        self.assertEqual(get.call_count, 1)
+
+
+class WakeProxyTests(IsolatedAsyncioTestCase):
+    async def test_only_managed_servers_are_woken(self):
+        lobby = fake_statefulset("lobby", replicas=0, ready=0)
+        database = fake_statefulset("database", replicas=0, ready=0, managed=False)
+        for sts in (lobby, database):
+            sts.metadata.annotations[HIBERNATED_ANNOTATION] = "1700000000"
+        proxy = WakeProxy()
+        proxy._statefulsets = SimpleNamespace(get={"default/lobby": lobby, "default/database": database}.get)
+        writer = mock.MagicMock(drain=mock.AsyncMock())
+        login = Handshake(b'', 765, 'lobby.mc.example.com', 2)
+        scale = mock.AsyncMock(return_value=True)
+
+        with mock.patch('dashboard.wake_proxy.scale_statefulset', scale), \
+                mock.patch('dashboard.wake_proxy.set_hibernated', mock.AsyncMock()), \
+                mock.patch('dashboard.wake_proxy.WAKE_HOLD_SECONDS', 0.1):
+            self.assertFalse(await proxy._ensure_ready(None, writer, login, 'database'))
+            self.assertFalse(await proxy._ensure_ready(None, writer, login, 'missing'))
+            scale.assert_not_awaited()
+
+            await proxy._ensure_ready(None, writer, login, 'lobby')
+            scale.assert_awaited_once_with('default', 'lobby', 1)
+        for waking in list(proxy._waking.values()):
+            waking.cancel()
+
+
+class WarmPoolTests(TestCase):
+    def test_pool_members_are_not_servers(self):
+        self.assertEqual(parse_pool_sizes("vanilla=2, paper"), {'vanilla': 2, 'paper': 1})
+        with self.assertRaises(ValueError):
+            parse_pool_sizes("no-such-template=1")
+
+        manifest = build_pool_manifest('mindworld-pool-paper-0', get_template('paper'))
+        self.assertNotEqual(manifest['metadata']['annotations']['managed-by'], 'mindworld')
+        self.assertEqual(manifest['metadata']['labels'], {POOL_LABEL: 'paper'})
+        pod_template = manifest['spec']['template']
+        self.assertNotIn('app', pod_template['metadata']['labels'])
+        env = {var['name']: var for var in pod_template['spec']['containers'][0]['env']}
+        self.assertEqual(env['SETUP_ONLY']['value'], 'TRUE')
+        self.assertEqual(env['TYPE']['value'], 'PAPER')
+        self.assertFalse(any('valueFrom' in var for var in env.values()))
+
+    def test_failed_hand_over_restores_the_reclaim_policy(self):
+        volume = SimpleNamespace(metadata=SimpleNamespace(annotations={}),
+                                 spec=SimpleNamespace(persistent_volume_reclaim_policy='Delete'))
+
+        def patch_volume(name, body, **kwargs):
+            volume.metadata.annotations.update(body.get('metadata', {}).get('annotations', {}))
+            volume.spec.persistent_volume_reclaim_policy = body['spec'].get('persistentVolumeReclaimPolicy')
+
+        core_api = mock.MagicMock()
+        core_api.read_namespaced_persistent_volume_claim.return_value = SimpleNamespace(
+            spec=SimpleNamespace(volume_name='pvc-1234'))
+        core_api.read_persistent_volume.return_value = volume
+        core_api.patch_persistent_volume.side_effect = patch_volume
+        core_api.delete_namespaced_persistent_volume_claim.side_effect = warm_pool.ApiException(status=500)
+        registry = SimpleNamespace(core_api=lambda: core_api, apps_api=mock.MagicMock)
+
+        with mock.patch.object(warm_pool, 'registry', registry):
+            with self.assertRaises(warm_pool.ApiException):
+                warm_pool.WarmPool({'paper': 1})._transfer_volume('mindworld-pool-paper-0', 'survival')
+        self.assertEqual(volume.spec.persistent_volume_reclaim_policy, 'Delete')
+        self.assertIsNone(volume.metadata.annotations[POOL_RECLAIM_POLICY_ANNOTATION])
+
+
+def fake_object(name, resource_version):
+    return SimpleNamespace(metadata=SimpleNamespace(namespace="default", name=name, resource_version=resource_version))
+
+
+class FakeWatch:
+    """Stands in for ``watch.Watch``, playing one scripted stream per watch request."""
+
+    def __init__(self, streams, informer):
+        self.streams = streams
+        self.informer = informer
+        self.resource_versions = []
+
+    def __call__(self):
+        return self
+
+    def stream(self, list_func, resource_version=None, **kwargs):
+        self.resource_versions.append(resource_version)
+        if not self.streams:
+            self.informer.stop()
+            return
+        for event in self.streams.pop(0):
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def stop(self):
+        pass
+
+
+class InformerTests(TestCase):
+    def test_watch_resumes_from_bookmarks_and_relists_when_expired(self):
+        lists = [
+            SimpleNamespace(items=[fake_object("lobby", "1"), fake_object("creative", "1")],
+                            metadata=SimpleNamespace(resource_version="10")),
+            SimpleNamespace(items=[fake_object("lobby", "12"), fake_object("survival", "15")],
+                            metadata=SimpleNamespace(resource_version="20")),
+        ]
+        informer = Informer("test", lambda: lambda **kwargs: lists.pop(0))
+        events = []
+        informer.add_handler(lambda event_type, obj, old_obj: events.append((event_type, obj.metadata.name)))
+        fake_watch = FakeWatch([
+            [{'type': 'BOOKMARK', 'object': {'metadata': {'resourceVersion': "11"}},
+              'raw_object': {'metadata': {'resourceVersion': "11"}}}],
+            [{'type': 'MODIFIED', 'object': fake_object("lobby", "12")}, informers.ApiException(status=410)],
+        ], informer)
+
+        with mock.patch.object(informers.watch, 'Watch', fake_watch):
+            informer._list_and_watch()
+
+        self.assertEqual(fake_watch.resource_versions, ["10", "11", "20"])
+        self.assertEqual([obj.metadata.name for obj in informer.list()], ["lobby", "survival"])
+        self.assertEqual(events, [("ADDED", "lobby"), ("ADDED", "creative"), ("MODIFIED", "lobby"),
+                                  ("ADDED", "survival"), ("DELETED", "creative")])
+
+    def test_other_errors_back_off_before_relisting(self):
+        informer = Informer("test", mock.MagicMock(side_effect=informers.ApiException(status=500)))
+        with mock.patch.object(informer._stopped, 'wait', side_effect=lambda timeout: informer.stop()) as wait:
+            informer._list_and_watch()
+        wait.assert_called_once_with(informers.RETRY_BACKOFF_SECONDS)
+        self.assertFalse(informer.has_synced())
+
+
+class ServerFileTests(TestCase):
+    def test_paths_cannot_leave_the_data_volume(self):
+        self.assertEqual(resolve_path("world/level.dat"), f"{DATA_ROOT}/world/level.dat")
+        self.assertEqual(resolve_path("../../etc/passwd"), f"{DATA_ROOT}/etc/passwd")
+        self.assertEqual(resolve_path("/world/../.."), DATA_ROOT)
+        self.assertEqual(resolve_path(None), DATA_ROOT)
+
+    def test_byte_ranges(self):
+        self.assertEqual(_parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(_parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(_parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(_parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(_parse_range("bytes=-5000", 1000), (0, 999))
+        self.assertIsNone(_parse_range(None, 1000))
+        self.assertIsNone(_parse_range("bytes=0-1,5-9", 1000))
+        self.assertIsNone(_parse_range("bytes=abc-", 1000))
+        with self.assertRaises(ValueError):
+            _parse_range("bytes=1000-", 1000)
+        with self.assertRaises(ValueError):
+            _parse_range("bytes=50-10", 1000)
+
+
+class ClusterTests(TestCase):
+    def test_parse_clusters(self):
+        self.assertEqual(parse_clusters(""), {DEFAULT_CLUSTER: None})
+        self.assertEqual(parse_clusters("eu=eu-prod, us ,"), {DEFAULT_CLUSTER: None, 'eu': "eu-prod", 'us': "us"})
+        for value in ("EU=eu-prod", "=eu-prod", "eu_west=eu-prod", "default=other", "eu=eu-prod,eu=eu-dr"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_clusters(value)
+
+    def test_unknown_clusters_are_rejected(self):
+        self.assertIs(get_registry(), registry)
+        with self.assertRaises(ValueError):
+            get_registry("mars")
+        with self.assertRaises(ValueError):
+            get_async_registry("mars")
+
+    @mock.patch('dashboard.views.cluster_names', return_value=[DEFAULT_CLUSTER, "eu"])
+    def test_views_are_routed_by_the_cluster_parameter(self, cluster_names):
+        with mock.patch('dashboard.views.apply_server_action') as apply:
+            self.client.get('/start-server/default/lobby/')
+            self.client.get('/start-server/default/lobby/?cluster=eu')
+            self.assertEqual(self.client.get('/start-server/default/lobby/?cluster=mars').status_code, 404)
+        self.assertEqual(apply.call_args_list, [mock.call("default", "lobby", 'start', DEFAULT_CLUSTER),
+                                                mock.call("default", "lobby", 'start', "eu")])
+
+
+class ClusterConsoleTests(IsolatedAsyncioTestCase):
+    async def connect(self, query):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/k8s-console/default/lobby/{query}")
+        return communicator, await communicator.connect()
+
+    @mock.patch('dashboard.consumers.cluster_names', return_value=[DEFAULT_CLUSTER, "eu"])
+    async def test_consoles_are_routed_by_the_cluster_parameter(self, cluster_names):
+        hub = SimpleNamespace(stream_id="stream", join=mock.AsyncMock(), leave=mock.AsyncMock(),
+                              scrollback=lambda since: (0, 0, b"", False))
+        with mock.patch('dashboard.consumers.console_backend_for', mock.AsyncMock(return_value="rcon")) as backend, \
+                mock.patch('dashboard.consumers.get_console_hub', return_value=hub) as get_hub:
+            communicator, (connected, _) = await self.connect("?cluster=eu")
+            self.assertTrue(connected)
+            await communicator.disconnect()
+
+            communicator, (connected, code) = await self.connect("?cluster=mars")
+            self.assertEqual((connected, code), (False, 4004))
+
+        backend.assert_awaited_once_with("lobby", "default", "eu")
+        get_hub.assert_called_once_with("lobby", "rcon", "default", "eu")
+
+
+class InstrumentationTests(TestCase):
+    def test_requests_are_labelled_by_verb_and_resource(self):
+        self.assertEqual(request_verb_and_resource('GET', '/api/v1/namespaces/default/pods'), ('list', 'pods'))
+        self.assertEqual(request_verb_and_resource('GET', '/apis/apps/v1/statefulsets?watch=True'),
+                         ('watch', 'statefulsets'))
+        self.assertEqual(request_verb_and_resource('PATCH', '/apis/apps/v1/namespaces/default/statefulsets/lobby/scale'),
+                         ('patch', 'statefulsets/scale'))
+        self.assertEqual(request_verb_and_resource('GET', '/api/v1/namespaces/default/pods/lobby-0/exec'),
+                         ('exec', 'pods/exec'))
+
+        api_client = SimpleNamespace(rest_client=SimpleNamespace(request=lambda method, url: SimpleNamespace(status=404)))
+        instrument_api_client(api_client, 'test')
+        api_client.rest_client.request('GET', '/api/v1/nodes/node-1')
+        labels = {'cluster': 'test', 'verb': 'get', 'resource': 'nodes', 'status': '404'}
+        self.assertEqual(REGISTRY.get_sample_value('mindworld_kube_request_duration_seconds_count', labels), 1)
+
+    def test_background_work_runs_in_the_callers_context(self):
+        # The current span is a context variable, this is what keeps worker threads in the view's trace
+        current = contextvars.ContextVar('current')
+        current.set("view span")
+        seen = []
+        restarted = threading.Event()
+
+        def record(*args):
+            seen.append(current.get(None))
+            restarted.set()
+
+        with mock.patch('dashboard.server_actions.apply_server_action', side_effect=record):
+            run_bulk_server_actions([("default", "default", name, 'stop') for name in ("lobby", "creative")])
+        restarted.clear()
+        with mock.patch.object(restart_jobs, '_run', side_effect=record):
+            restart_jobs.start_restart("default", "lobby")
+            self.assertTrue(restarted.wait(5))
+        self.assertEqual(seen, ["view span"] * 3)
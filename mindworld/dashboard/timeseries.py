@@ -0,0 +1,86 @@
+import time
+import threading
+from array import array
+
+
+class _Tier:
+    """Fixed number of buckets of one resolution, reused round-robin."""
+
+    def __init__(self, resolution, size, fields):
+        self.resolution = resolution
+        self.size = size
+        self.buckets = array('q', [-1]) * size
+        self.counts = {field: array('H', [0]) * size for field in fields}
+        self.sums = {field: array('f', [0.0]) * size for field in fields}
+        self.maxes = {field: array('f', [0.0]) * size for field in fields}
+
+    @property
+    def retention(self):
+        return self.resolution * self.size
+
+    def add(self, timestamp, values):
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.size
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            for field in self.counts:
+                self.counts[field][slot] = 0
+                self.sums[field][slot] = 0.0
+                self.maxes[field][slot] = 0.0
+
+        for field, value in values.items():
+            if value is None or field not in self.counts:
+                continue
+            count = self.counts[field][slot]
+            self.maxes[field][slot] = value if count == 0 else max(self.maxes[field][slot], value)
+            self.sums[field][slot] += value
+            self.counts[field][slot] = min(count + 1, 0xFFFF)
+
+    def query(self, start, end):
+        first = max(int(start // self.resolution), int(end // self.resolution) - self.size + 1)
+        series = {field: [] for field in self.counts}
+        for bucket in range(first, int(end // self.resolution) + 1):
+            slot = bucket % self.size
+            if self.buckets[slot] != bucket:
+                continue
+            for field, counts in self.counts.items():
+                count = counts[slot]
+                if count:
+                    series[field].append([bucket * self.resolution,
+                                          round(self.sums[field][slot] / count, 3),
+                                          round(self.maxes[field][slot], 3)])
+        return series
+
+
+class TimeSeries:
+    """Downsampled in-memory time series for a fixed set of fields.
+
+    Every sample is folded into each tier, e.g. 15s buckets for an hour,
+    1 minute buckets for a day and 15 minute buckets for a week. Each bucket
+    keeps the sum, count and maximum per field, so memory use is fixed by the
+    tier sizes and range queries return ``[timestamp, avg, max]`` points.
+    """
+
+    def __init__(self, fields, tiers):
+        self.fields = tuple(fields)
+        self._tiers = [_Tier(resolution, size, self.fields) for resolution, size in sorted(tiers)]
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, values):
+        with self._lock:
+            for tier in self._tiers:
+                tier.add(timestamp, values)
+
+    def query(self, start, end, step=0):
+        """Return ``(resolution, {field: [[ts, avg, max], ...]})`` for ``start..end``.
+
+        Uses the finest tier that is at least ``step`` seconds wide and still
+        holds data from ``start``, or the coarsest tier if none does.
+        """
+        age = time.time() - start
+        for tier in self._tiers:
+            if tier.resolution >= step and age <= tier.retention + tier.resolution:
+                break
+        with self._lock:
+            return tier.resolution, tier.query(start, end)
+
@@ -13,6 +13,17 @@ urlpatterns = [
     path('edit-server/<str:namespace>/<str:name>/', views.edit_server, name='edit_server'),
     path('manage-server/<str:namespace>/<str:name>/<str:action>/', views.manage_server, name='manage_server'),
     path('api/server-status/', views.get_server_status, name='get_server_status'),
+    path('api/servers/bulk/', views.bulk_manage_servers, name='bulk_manage_servers'),
+    path('api/restart-jobs/<str:job_id>/', views.get_restart_status, name='get_restart_status'),
+    path('api/servers/<str:namespace>/<str:name>/metrics/', views.get_server_metrics, name='get_server_metrics'),
+    path('api/servers/<str:namespace>/<str:name>/history/', views.get_server_history, name='get_server_history'),
+    path('api/servers/<str:namespace>/<str:name>/files/', views.server_files, name='server_files'),
+    path('api/servers/<str:namespace>/<str:name>/files/<path:path>', views.server_files, name='server_file'),
+    path('api/servers/<str:namespace>/<str:name>/backups/', views.server_backups, name='server_backups'),
+    path('api/servers/<str:namespace>/<str:name>/backups/<str:snapshot_id>/restore/', views.restore_server_backup, name='restore_server_backup'),
+    path('api/backup-jobs/<str:job_id>/', views.get_backup_status, name='get_backup_status'),
+    path('files/<str:namespace>/<str:name>/', views.server_files_page, name='server_files_page'),
     path('nodes/', views.nodes, name='nodes'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
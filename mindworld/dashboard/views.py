@@ -1,8 +1,38 @@
 import os
+import re
+import json
+import math
+import time
+import asyncio
+import mimetypes
+import posixpath
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .forms import CreateServerForm
-from .server_utils import get_statefulsets_managed_by_mindworld, scale_statefulset, create_or_update_statefulset_and_service
+from .kube_clients import DEFAULT_CLUSTER, cluster_names
+from .server_actions import SERVER_ACTIONS, apply_server_action, find_managed_statefulsets, run_bulk_server_actions
+from .restart_jobs import start_restart, get_restart_job
+from .server_metrics import metrics_collector
+from .placement import plan_placement
+from .warm_pool import provision_server
+from .server_templates import get_template
+from .catalog import server_catalog, list_servers, status_history
+from .backups import BackupError, get_backup_store, list_snapshots, start_backup, start_restore, get_backup_job
+from .files import (
+    FILE_CHUNK_SIZE, FileError, server_pod, stat, list_directory, read_file, read_archive, write_file, extract_archive
+)
+
+SERVER_LIST_PAGE_SIZE = int(os.getenv('SERVER_LIST_PAGE_SIZE', '100'))
+SERVER_LIST_MAX_PAGE_SIZE = 1000
+
+def _cluster(request):
+    """The cluster a request is for (``?cluster=``, default: the default cluster)."""
+    cluster = request.GET.get('cluster') or DEFAULT_CLUSTER
+    if cluster not in cluster_names():
+        raise Http404(f"Unknown cluster {cluster}")
+    return cluster
 
 def home(request):
     return render(request, 'dashboard/dashboard.html')
@@ -16,6 +46,10 @@ def user_login(request):
 def nodes(request):
     return render(request, 'dashboard/nodes.html')
 
+def metrics(request):
+    """Prometheus metrics of this worker process."""
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 def create_server(request):
     if request.method == "POST":
         form = CreateServerForm(request.POST)
@@ -26,8 +60,11 @@ def create_server(request):
                 "MEMORY": str(form.cleaned_data['memory']),
                 "MAX_PLAYERS": str(form.cleaned_data['maxPlayers'])
             }
+            cluster = form.cleaned_data['cluster']
             try:
-                create_or_update_statefulset_and_service(server_name, env_vars)
+                template = get_template(form.cleaned_data['template'])
+                provision_server(server_name, env_vars, plan_placement(env_vars, cluster=cluster), template,
+                                 form.cleaned_data['namespace'], cluster)
                 return redirect('home')  # Redirect to home or a success page after creating the server
             except Exception as e:
                 return HttpResponse(f"Error: {str(e)}", status=500)
@@ -37,24 +74,126 @@ def create_server(request):
     return render(request, 'dashboard/create_server.html', {'form': form})
 
 def start_server(request, namespace, name):
-    scale_statefulset(namespace, name, replicas=1)
+    apply_server_action(namespace, name, 'start', _cluster(request))
     return redirect('home')
 
 def stop_server(request, namespace, name):
-    scale_statefulset(namespace, name, replicas=0)
+    apply_server_action(namespace, name, 'stop', _cluster(request))
     return redirect('home')
 
 def restart_server(request, namespace, name):
-    scale_statefulset(namespace, name, replicas=0)
-    scale_statefulset(namespace, name, replicas=1)
+    start_restart(namespace, name, _cluster(request))
     return redirect('home')
 
+def _bool_param(value):
+    return None if value is None else value.lower() in ('1', 'true', 'yes')
+
 def get_server_status(request):
-    servers = get_statefulsets_managed_by_mindworld()
-    return JsonResponse(servers, safe=False)
+    """List managed servers from the server catalog.
+
+    Filters: ``cluster``, ``namespace``, ``status``, ``hibernated`` and
+    ``prefix`` (name prefix). Paged with ``offset`` and ``limit`` (default
+    SERVER_LIST_PAGE_SIZE, at most SERVER_LIST_MAX_PAGE_SIZE); the number of
+    matching servers is in the X-Total-Count header.
+    """
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+        limit = min(SERVER_LIST_MAX_PAGE_SIZE, max(1, int(request.GET.get('limit', SERVER_LIST_PAGE_SIZE))))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'offset and limit must be integers'}, status=400)
+
+    server_catalog.wait_for_sync()
+    total, servers = list_servers(
+        cluster=request.GET.get('cluster'),
+        namespace=request.GET.get('namespace'),
+        status=request.GET.get('status'),
+        hibernated=_bool_param(request.GET.get('hibernated')),
+        name_prefix=request.GET.get('prefix'),
+        offset=offset,
+        limit=limit
+    )
+    response = JsonResponse(servers, safe=False)
+    response['X-Total-Count'] = total
+    return response
+
+def get_server_history(request, namespace, name):
+    """Return a server's status changes, newest first (``limit``, default 100)."""
+    try:
+        limit = min(SERVER_LIST_MAX_PAGE_SIZE, max(1, int(request.GET.get('limit', 100))))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit must be an integer'}, status=400)
+    cluster = _cluster(request)
+    history = status_history(namespace, name, limit, cluster)
+    if history is None:
+        return JsonResponse({'status': 'error', 'message': 'Unknown server'}, status=404)
+    return JsonResponse({'cluster': cluster, 'namespace': namespace, 'name': name, 'history': history})
+
+def get_restart_status(request, job_id):
+    job = get_restart_job(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Unknown job'}, status=404)
+    return JsonResponse(job.as_dict())
+
+async def server_backups(request, namespace, name):
+    """GET lists a server's snapshots, newest first. POST starts a backup."""
+    cluster = _cluster(request)
+    if request.method == 'POST':
+        job = start_backup(namespace, name, cluster)
+        return JsonResponse({'status': 'accepted', 'job_id': job.id}, status=202)
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=405)
+    try:
+        store = get_backup_store()
+        snapshots = await asyncio.to_thread(list_snapshots, store, namespace, name, cluster)
+    except BackupError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+    return JsonResponse({'cluster': cluster, 'namespace': namespace, 'name': name, 'snapshots': snapshots})
+
+async def restore_server_backup(request, namespace, name, snapshot_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=405)
+    job = start_restore(namespace, name, snapshot_id, _cluster(request))
+    return JsonResponse({'status': 'accepted', 'job_id': job.id}, status=202)
+
+def get_backup_status(request, job_id):
+    job = get_backup_job(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Unknown job'}, status=404)
+    return JsonResponse(job.as_dict())
+
+def get_server_metrics(request, namespace, name):
+    """Return a server's metric history as ``[timestamp, avg, max]`` points per field.
+
+    ``start`` and ``end`` are unix timestamps (default: the last hour) and
+    ``step`` is the smallest bucket width wanted, in seconds.
+    """
+    metrics_collector.start()
+    try:
+        end = float(request.GET.get('end', time.time()))
+        start = float(request.GET.get('start', end - 3600))
+        step = float(request.GET.get('step', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'start, end and step must be numbers'}, status=400)
+    if not all(math.isfinite(value) for value in (start, end, step)):
+        return JsonResponse({'status': 'error', 'message': 'start, end and step must be finite'}, status=400)
+    if start >= end:
+        return JsonResponse({'status': 'error', 'message': 'start must be before end'}, status=400)
+
+    # Only the default cluster is sampled
+    series = metrics_collector.series(namespace, name) if _cluster(request) == DEFAULT_CLUSTER else None
+    if series is None:
+        return JsonResponse({'status': 'error', 'message': 'No metrics for this server'}, status=404)
+    resolution, points = series.query(start, end, step)
+    return JsonResponse({
+        'namespace': namespace,
+        'name': name,
+        'resolution': resolution,
+        'series': points
+    })
 
 def edit_server(request, namespace, name):
     context = {
+        'cluster': _cluster(request),
         'namespace': namespace,
         'deployment_name': name,
     }
@@ -62,12 +201,196 @@ def edit_server(request, namespace, name):
 
 def manage_server(request, namespace, name, action):
     if request.method == 'POST':
-        if action == 'start':
-            scale_statefulset(namespace, name, replicas=1)
-        elif action == 'stop':
-            scale_statefulset(namespace, name, replicas=0)
-        elif action == 'restart':
-            scale_statefulset(namespace, name, replicas=0)
-            scale_statefulset(namespace, name, replicas=1)
+        cluster = _cluster(request)
+        if action == 'restart':
+            job = start_restart(namespace, name, cluster)
+            return JsonResponse({'status': 'accepted', 'action': action, 'job_id': job.id}, status=202)
+        if action in SERVER_ACTIONS:
+            apply_server_action(namespace, name, action, cluster)
         return JsonResponse({'status': 'success', 'action': action})
-    return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
\ No newline at end of file
+    return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+
+def bulk_manage_servers(request):
+    """Apply start/stop/restart to many servers at once.
+
+    Accepts a JSON body with either an explicit list of servers::
+
+        {"servers": [{"namespace": "default", "name": "lobby", "action": "start"}, ...]}
+
+    or a label selector applied to every managed server::
+
+        {"selector": "event=summer", "action": "stop"}
+
+    Servers take an optional ``cluster`` (default: the default cluster). A
+    selector matches servers in every cluster unless ``cluster`` is given.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+
+    try:
+        payload = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    if not isinstance(payload, dict):
+        return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+    servers = payload.get('servers', [])
+    if not isinstance(servers, list) or not all(isinstance(server, dict) for server in servers):
+        return JsonResponse({'status': 'error', 'message': '"servers" must be a list of objects'}, status=400)
+    selector = payload.get('selector')
+    if selector is not None and not isinstance(selector, str):
+        return JsonResponse({'status': 'error', 'message': '"selector" must be a string'}, status=400)
+
+    operations = []
+    for server in servers:
+        operations.append((server.get('cluster', DEFAULT_CLUSTER), server.get('namespace'), server.get('name'),
+                           server.get('action')))
+    if selector is not None:
+        action = payload.get('action')
+        try:
+            matches = find_managed_statefulsets(selector, payload.get('cluster'))
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        operations.extend((cluster, namespace, name, action) for cluster, namespace, name in matches)
+
+    for cluster, namespace, name, action in operations:
+        if cluster not in cluster_names() or not namespace or not name or action not in SERVER_ACTIONS:
+            return JsonResponse({'status': 'error', 'message': f"Invalid operation for {cluster}/{namespace}/{name}: {action}"}, status=400)
+
+    results = run_bulk_server_actions(operations)
+    return JsonResponse({'status': 'success', 'results': results})
+
+
+def server_files_page(request, namespace, name):
+    return render(request, 'dashboard/files.html',
+                  {'cluster': _cluster(request), 'namespace': namespace, 'deployment_name': name})
+
+# Already compressed formats that are not worth gzipping again (.dat is gzipped NBT)
+COMPRESSED_EXTENSIONS = {'.gz', '.tgz', '.zip', '.jar', '.mca', '.mcr', '.dat', '.png', '.jpg', '.zst', '.xz'}
+GZIP_MIN_SIZE = 1024
+
+def _parse_range(header, size):
+    """Return ``(start, end)`` for a single byte range, or None to send everything.
+
+    Raises ValueError if the range cannot be satisfied. Multiple ranges are
+    answered with the whole file, which RFC 9110 allows.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable for {size} bytes")
+    return start, end
+
+def _accepts_gzip(request):
+    return any(coding.split(';')[0].strip() == 'gzip'
+               for coding in request.headers.get('Accept-Encoding', '').split(','))
+
+async def _request_chunks(request):
+    # The body is spooled to a temporary file by the ASGI handler, read it back in chunks
+    while chunk := await asyncio.to_thread(request.read, FILE_CHUNK_SIZE):
+        yield chunk
+
+def _file_response(request, pod, path, entry):
+    size = entry['size']
+    etag = f'"{size:x}-{int(entry["modified"] * 1000):x}"'
+    last_modified = http_date(entry['modified'])
+    content_type = mimetypes.guess_type(entry['name'])[0] or 'application/octet-stream'
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range in (etag, last_modified):
+        try:
+            byte_range = _parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+    compress = (byte_range is None and _accepts_gzip(request) and size >= GZIP_MIN_SIZE
+                and posixpath.splitext(entry['name'])[1].lower() not in COMPRESSED_EXTENSIONS)
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    elif byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_file(pod, path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(read_file(pod, path, compress=compress), content_type=content_type)
+
+    if byte_range is not None:
+        response['Content-Range'] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+        response['Content-Length'] = byte_range[1] - byte_range[0] + 1
+    elif compress:
+        response['Content-Encoding'] = 'gzip'
+        etag = etag[:-1] + '-gzip"'
+    else:
+        response['Content-Length'] = size
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    if 'download' in request.GET:
+        response['Content-Disposition'] = content_disposition_header(True, entry['name'])
+    return response
+
+async def server_files(request, namespace, name, path=''):
+    """Browse and transfer files on a server's data volume.
+
+    GET on a directory lists it as JSON, or streams it as a tarball with
+    ``?archive=tar`` or ``?archive=tar.gz``. GET on a file streams it, with
+    Range support and gzip when the client accepts it. PUT uploads a file
+    (a ``Content-Range`` resumes an upload at that offset) and POST extracts
+    a tar or tar.gz body into the directory.
+    """
+    try:
+        pod = await server_pod(name, namespace, _cluster(request))
+        if request.method in ('GET', 'HEAD'):
+            entry = await stat(pod, path)
+            if entry is None:
+                return JsonResponse({'status': 'error', 'message': 'No such file or directory'}, status=404)
+
+            archive = request.GET.get('archive')
+            if archive:
+                if archive not in ('tar', 'tar.gz'):
+                    return JsonResponse({'status': 'error', 'message': 'archive must be tar or tar.gz'}, status=400)
+                filename = f"{entry['name'] if path.strip('/') else name}.{archive}"
+                response = StreamingHttpResponse(read_archive(pod, path, compress=archive == 'tar.gz'),
+                                                 content_type='application/gzip' if archive == 'tar.gz' else 'application/x-tar')
+                response['Content-Disposition'] = content_disposition_header(True, filename)
+                return response
+            if entry['type'] == 'directory':
+                return JsonResponse({'path': path.strip('/'), 'entries': await list_directory(pod, path)})
+            return _file_response(request, pod, path, entry)
+
+        if request.method not in ('PUT', 'POST'):
+            return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=405)
+        try:
+            size = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'Content-Length is required'}, status=411)
+
+        if request.method == 'POST':
+            compressed = (request.content_type in ('application/gzip', 'application/x-gzip')
+                          or request.headers.get('Content-Encoding') == 'gzip')
+            await extract_archive(pod, path, _request_chunks(request), size, compressed)
+            return JsonResponse({'status': 'success', 'path': path.strip('/')})
+
+        offset = None
+        content_range = request.headers.get('Content-Range')
+        if content_range:
+            match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range.strip())
+            if not match or int(match.group(2)) - int(match.group(1)) + 1 != size:
+                return JsonResponse({'status': 'error', 'message': 'Invalid Content-Range'}, status=400)
+            offset = int(match.group(1))
+        await write_file(pod, path, _request_chunks(request), size, offset)
+        return JsonResponse({'status': 'success', 'path': path.strip('/'), 'size': size}, status=201)
+    except FileError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
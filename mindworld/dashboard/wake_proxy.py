@@ -0,0 +1,257 @@
+"""TCP proxy in front of the server Services that wakes hibernated servers.
+
+Players connect to the proxy instead of ``<name>-service``. The proxy reads
+the Minecraft handshake, picks the server from the address the player typed
+(``<name>.<WAKE_PROXY_DOMAIN>``, or WAKE_PROXY_DEFAULT_SERVER) and then just
+pipes bytes to the server's Service. If the server is hibernated:
+
+* server list pings get a "sleeping" status without waking it,
+* a login scales it back up and holds the player until it is ready, or
+  disconnects them with a "starting" message if that takes too long.
+"""
+import os
+import json
+import asyncio
+import logging
+from .async_server_utils import scale_statefulset, set_hibernated
+from .server_utils import NAMESPACE, get_statefulset_informer, is_hibernated, is_managed_by_mindworld, wait_for_cache
+
+logger = logging.getLogger(__name__)
+
+WAKE_PROXY_PORT = int(os.getenv('WAKE_PROXY_PORT', '25565'))
+WAKE_PROXY_DOMAIN = os.getenv('WAKE_PROXY_DOMAIN', '')
+WAKE_PROXY_DEFAULT_SERVER = os.getenv('WAKE_PROXY_DEFAULT_SERVER', '')
+# How long a login is held while its server starts. Clients give up after ~30s.
+WAKE_HOLD_SECONDS = float(os.getenv('WAKE_HOLD_SECONDS', '25'))
+# How long the proxy keeps waiting for a woken server before giving up on it.
+WAKE_TIMEOUT = float(os.getenv('WAKE_TIMEOUT', '600'))
+HANDSHAKE_TIMEOUT = 10
+SERVER_PORT = 25565
+
+STATE_STATUS = 1
+MAX_PACKET_LENGTH = 2 ** 21
+
+
+class HandshakeError(Exception):
+    pass
+
+
+def encode_varint(value):
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data, offset=0):
+    """Return ``(value, next_offset)`` for the VarInt at ``offset``."""
+    value = 0
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            raise HandshakeError("Truncated VarInt")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+    raise HandshakeError("VarInt too long")
+
+
+async def read_varint(reader, raw):
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        raw.append(byte)
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise HandshakeError("VarInt too long")
+
+
+async def read_packet(reader, raw=None):
+    """Read one uncompressed packet and return ``(packet_id, payload)``."""
+    raw = bytearray() if raw is None else raw
+    length = await read_varint(reader, raw)
+    if length <= 0 or length > MAX_PACKET_LENGTH:
+        raise HandshakeError(f"Bad packet length {length}")
+    body = await reader.readexactly(length)
+    raw.extend(body)
+    packet_id, offset = decode_varint(body)
+    return packet_id, body[offset:]
+
+
+def encode_packet(packet_id, payload=b''):
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+def encode_string(text):
+    data = text.encode('utf-8')
+    return encode_varint(len(data)) + data
+
+
+class Handshake:
+    def __init__(self, raw, protocol, address, next_state):
+        self.raw = bytes(raw)
+        self.protocol = protocol
+        self.address = address
+        self.next_state = next_state
+
+    @classmethod
+    async def read(cls, reader):
+        raw = bytearray()
+        packet_id, payload = await read_packet(reader, raw)
+        if packet_id != 0:
+            raise HandshakeError(f"Expected a handshake, got packet {packet_id:#x}")
+        protocol, offset = decode_varint(payload)
+        length, offset = decode_varint(payload, offset)
+        address = payload[offset:offset + length].decode('utf-8', errors='replace')
+        offset += length + 2  # server port
+        next_state, _ = decode_varint(payload, offset)
+        # Forge appends "\0FML\0" markers, and some clients keep a trailing dot
+        address = address.split('\0', 1)[0].rstrip('.').lower()
+        return cls(raw, protocol, address, next_state)
+
+
+def route(address, domain=WAKE_PROXY_DOMAIN, default=WAKE_PROXY_DEFAULT_SERVER):
+    """Map the address a player connected to onto a server name."""
+    if domain and address.endswith('.' + domain):
+        name = address[:-len(domain) - 1]
+        if name and '.' not in name:
+            return name
+    return default or None
+
+
+class WakeProxy:
+    """Route players to servers, reading server state from the StatefulSet cache."""
+
+    def __init__(self, port=WAKE_PROXY_PORT):
+        self.port = port
+        self._waking = {}
+        self._statefulsets = None
+
+    async def serve(self):
+        self._statefulsets = await asyncio.to_thread(get_statefulset_informer)
+        await asyncio.to_thread(wait_for_cache, self._statefulsets)
+        server = await asyncio.start_server(self._handle, port=self.port)
+        logger.info(f"Wake proxy listening on port {self.port}.")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            handshake = await asyncio.wait_for(Handshake.read(reader), HANDSHAKE_TIMEOUT)
+        except (HandshakeError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Dropping connection without a valid handshake: {e}")
+            writer.close()
+            return
+
+        try:
+            name = route(handshake.address)
+            if name is None:
+                await self._refuse(reader, writer, handshake, "Unknown server.")
+                return
+            if not await self._ensure_ready(reader, writer, handshake, name):
+                return
+            await self._pipe(reader, writer, handshake, name)
+        except Exception as e:
+            logger.error(f"Error proxying {handshake.address}: {e}")
+        finally:
+            writer.close()
+
+    async def _ensure_ready(self, reader, writer, handshake, name):
+        """Return True once ``name`` can take the connection, answering the client otherwise."""
+        sts = self._statefulsets.get(f"{NAMESPACE}/{name}")
+        if sts is None or not is_managed_by_mindworld(sts):
+            await self._refuse(reader, writer, handshake, "Unknown server.")
+            return False
+        if sts.status.ready_replicas:
+            return True
+
+        hibernated = is_hibernated(sts)
+        if not hibernated and not sts.spec.replicas:
+            await self._refuse(reader, writer, handshake, "This server is stopped.")
+            return False
+        if handshake.next_state == STATE_STATUS:
+            # Refreshing the server list must not wake anything
+            message = "Sleeping, join to wake it up." if hibernated else "Starting up..."
+            await self._send_status(reader, writer, handshake, message)
+            return False
+
+        waking = self._waking.get(name)
+        if waking is None:
+            waking = self._waking[name] = asyncio.ensure_future(self._wake(name, hibernated))
+            waking.add_done_callback(lambda _: self._waking.pop(name, None))
+        try:
+            if await asyncio.wait_for(asyncio.shield(waking), WAKE_HOLD_SECONDS):
+                return True
+        except asyncio.TimeoutError:
+            pass
+        await self._refuse(reader, writer, handshake, "The server is starting, reconnect in a moment.")
+        return False
+
+    async def _wake(self, name, hibernated):
+        if hibernated:
+            logger.info(f"Waking hibernated server {name} for a player.")
+            if not await scale_statefulset(NAMESPACE, name, 1):
+                return False
+            await set_hibernated(NAMESPACE, name, False)
+
+        deadline = asyncio.get_running_loop().time() + WAKE_TIMEOUT
+        while asyncio.get_running_loop().time() < deadline:
+            sts = self._statefulsets.get(f"{NAMESPACE}/{name}")
+            if sts is not None and sts.status.ready_replicas:
+                return True
+            await asyncio.sleep(1)
+        logger.warning(f"Server {name} was not ready {WAKE_TIMEOUT} seconds after waking.")
+        return False
+
+    async def _refuse(self, reader, writer, handshake, message):
+        if handshake.next_state == STATE_STATUS:
+            await self._send_status(reader, writer, handshake, message)
+            return
+        # Login start: answer with a login disconnect carrying the message
+        writer.write(encode_packet(0x00, encode_string(json.dumps({"text": message}))))
+        await writer.drain()
+
+    async def _send_status(self, reader, writer, handshake, message):
+        status = {
+            "version": {"name": "mindworld", "protocol": handshake.protocol},
+            "players": {"max": 0, "online": 0},
+            "description": {"text": message}
+        }
+        try:
+            packet_id, _ = await asyncio.wait_for(read_packet(reader), HANDSHAKE_TIMEOUT)
+            if packet_id != 0x00:
+                return
+            writer.write(encode_packet(0x00, encode_string(json.dumps(status))))
+            await writer.drain()
+            packet_id, payload = await asyncio.wait_for(read_packet(reader), HANDSHAKE_TIMEOUT)
+            if packet_id == 0x01:
+                writer.write(encode_packet(0x01, payload))
+                await writer.drain()
+        except (HandshakeError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+
+    async def _pipe(self, reader, writer, handshake, name):
+        upstream_reader, upstream_writer = await asyncio.wait_for(
+            asyncio.open_connection(f"{name}-service.{NAMESPACE}.svc", SERVER_PORT), HANDSHAKE_TIMEOUT)
+        upstream_writer.write(handshake.raw)
+
+        async def copy(source, destination):
+            try:
+                while data := await source.read(65536):
+                    destination.write(data)
+                    await destination.drain()
+            except ConnectionError:
+                pass
+            finally:
+                destination.close()
+
+        await asyncio.gather(copy(reader, upstream_writer), copy(upstream_reader, writer))
@@ -0,0 +1,416 @@
+"""Warm pool of pre-provisioned server volumes.
+
+Most of the time to a playable new server goes to binding a fresh volume,
+pulling the image onto the node and downloading the server jar. The pool
+keeps WARM_POOL members per template that have already done all of that:
+each member is a StatefulSet that runs the image once with SETUP_ONLY and is
+then parked at zero replicas, keeping its bound volume.
+
+Creating a server claims a parked member of its template. The claim the
+new server's StatefulSet would create (``minecraft-data-<name>-0``) is
+created up front, asking for the member's PersistentVolume, and the server
+prefers the node the image was pulled on, so it starts straight into the
+JVM boot once the volume is handed over. The hand-over runs in the
+background; until it is done the claim, and with it the server's pod, stays
+pending. A StatefulSet cannot be renamed, so the member itself is deleted;
+only its volume moves. The pool is kept full by ``manage.py warm_pool``,
+which also cleans up after hand-overs that never finished.
+
+Members are annotated ``managed-by: mindworld-pool`` and carry no app
+label, so they never show up as servers.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from kubernetes.client.rest import ApiException
+from .kube_clients import DEFAULT_CLUSTER, registry
+from .server_templates import DEFAULT_SERVER_TEMPLATE, TEMPLATE_VERSION_ANNOTATION, get_template
+from .server_utils import (
+    NAMESPACE, SERVER_LABEL, build_statefulset_manifest, create_or_update_statefulset_and_service, get_pod_name,
+    scale_statefulset, server_labels, server_resources
+)
+
+logger = logging.getLogger(__name__)
+
+# Parked members per template, e.g. "vanilla=2,paper=1". Empty turns the pool off.
+WARM_POOL = os.getenv('WARM_POOL', '')
+WARM_POOL_INTERVAL = float(os.getenv('WARM_POOL_INTERVAL', '30'))
+# Heap the setup run gets; only installers (Forge) need much.
+WARM_POOL_MEMORY = os.getenv('WARM_POOL_MEMORY', '512M')
+# Members left "claimed" (and server claims left pending) this long were abandoned by a failed hand-over.
+WARM_POOL_CLAIM_TIMEOUT = 600
+# How long a hand-over waits for the member's volume claim to be deleted.
+VOLUME_RELEASE_TIMEOUT = 60
+
+WARM_POOL_PREFIX = 'mindworld-pool'
+POOL_MANAGED_BY = 'mindworld-pool'
+# Template name on member StatefulSets; member name on their pods.
+POOL_LABEL = 'mindworld/pool'
+POOL_MEMBER_LABEL = 'mindworld/pool-member'
+# Member whose volume a new server's data claim is waiting for.
+POOL_CLAIM_LABEL = 'mindworld/pool-claim'
+# "warming" while the setup runs, "ready" once parked, "claimed" while being handed over.
+POOL_STATE_ANNOTATION = 'mindworld/pool-state'
+POOL_NODE_ANNOTATION = 'mindworld/pool-node'
+POOL_CLAIMED_AT_ANNOTATION = 'mindworld/pool-claimed-at'
+# Reclaim policy of a volume while it is kept (Retain) for a hand-over.
+POOL_RECLAIM_POLICY_ANNOTATION = 'mindworld/pool-reclaim-policy'
+
+MERGE_PATCH = 'application/merge-patch+json'
+
+
+def parse_pool_sizes(value):
+    """Parse WARM_POOL into ``{template name: size}``."""
+    sizes = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, _, size = entry.partition('=')
+        get_template(name.strip())
+        sizes[name.strip()] = int(size or 1)
+    return sizes
+
+
+def pool_member_name(template_name, index):
+    return f"{WARM_POOL_PREFIX}-{template_name}-{index}"
+
+
+def data_claim_name(statefulset_name):
+    """Name of the data volume claim the StatefulSet creates for its pod."""
+    return f"minecraft-data-{statefulset_name}-0"
+
+
+def build_pool_manifest(name, template):
+    """StatefulSet of a pool member: the server image, run once with SETUP_ONLY."""
+    env_vars = {"EULA": "TRUE", "MEMORY": WARM_POOL_MEMORY, "SETUP_ONLY": "TRUE"}
+    manifest = build_statefulset_manifest(name, env_vars, template=template)
+    labels = {POOL_MEMBER_LABEL: name}
+    manifest["metadata"]["labels"] = {POOL_LABEL: template.name}
+    manifest["metadata"]["annotations"].update({"managed-by": POOL_MANAGED_BY, POOL_STATE_ANNOTATION: "warming"})
+    manifest["spec"]["selector"] = {"matchLabels": labels}
+    pod_template = manifest["spec"]["template"]
+    pod_template["metadata"] = {"labels": labels}
+
+    container = pod_template["spec"]["containers"][0]
+    # The setup downloads the server into /data and exits; the marker makes the pod ready
+    container["command"] = ["/bin/sh", "-c", "/start && touch /tmp/warm-pool-ready && exec sleep infinity"]
+    container["env"] = [{"name": key, "value": str(value)}
+                        for key, value in template.env_vars(env_vars).items()]
+    container["ports"] = [{"containerPort": 25565}]
+    container["resources"] = server_resources(env_vars)
+    container["readinessProbe"] = {
+        "exec": {"command": ["test", "-f", "/tmp/warm-pool-ready"]},
+        "periodSeconds": 5
+    }
+    del container["livenessProbe"]
+    return manifest
+
+
+def warm_node_placement(node, placement=None):
+    """``placement`` with the node affinity replaced by a preference for ``node``."""
+    placement = dict(placement or {})
+    placement["affinity"] = {
+        "nodeAffinity": {
+            "preferredDuringSchedulingIgnoredDuringExecution": [{
+                "weight": 100,
+                "preference": {
+                    "matchFields": [{"key": "metadata.name", "operator": "In", "values": [node]}]
+                }
+            }]
+        }
+    }
+    return placement
+
+
+def _state(sts):
+    return (sts.metadata.annotations or {}).get(POOL_STATE_ANNOTATION)
+
+
+def _wait_deleted(read, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            read()
+        except ApiException as e:
+            if e.status == 404:
+                return
+            raise
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Not deleted within {timeout} seconds.")
+        time.sleep(0.5)
+
+
+class WarmPool:
+    """Keep parked members for each template in ``sizes`` and hand them out."""
+
+    def __init__(self, sizes, interval=WARM_POOL_INTERVAL):
+        self.sizes = sizes
+        self.interval = interval
+
+    def run(self):
+        """Reconcile the pool every ``interval`` seconds, forever."""
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling the warm pool: {e}")
+            time.sleep(self.interval)
+
+    def _members(self, template_name=None):
+        selector = f"{POOL_LABEL}={template_name}" if template_name else POOL_LABEL
+        return registry.apps_api().list_namespaced_stateful_set(NAMESPACE, label_selector=selector).items
+
+    def reconcile(self):
+        """Park warmed members, drop outdated ones and create what is missing.
+
+        Member names are fixed (template and index), so workers running this
+        at the same time cannot overfill the pool.
+        """
+        self._abandon_stale_claims()
+        members = {sts.metadata.name: sts for sts in self._members()}
+        wanted = {pool_member_name(name, index): get_template(name)
+                  for name, size in self.sizes.items() for index in range(size)}
+
+        for name, sts in members.items():
+            template = wanted.get(name)
+            version = (sts.metadata.annotations or {}).get(TEMPLATE_VERSION_ANNOTATION)
+            if _state(sts) == "claimed":
+                claimed_at = float((sts.metadata.annotations or {}).get(POOL_CLAIMED_AT_ANNOTATION, 0))
+                if time.time() - claimed_at > WARM_POOL_CLAIM_TIMEOUT:
+                    logger.warning(f"Removing warm pool member {name} left behind by a failed claim.")
+                    self._discard(name)
+            elif template is None or version != str(template.version):
+                logger.info(f"Removing warm pool member {name}, it is no longer wanted or outdated.")
+                self._discard(name)
+            elif _state(sts) == "warming" and sts.status.ready_replicas:
+                self._park(sts)
+
+        core_api = registry.core_api()
+        for name, template in wanted.items():
+            if name in members:
+                continue
+            try:
+                claim = core_api.read_namespaced_persistent_volume_claim(data_claim_name(name), NAMESPACE)
+                if claim.metadata.deletion_timestamp:
+                    continue
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+            try:
+                registry.apps_api().create_namespaced_stateful_set(NAMESPACE, build_pool_manifest(name, template))
+                logger.info(f"Warming pool member {name}.")
+            except ApiException as e:
+                if e.status != 409:
+                    logger.error(f"Error creating warm pool member {name}: {e}")
+
+    def _park(self, sts):
+        """Record where a warmed member ran and scale it to zero."""
+        name = sts.metadata.name
+        node = registry.core_api().read_namespaced_pod(get_pod_name(name), NAMESPACE).spec.node_name
+        registry.apps_api().patch_namespaced_stateful_set(name, NAMESPACE, {"metadata": {"annotations": {
+            POOL_STATE_ANNOTATION: "ready", POOL_NODE_ANNOTATION: node
+        }}})
+        scale_statefulset(NAMESPACE, name, 0)
+        logger.info(f"Warm pool member {name} is ready on {node}.")
+
+    def _discard(self, name):
+        for delete in (lambda: registry.apps_api().delete_namespaced_stateful_set(name, NAMESPACE),
+                       lambda: registry.core_api().delete_namespaced_persistent_volume_claim(data_claim_name(name),
+                                                                                             NAMESPACE)):
+            try:
+                delete()
+            except ApiException as e:
+                if e.status != 404:
+                    logger.error(f"Error removing warm pool member {name}: {e}")
+
+    def _mark_claimed(self, sts):
+        """Claim a member, failing if another worker changed it first."""
+        try:
+            registry.apps_api().patch_namespaced_stateful_set(sts.metadata.name, NAMESPACE, {"metadata": {
+                "resourceVersion": sts.metadata.resource_version,
+                "annotations": {POOL_STATE_ANNOTATION: "claimed", POOL_CLAIMED_AT_ANNOTATION: str(int(time.time()))}
+            }}, _content_type=MERGE_PATCH)
+            return True
+        except ApiException as e:
+            if e.status != 409:
+                raise
+            return False
+
+    def claim(self, name, template):
+        """Reserve a parked member's volume for server ``name`` and hand it over in the background.
+
+        Returns the node the member was warmed on, or None if no member of
+        ``template`` was available.
+        """
+        if template.name not in self.sizes:
+            return None
+        for sts in self._members(template.name):
+            annotations = sts.metadata.annotations or {}
+            if (_state(sts) != "ready" or sts.spec.replicas or sts.status.replicas
+                    or annotations.get(TEMPLATE_VERSION_ANNOTATION) != str(template.version)):
+                continue
+            if self._mark_claimed(sts):
+                break
+        else:
+            return None
+
+        member = sts.metadata.name
+        try:
+            self._reserve_volume(member, name)
+        except Exception as e:
+            logger.error(f"Could not reserve the volume of warm pool member {member} for {name}: {e}")
+            self._discard(member)
+            return None
+        threading.Thread(target=contextvars.copy_context().run, args=(self._hand_over, member, name),
+                         name=f"warm-pool-{name}", daemon=True).start()
+        logger.info(f"Server {name} claimed warm pool member {member}.")
+        return annotations.get(POOL_NODE_ANNOTATION)
+
+    def _reserve_volume(self, member, name):
+        """Create the data claim of server ``name``, asking for the member's volume.
+
+        The claim stays pending while the volume is still bound to the
+        member, and so does the server's pod, which needs it.
+        """
+        claim = registry.core_api().read_namespaced_persistent_volume_claim(data_claim_name(member), NAMESPACE)
+        registry.core_api().create_namespaced_persistent_volume_claim(NAMESPACE, {
+            "apiVersion": "v1",
+            "kind": "PersistentVolumeClaim",
+            "metadata": {"name": data_claim_name(name), "labels": {**server_labels(name), POOL_CLAIM_LABEL: member}},
+            "spec": {
+                "accessModes": claim.spec.access_modes,
+                "storageClassName": claim.spec.storage_class_name,
+                "resources": {"requests": {"storage": claim.spec.resources.requests["storage"]}},
+                "volumeName": claim.spec.volume_name
+            }
+        })
+
+    def _hand_over(self, member, name):
+        try:
+            self._transfer_volume(member, name)
+        except Exception as e:
+            logger.error(f"Could not hand warm pool member {member} over to {name}: {e}")
+            self._abandon(member, name)
+            return
+        logger.info(f"Handed the volume of warm pool member {member} over to {name}.")
+
+    def _transfer_volume(self, member, name):
+        """Rebind the member's PersistentVolume to the data claim of server ``name``.
+
+        The volume is kept (Retain) while its claim is deleted, and pre-bound
+        to the new claim so no other claim can take it in between. If that
+        fails the original reclaim policy is put back, so the volume is not
+        left behind once nothing claims it.
+        """
+        core_api = registry.core_api()
+        apps_api = registry.apps_api()
+        volume_name = core_api.read_namespaced_persistent_volume_claim(data_claim_name(member),
+                                                                       NAMESPACE).spec.volume_name
+        reclaim_policy = core_api.read_persistent_volume(volume_name).spec.persistent_volume_reclaim_policy
+
+        core_api.patch_persistent_volume(volume_name, {
+            "metadata": {"annotations": {POOL_RECLAIM_POLICY_ANNOTATION: reclaim_policy}},
+            "spec": {"persistentVolumeReclaimPolicy": "Retain"}
+        }, _content_type=MERGE_PATCH)
+        try:
+            apps_api.delete_namespaced_stateful_set(member, NAMESPACE)
+            core_api.delete_namespaced_persistent_volume_claim(data_claim_name(member), NAMESPACE)
+            _wait_deleted(lambda: core_api.read_namespaced_persistent_volume_claim(data_claim_name(member),
+                                                                                   NAMESPACE),
+                          VOLUME_RELEASE_TIMEOUT)
+            core_api.patch_persistent_volume(volume_name, {"spec": {"claimRef": {
+                "apiVersion": "v1",
+                "kind": "PersistentVolumeClaim",
+                "namespace": NAMESPACE,
+                "name": data_claim_name(name),
+                "uid": None,
+                "resourceVersion": None
+            }}}, _content_type=MERGE_PATCH)
+        except Exception:
+            self._restore_reclaim_policy(volume_name)
+            raise
+        self._restore_reclaim_policy(volume_name)
+
+    def _restore_reclaim_policy(self, volume_name):
+        """Put back the reclaim policy a hand-over replaced with Retain."""
+        core_api = registry.core_api()
+        try:
+            volume = core_api.read_persistent_volume(volume_name)
+            reclaim_policy = (volume.metadata.annotations or {}).get(POOL_RECLAIM_POLICY_ANNOTATION)
+            if reclaim_policy:
+                core_api.patch_persistent_volume(volume_name, {
+                    "metadata": {"annotations": {POOL_RECLAIM_POLICY_ANNOTATION: None}},
+                    "spec": {"persistentVolumeReclaimPolicy": reclaim_policy}
+                }, _content_type=MERGE_PATCH)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error(f"Could not restore the reclaim policy of volume {volume_name}: {e}")
+
+    def _abandon(self, member, name):
+        """Give up on a hand-over: drop the member and start server ``name`` on a fresh volume."""
+        core_api = registry.core_api()
+        try:
+            claim = core_api.read_namespaced_persistent_volume_claim(data_claim_name(name), NAMESPACE)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error(f"Error reading the data claim of {name}: {e}")
+                return
+            claim = None
+        if claim is not None:
+            if claim.status.phase != 'Pending':
+                return
+            if claim.spec.volume_name:
+                self._restore_reclaim_policy(claim.spec.volume_name)
+        self._discard(member)
+        if claim is None:
+            return
+        try:
+            core_api.delete_namespaced_persistent_volume_claim(data_claim_name(name), NAMESPACE)
+            # The StatefulSet creates a fresh claim for the pod that replaces this one
+            core_api.delete_namespaced_pod(get_pod_name(name), NAMESPACE)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error(f"Error moving {name} off warm pool member {member}: {e}")
+
+    def _abandon_stale_claims(self):
+        """Abandon hand-overs whose claim is still pending after WARM_POOL_CLAIM_TIMEOUT."""
+        claims = registry.core_api().list_namespaced_persistent_volume_claim(NAMESPACE,
+                                                                             label_selector=POOL_CLAIM_LABEL).items
+        for claim in claims:
+            age = time.time() - claim.metadata.creation_timestamp.timestamp()
+            if claim.status.phase == 'Pending' and age > WARM_POOL_CLAIM_TIMEOUT:
+                member, name = claim.metadata.labels[POOL_CLAIM_LABEL], claim.metadata.labels[SERVER_LABEL]
+                logger.warning(f"Volume hand-over from warm pool member {member} to {name} never finished.")
+                self._abandon(member, name)
+
+
+def _is_new_server(name):
+    """True if neither the StatefulSet nor a data volume of ``name`` exists."""
+    for read in (lambda: registry.apps_api().read_namespaced_stateful_set(name, NAMESPACE),
+                 lambda: registry.core_api().read_namespaced_persistent_volume_claim(data_claim_name(name), NAMESPACE)):
+        try:
+            read()
+            return False
+        except ApiException as e:
+            if e.status != 404:
+                raise
+    return True
+
+
+def provision_server(name, env_vars, placement=None, template=None, namespace=NAMESPACE, cluster=DEFAULT_CLUSTER):
+    """Create or update a server, starting a new one on a warm pool volume when one is parked.
+
+    The pool only lives in the default cluster's NAMESPACE; servers elsewhere are created cold.
+    """
+    template = template or get_template(DEFAULT_SERVER_TEMPLATE)
+    pooled = namespace == NAMESPACE and cluster == DEFAULT_CLUSTER
+    if pooled and warm_pool.sizes and _is_new_server(name):
+        node = warm_pool.claim(name, template)
+        if node:
+            placement = warm_node_placement(node, placement)
+    create_or_update_statefulset_and_service(name, env_vars, placement, template, namespace, cluster)
+
+
+warm_pool = WarmPool(parse_pool_sizes(WARM_POOL))
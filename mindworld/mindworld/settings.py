@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,13 +44,32 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'mindworld.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# "memory" only reaches consumers in the same process. Use "redis" when running
+# more than one ASGI worker or pod so group broadcasts reach every websocket.
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'memory')
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [os.getenv('REDIS_URL', 'redis://localhost:6379/0')],
+                "prefix": os.getenv('CHANNEL_LAYER_PREFIX', 'mindworld'),
+                # Messages queued per websocket before new ones are dropped
+                "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', '100')),
+                "expiry": int(os.getenv('CHANNEL_LAYER_EXPIRY', '60')),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 MIDDLEWARE = [
+    'dashboard.instrumentation.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',